@@ -104,6 +104,35 @@ def create_app(config_name=None):
     app.audit_log_service = AuditLogService(app=app)
     app.logger.info("AuditLogService initialized and attached to app.")
 
+    from .services.catalog_cache_service import CatalogCacheService
+    app.catalog_cache = CatalogCacheService(app=app)
+
+    from .services.product_search_service import ProductSearchService, rebuild_search_index_command
+    app.product_search_service = ProductSearchService(app=app)
+    app.cli.add_command(rebuild_search_index_command)
+
+    from .services.static_json_service import StaticJsonRegenerationService
+    app.static_json_service = StaticJsonRegenerationService(app=app)
+
+    from .services.asset_job_service import asset_worker_command
+    app.cli.add_command(asset_worker_command)
+
+    from .services.inventory_import_service import InventoryImportService, run_import_job_command
+    app.inventory_import_service = InventoryImportService(app=app)
+    app.cli.add_command(run_import_job_command)
+
+    from .services.stock_reservation_service import sweep_reservations_command
+    app.cli.add_command(sweep_reservations_command)
+
+    from .services.stock_allocation_service import allocate_orders_command
+    app.cli.add_command(allocate_orders_command)
+
+    from .services.asset_store_service import gc_assets_command
+    app.cli.add_command(gc_assets_command)
+
+    from .database import register_db_commands
+    register_db_commands(app)
+
     # Import and register models here so Flask-Migrate can find them
     from . import models 
 
@@ -195,6 +224,9 @@ def create_app(config_name=None):
         elif filepath.startswith('passports/'):
             base_serve_path = os.path.join(app.config['ASSET_STORAGE_PATH'], 'passports')
             actual_filename = filepath[len('passports/'):]
+        elif filepath.startswith('cas/passports/'): # Passports in the content-addressed asset store
+            base_serve_path = os.path.join(app.config['ASSET_STORAGE_PATH'], 'cas', 'passports')
+            actual_filename = filepath[len('cas/passports/'):]
             
         if base_serve_path:
             # Further protection against path traversal using os.path.normpath and os.path.join
@@ -205,6 +237,13 @@ def create_app(config_name=None):
                 return flask_abort(404)
             if os.path.exists(requested_path_full) and os.path.isfile(requested_path_full):
                 app.logger.debug(f"Serving public asset: {actual_filename} from {base_serve_path}")
+                # Passports are written pre-gzipped (PASSPORT_PRECOMPRESS); send that copy to clients that accept it.
+                if filepath.startswith(('passports/', 'cas/passports/')) and 'gzip' in request.headers.get('Accept-Encoding', '') \
+                        and os.path.isfile(f"{requested_path_full}.gz"):
+                    response = send_from_directory(base_serve_path, f"{actual_filename}.gz", mimetype='text/html')
+                    response.headers['Content-Encoding'] = 'gzip'
+                    response.headers['Vary'] = 'Accept-Encoding'
+                    return response
                 return send_from_directory(base_serve_path, actual_filename)
             
         app.logger.warning(f"Public asset not found or path not recognized: {filepath}")
@@ -16,6 +16,7 @@ def serve_asset(asset_relative_path):
         return flask_abort(404)
 
     asset_type_map = {
+        'cas': os.path.join(current_app.config['ASSET_STORAGE_PATH'], 'cas'), # Content-addressed asset store (see AssetStore)
         'qr_codes': current_app.config['QR_CODE_FOLDER'],
         'labels': current_app.config['LABEL_FOLDER'],
         'invoices': current_app.config['INVOICE_PDF_PATH'],
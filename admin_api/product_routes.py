@@ -17,7 +17,7 @@ from ..models import (
 )
 from ..utils import (
     admin_required, generate_slug, allowed_file,
-    get_file_extension, generate_static_json_files, sanitize_input
+    get_file_extension, sanitize_input
 )
 
 # --- Helper Function for Localization ---
@@ -97,9 +97,10 @@ def create_category():
 
     try:
         db.session.add(new_category)
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
         audit_logger.log_action(user_id=current_admin_id, action='create_category_success', target_type='category', target_id=new_category.id, details=f"Category '{name}' created.", status='success')
-        generate_static_json_files()
+        current_app.static_json_service.request_regeneration(category_ids=[new_category.id])
         return jsonify(message="Category created successfully", category=new_category.to_dict(), success=True), 201
     except Exception as e:
         db.session.rollback()
@@ -159,7 +160,7 @@ def update_category(category_id):
         return jsonify(message="Category code already exists.", success=False), 409
 
     new_slug = generate_slug(name)
-    if new_slug != category.slug and Category.query.filter_by(slug=new_slug, id!=category_id).first():
+    if new_slug != category.slug and Category.query.filter(Category.slug == new_slug, Category.id != category_id).first():
         return jsonify(message=f"Category name (slug: '{new_slug}') already exists.", success=False), 409
 
     if remove_image and category.image_url:
@@ -186,9 +187,10 @@ def update_category(category_id):
     category.is_active = str(data.get('is_active')).lower() == 'true'
 
     try:
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
         audit_logger.log_action(user_id=current_admin_id, action='update_category_success', target_type='category', target_id=category_id, details=f"Category '{name}' updated.", status='success')
-        generate_static_json_files()
+        current_app.static_json_service.request_regeneration(category_ids=[category_id])
         return jsonify(message="Category updated successfully.", category=category.to_dict(), success=True), 200
     except Exception as e:
         db.session.rollback()
@@ -216,9 +218,10 @@ def delete_category(category_id):
 
     try:
         db.session.delete(category)
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
         audit_logger.log_action(user_id=current_admin_id, action='delete_category_success', target_type='category', target_id=category_id, details=f"Category '{category_name_log}' deleted.", status='success')
-        generate_static_json_files()
+        current_app.static_json_service.request_regeneration(category_ids=[category_id])
         return jsonify(message=f"Category '{category_name_log}' deleted successfully.", success=True), 200
     except Exception as e:
         db.session.rollback()
@@ -232,18 +235,28 @@ def get_products_admin():
     include_variants = request.args.get('include_variants', 'false').lower() == 'true'
     try:
         products_models = Product.query.order_by(Product.name).all()
+        variant_counts = dict(
+            db.session.query(ProductWeightOption.product_id, func.count(ProductWeightOption.id))
+            .group_by(ProductWeightOption.product_id).all()
+        )
+        # Localizations (and variants, if requested) of the whole listing in one query each
+        localizations = {loc.product_id: loc for loc in ProductLocalization.query.filter_by(lang_code='fr')}
+        variants_by_product = {}
+        if include_variants:
+            for option in ProductWeightOption.query.order_by(ProductWeightOption.product_id, ProductWeightOption.id):
+                variants_by_product.setdefault(option.product_id, []).append(option)
         products_data = []
         for p_model in products_models:
-            product_dict = p_model.to_dict()
+            product_dict = p_model.to_dict(localization=localizations.get(p_model.id))
             if p_model.main_image_url:
                 try: product_dict['main_image_full_url'] = url_for('serve_public_asset', filepath=p_model.main_image_url, _external=True)
                 except Exception as e: current_app.logger.warning(f"URL gen error for main image {p_model.main_image_url}: {e}")
             
             if include_variants and p_model.type == ProductTypeEnum.VARIABLE_WEIGHT:
-                product_dict['weight_options'] = [opt.to_dict() for opt in p_model.weight_options]
+                product_dict['weight_options'] = [opt.to_dict() for opt in variants_by_product.get(p_model.id, [])]
                 product_dict['variant_count'] = len(product_dict['weight_options'])
             else:
-                product_dict['variant_count'] = p_model.weight_options.count()
+                product_dict['variant_count'] = variant_counts.get(p_model.id, 0)
 
             products_data.append(product_dict)
         return jsonify(products=products_data, success=True), 200
@@ -306,8 +319,10 @@ def create_product_admin():
         if any(loc_data_en.values()):
             _update_or_create_product_localization(new_product.id, 'en', loc_data_en)
 
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
-        generate_static_json_files()
+        current_app.product_search_service.index_product(new_product.id)
+        current_app.static_json_service.request_regeneration(product_ids=[new_product.id], category_ids=[new_product.category_id])
         audit_logger.log_action(user_id=current_admin_id, action='create_product_admin_success', target_type='product', target_id=new_product.id, details=f"Product '{new_product.name}' created.", status='success')
         return jsonify(message="Product created successfully", product=new_product.to_dict(), success=True), 201
 
@@ -341,6 +356,7 @@ def update_product_admin(product_id):
         if new_product_code != product.product_code and Product.query.filter(Product.product_code == new_product_code, Product.id != product_id).first():
             return jsonify(message=f"Product Code '{new_product_code}' already exists.", success=False), 409
         
+        previous_category_id = product.category_id
         product.name = name_fr
         product.product_code = new_product_code
         product.category_id = int(data['category_id']) if data.get('category_id') else product.category_id
@@ -370,8 +386,10 @@ def update_product_admin(product_id):
         loc_data_en = { 'name_en': data.get('name_en'), 'description_en': data.get('description_en'), 'long_description_en': data.get('long_description_en') }
         _update_or_create_product_localization(product_id, 'en', loc_data_en)
 
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
-        generate_static_json_files()
+        current_app.product_search_service.index_product(product_id)
+        current_app.static_json_service.request_regeneration(product_ids=[product_id], category_ids=[previous_category_id, product.category_id])
         audit_logger.log_action(user_id=current_admin_id, action='update_product_admin_success', target_type='product', target_id=product_id, details=f"Product '{product.name}' updated.", status='success')
         return jsonify(message="Product updated successfully", product=product.to_dict(), success=True), 200
     except Exception as e:
@@ -415,7 +433,9 @@ def update_product_options_admin(product_id):
                 new_option = ProductWeightOption(product_id=product_id, weight_grams=weight, price=price, sku_suffix=sku_suffix)
                 db.session.add(new_option)
 
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
+        current_app.static_json_service.request_regeneration(product_ids=[product_id])
         return jsonify(message="Product weight options updated successfully.", success=True), 200
     except ValueError as ve:
         db.session.rollback()
@@ -447,13 +467,16 @@ def delete_product_admin(product_id):
             image_paths_to_delete.append(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url))
 
     product_name_for_log = product.name
+    product_category_id = product.category_id
 
     try:
         # The database relationships are set up with cascade="all, delete-orphan",
         # so deleting the product will automatically delete related ProductImage,
         # ProductWeightOption, and ProductLocalization records.
         db.session.delete(product)
+        current_app.catalog_cache.bump_version(db.session)
         db.session.commit()
+        current_app.product_search_service.remove_product(product_id)
 
         # After successful DB deletion, delete the physical files
         for path in image_paths_to_delete:
@@ -465,7 +488,7 @@ def delete_product_admin(product_id):
         
         audit_logger.log_action(user_id=current_admin_id, action='delete_product_success', target_type='product', target_id=product_id, details=f"Product '{product_name_for_log}' and its assets deleted.", status='success')
         
-        generate_static_json_files()
+        current_app.static_json_service.request_regeneration(product_ids=[product_id], category_ids=[product_category_id])
         
         return jsonify(message=f"Product '{product_name_for_log}' deleted successfully.", success=True), 200
     except Exception as e:
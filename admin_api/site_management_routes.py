@@ -4,7 +4,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from . import admin_api_bp
 from ..database import get_db_connection, query_db
-from ..utils import admin_required, sanitize_input, generate_static_json_files
+from ..utils import admin_required, sanitize_input
 
 # --- Review Management ---
 @admin_api_bp.route('/reviews', methods=['GET'])
@@ -158,14 +158,24 @@ def update_settings_admin():
 @admin_api_bp.route('/regenerate-static-json', methods=['POST'])
 @admin_required
 def regenerate_static_json_endpoint():
-    """Triggers the regeneration of static JSON data files."""
+    """Queues a full regeneration of the static JSON data files and returns its job id."""
     current_user_id = get_jwt_identity()
     audit_logger = current_app.audit_log_service
     try:
-        generate_static_json_files()
-        audit_logger.log_action(user_id=current_user_id, action='regenerate_static_json', status='success', ip_address=request.remote_addr)
-        return jsonify(message="Static JSON files regenerated successfully.", success=True), 200
+        job_id = current_app.static_json_service.request_regeneration(full_rebuild=True)
+        audit_logger.log_action(user_id=current_user_id, action='regenerate_static_json', details=f"Job {job_id} queued.", status='success', ip_address=request.remote_addr)
+        job = current_app.static_json_service.get_job(job_id)
+        return jsonify(message="Static JSON regeneration queued.", job=job, success=True), 202
     except Exception as e:
-        current_app.logger.error(f"Failed to regenerate static JSON files via API: {e}", exc_info=True)
+        current_app.logger.error(f"Failed to queue static JSON regeneration via API: {e}", exc_info=True)
         audit_logger.log_action(user_id=current_user_id, action='regenerate_static_json_fail', details=str(e), status='failure', ip_address=request.remote_addr)
-        return jsonify(message=f"Failed to regenerate static JSON files: {str(e)}", success=False), 500
+        return jsonify(message=f"Failed to queue static JSON regeneration: {str(e)}", success=False), 500
+
+@admin_api_bp.route('/regenerate-static-json/<string:job_id>', methods=['GET'])
+@admin_required
+def get_static_json_job_status(job_id):
+    """Returns the status of a static JSON regeneration job (queued, running, completed or failed)."""
+    job = current_app.static_json_service.get_job(job_id)
+    if not job:
+        return jsonify(message="Regeneration job not found.", success=False), 404
+    return jsonify(job=job, success=True), 200
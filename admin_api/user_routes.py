@@ -9,7 +9,7 @@ from datetime import datetime, timezone
 from . import admin_api_bp
 from .. import db
 from ..models import User, ProfessionalDocument, UserRoleEnum, ProfessionalStatusEnum, B2BPricingTierEnum
-from ..utils import admin_required
+from ..utils import admin_required, paginate_keyset
 
 @admin_api_bp.route('/users', methods=['GET'])
 @admin_required
@@ -23,6 +23,8 @@ def get_users_admin():
         is_active_filter = request.args.get('is_active')
         professional_status_filter = request.args.get('professional_status')
         search_term = request.args.get('search')
+        cursor = request.args.get('cursor') # Present (even empty) -> keyset pagination on (created_at, id)
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
 
         query = User.query
 
@@ -49,6 +51,16 @@ def get_users_admin():
                 )
             )
         
+        if cursor is not None:
+            users_models, next_cursor, total_items = paginate_keyset(
+                query, User.created_at, User.id, cursor=cursor or None, per_page=per_page,
+                descending=True, include_total=include_total
+            )
+            pagination_data = {"per_page": per_page, "next_cursor": next_cursor, "has_more": next_cursor is not None}
+            if include_total: pagination_data["total_items"] = total_items
+            audit_logger.log_action(user_id=current_admin_id, action='admin_get_users_list', status='success', ip_address=request.remote_addr)
+            return jsonify({"users": [u.to_dict() for u in users_models], "pagination": pagination_data, "success": True}), 200
+
         paginated_users = query.order_by(User.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
         users_data = [u.to_dict() for u in paginated_users.items]
         
@@ -61,6 +73,8 @@ def get_users_admin():
             },
             "success": True
         }), 200
+    except ValueError as ve:
+        return jsonify(message=str(ve), success=False), 400
     except Exception as e:
         current_app.logger.error(f"Error fetching users for admin: {e}", exc_info=True)
         return jsonify(message="Failed to fetch users.", success=False), 500
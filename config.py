@@ -65,7 +65,29 @@ class Config:
     ASSET_STORAGE_PATH = os.environ.get('ASSET_STORAGE_PATH', os.path.join(UPLOAD_FOLDER, 'generated_assets'))
     QR_CODE_FOLDER = os.path.join(ASSET_STORAGE_PATH, 'qr_codes')
     PASSPORT_FOLDER = os.path.join(ASSET_STORAGE_PATH, 'passports')
+    ASSET_STORE_GC_GRACE_SECONDS = int(os.environ.get('ASSET_STORE_GC_GRACE_SECONDS', 86400)) # `flask gc-assets` keeps unreferenced blobs younger than this
+    PASSPORT_PRECOMPRESS = os.environ.get('PASSPORT_PRECOMPRESS', 'true').lower() in ('true', '1', 't') # Also write passport .html.gz files for serve_public_asset
     LABEL_FOLDER = os.path.join(ASSET_STORAGE_PATH, 'labels')
+    QR_CODE_FORMAT = os.environ.get('QR_CODE_FORMAT', 'svg') # Passport QR images: 'svg' (compact, scalable) or 'png'
+    QR_CODE_PNG_BOX_SIZE = int(os.environ.get('QR_CODE_PNG_BOX_SIZE', 10)) # Pixels per module for PNG output
+    LABEL_SHEET_LAYOUT = os.environ.get('LABEL_SHEET_LAYOUT', 'a4') # Receipt label sheets: 'a4' (2 x 4 labels per page) or 'a7' (one label per page)
+    LABEL_FORMAT = os.environ.get('LABEL_FORMAT', 'pdf') # 'pdf' (ReportLab) or 'zpl' (thermal printers)
+    LABEL_ZPL_WIDTH_DOTS = int(os.environ.get('LABEL_ZPL_WIDTH_DOTS', 800)) # 100 mm at 8 dots/mm (203 dpi)
+    LABEL_ZPL_HEIGHT_DOTS = int(os.environ.get('LABEL_ZPL_HEIGHT_DOTS', 560)) # 70 mm at 8 dots/mm
+    ASSET_GENERATION_WORKERS = int(os.environ.get('ASSET_GENERATION_WORKERS', 0)) # Processes for batch asset rendering; 0 = CPU count
+    ASSET_PARALLEL_MIN_BATCH = int(os.environ.get('ASSET_PARALLEL_MIN_BATCH', 8)) # Smaller receipts render inline
+    ASSET_GENERATION_MODE = os.environ.get('ASSET_GENERATION_MODE', 'queued') # 'queued' (rendered by `flask asset-worker`) or 'inline'
+    ASSET_JOB_MAX_ATTEMPTS = int(os.environ.get('ASSET_JOB_MAX_ATTEMPTS', 3))
+    ASSET_JOB_RETRY_BACKOFF_SECONDS = int(os.environ.get('ASSET_JOB_RETRY_BACKOFF_SECONDS', 30)) # Doubled after each failed attempt
+    ASSET_JOB_LOCK_TIMEOUT_SECONDS = int(os.environ.get('ASSET_JOB_LOCK_TIMEOUT_SECONDS', 600)) # RUNNING jobs older than this are reclaimed
+    INVENTORY_IMPORT_FOLDER = os.path.join(UPLOAD_FOLDER, 'imports') # Uploaded CSVs kept until their import job completes
+    INVENTORY_IMPORT_CHUNK_SIZE = int(os.environ.get('INVENTORY_IMPORT_CHUNK_SIZE', 1000)) # Rows per committed chunk
+    INVENTORY_IMPORT_ASYNC = os.environ.get('INVENTORY_IMPORT_ASYNC', 'true').lower() in ('true', '1', 't')
+    INVENTORY_IMPORT_STALE_SECONDS = int(os.environ.get('INVENTORY_IMPORT_STALE_SECONDS', 300)) # A RUNNING job without progress this long may be resumed
+    INVENTORY_IMPORT_MAX_REPORTED_FAILURES = int(os.environ.get('INVENTORY_IMPORT_MAX_REPORTED_FAILURES', 1000))
+    INVENTORY_EXPORT_BATCH_SIZE = int(os.environ.get('INVENTORY_EXPORT_BATCH_SIZE', 1000)) # Rows fetched and flushed per round in CSV exports
+    STOCK_RESERVATION_TTL_SECONDS = int(os.environ.get('STOCK_RESERVATION_TTL_SECONDS', 900)) # How long a cart holds its stock
+    STOCK_RESERVATION_ORDER_TTL_SECONDS = int(os.environ.get('STOCK_RESERVATION_ORDER_TTL_SECONDS', 3600)) # Payment window for a checked-out order
     # Static assets paths adjusted to use PROJECT_ROOT
     DEFAULT_FONT_PATH = os.environ.get('DEFAULT_FONT_PATH', os.path.join(PROJECT_ROOT, 'static_assets', 'fonts', 'DejaVuSans.ttf')) 
     MAISON_TRUVRA_LOGO_PATH_LABEL = os.environ.get('MAISON_TRUVRA_LOGO_PATH_LABEL', os.path.join(PROJECT_ROOT, 'static_assets', 'logos', 'maison_truvra_label_logo.png')) 
@@ -105,6 +127,25 @@ class Config:
     # APP_BASE_URL already defined above
     BACKEND_APP_BASE_URL = os.environ.get('BACKEND_APP_BASE_URL', 'http://localhost:5001') # For backend specific URLs like callbacks
 
+    # --- Public Catalog Cache ---
+    CATALOG_CACHE_ENABLED = os.environ.get('CATALOG_CACHE_ENABLED', 'true').lower() in ('true', '1', 't')
+    CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 2048))
+    CATALOG_CACHE_TTL_SECONDS = int(os.environ.get('CATALOG_CACHE_TTL_SECONDS', 60)) # Bounds staleness of stock figures in listings
+    CATALOG_VERSION_CHECK_SECONDS = float(os.environ.get('CATALOG_VERSION_CHECK_SECONDS', 2)) # How often each worker re-reads the catalog version
+    CATALOG_HTTP_MAX_AGE = int(os.environ.get('CATALOG_HTTP_MAX_AGE', 0)) # Cache-Control max-age for catalog GETs; 0 = always revalidate via ETag
+
+    # --- Static Catalog JSON ---
+    STATIC_JSON_ASYNC = os.environ.get('STATIC_JSON_ASYNC', 'true').lower() in ('true', '1', 't') # Regenerate in a background thread
+    STATIC_JSON_REGENERATION_WINDOW_SECONDS = float(os.environ.get('STATIC_JSON_REGENERATION_WINDOW_SECONDS', 5)) # At most one regeneration per window
+    STATIC_JSON_JOB_LOCK_TIMEOUT_SECONDS = int(os.environ.get('STATIC_JSON_JOB_LOCK_TIMEOUT_SECONDS', 600)) # A run that died leaves its jobs claimable again after this
+    STATIC_JSON_JOB_RETENTION_DAYS = int(os.environ.get('STATIC_JSON_JOB_RETENTION_DAYS', 7)) # Finished regeneration jobs kept for polling
+    STATIC_JSON_SHARDED = os.environ.get('STATIC_JSON_SHARDED', 'false').lower() in ('true', '1', 't') # Also write per-category/per-product shards + manifest.json
+    STATIC_JSON_PRECOMPRESS = os.environ.get('STATIC_JSON_PRECOMPRESS', '') # Comma-separated: 'gzip', 'br' (brotli package required)
+
+    # --- Product Search ---
+    PRODUCT_SEARCH_BACKEND = os.environ.get('PRODUCT_SEARCH_BACKEND', 'auto') # 'auto' (FTS5 on SQLite, in-process index otherwise), 'fts5' or 'memory'
+    PRODUCT_SEARCH_MAX_RESULTS = int(os.environ.get('PRODUCT_SEARCH_MAX_RESULTS', 500)) # Ranked matches (after the listing filters) considered per search; reported as search_max_results
+
     RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', "memory://")
     RATELIMIT_STRATEGY = "fixed-window"
     RATELIMIT_HEADERS_ENABLED = True
@@ -203,12 +244,16 @@ class TestingConfig(Config):
     INITIAL_ADMIN_EMAIL = 'test_admin_orm@example.com'
     INITIAL_ADMIN_PASSWORD = 'test_password_orm123'
     SQLALCHEMY_ECHO = False
+    ASSET_GENERATION_MODE = 'inline'
+    INVENTORY_IMPORT_ASYNC = False
     SIMPLELOGIN_CLIENT_ID = 'test_sl_client_id_testing' 
     SIMPLELOGIN_CLIENT_SECRET = 'test_sl_client_secret_testing'
     BACKUP_ENCRYPTION_KEY = Fernet.generate_key().decode() # Use a fresh key for tests
 
     # Ensure a test recipient for backup emails if testing that feature
     BACKUP_EMAIL_RECIPIENT = 'test-backup-recipient@example.com'
+    CATALOG_CACHE_ENABLED = False
+    STATIC_JSON_ASYNC = False
 
 
 class ProductionConfig(Config):
@@ -333,6 +378,7 @@ def get_config_by_name(config_name_str=None):
         config_instance.QR_CODE_FOLDER,
         config_instance.PASSPORT_FOLDER, 
         config_instance.LABEL_FOLDER,
+        config_instance.INVENTORY_IMPORT_FOLDER,
         config_instance.PROFESSIONAL_DOCS_UPLOAD_PATH, 
         config_instance.INVOICE_PDF_PATH,
         config_instance.BACKUP_DIRECTORY, # Added backup directory
@@ -1,14 +1,18 @@
 # backend/database.py
 import os
 import click
+from datetime import date, datetime, time, timedelta, timezone
 from flask import current_app
 from flask.cli import with_appcontext
-from sqlalchemy import func # Import func for SQL functions like upper
+from collections import defaultdict
+from sqlalchemy import func, select, insert, update, and_, or_, case # Import func for SQL functions like upper
 
 # Import the db instance and models from your application structure
 from . import db 
 from .models import User, Category, Product, StockMovement # Import other models as needed
 
+BULK_INSERT_BATCH_SIZE = 1000 # Rows per executemany round-trip in bulk_insert_serialized_items
+
 def populate_initial_data_sqlalchemy():
     """Populates the database with initial data using SQLAlchemy models."""
     if not current_app:
@@ -73,18 +77,56 @@ def seed_db_command():
     populate_initial_data_sqlalchemy()
     click.echo('Database seeded with initial data (SQLAlchemy).')
 
+@click.command('recompute-stock')
+@with_appcontext
+def recompute_stock_command():
+    """Rebuilds the maintained product and variant stock counters from the stock movement ledger."""
+    drifted_products, drifted_variants = recompute_stock_counters()
+    db.session.commit()
+    click.echo(f'Stock counters recomputed. Corrected {drifted_products} product(s) and {drifted_variants} variant(s).')
+
+@click.command('regenerate-static-json')
+@with_appcontext
+def regenerate_static_json_command():
+    """Fully rebuilds the static products/categories JSON files from the database."""
+    from .utils import generate_static_json_files
+    # Asset URLs are built with url_for(_external=True), which needs a request context outside of requests.
+    with current_app.test_request_context(base_url=current_app.config.get('BACKEND_APP_BASE_URL')):
+        result = generate_static_json_files() or {}
+    error_count = len(result.get('product_errors', [])) + len(result.get('category_errors', []))
+    click.echo(f'Static JSON files regenerated with {error_count} error(s).')
+
+@click.command('snapshot-stock')
+@click.option('--until', default=None, help='Snapshot up to the start of this day (YYYY-MM-DD, UTC). Default: today.')
+@click.option('--rebuild', is_flag=True, help='Delete all snapshots and rebuild them from the first movement.')
+@with_appcontext
+def snapshot_stock_command(until, rebuild):
+    """Builds daily stock ledger snapshots up to a day, continuing from the latest existing snapshot."""
+    until_day = date.fromisoformat(until) if until else None
+    if rebuild:
+        from .models import StockSnapshot
+        db.session.query(StockSnapshot).delete(synchronize_session=False)
+    created = build_stock_snapshots(until_day=until_day)
+    db.session.commit()
+    click.echo(f'Stock snapshots built: {created} row(s) added.')
+
 def register_db_commands(app):
     """Registers database-related CLI commands."""
     app.cli.add_command(seed_db_command)
-    app.logger.info("SQLAlchemy DB seed command registered.")
+    app.cli.add_command(recompute_stock_command)
+    app.cli.add_command(regenerate_static_json_command)
+    app.cli.add_command(snapshot_stock_command)
+    app.logger.info("SQLAlchemy DB commands registered.")
 
 def record_stock_movement(
     db_session, product_id, movement_type, quantity_change=None, weight_change_grams=None,
     variant_id=None, serialized_item_id=None, reason=None,
-    related_order_id=None, related_user_id=None, notes=None
+    related_order_id=None, related_user_id=None, notes=None, update_counters=True
 ):
     """
-    Records a stock movement using SQLAlchemy session.
+    Records a stock movement using SQLAlchemy session and applies its quantity_change
+    to the maintained product/variant stock counters in the same transaction.
+    Raises InsufficientStockError (before recording anything) if a counter would go below zero.
     The calling function is responsible for db_session.commit().
     """
     from .models import StockMovement # Local import to avoid circular dependency at module level
@@ -93,6 +135,8 @@ def record_stock_movement(
         current_app.logger.error("record_stock_movement called without a SQLAlchemy db session.")
         raise ValueError("A SQLAlchemy db session is required for record_stock_movement.")
 
+    if update_counters:
+        apply_stock_counter_delta(db_session, product_id, quantity_change, variant_id=variant_id)
     movement = StockMovement(
         product_id=product_id,
         variant_id=variant_id,
@@ -109,6 +153,340 @@ def record_stock_movement(
     current_app.logger.debug(f"Stock movement object created for recording: {movement_type} for product ID {product_id}")
     return movement
 
+def serialized_availability_change(old_status_enum, new_status_enum):
+    """Returns +1/-1 when a serialized item enters/leaves sellable stock (AVAILABLE), else 0."""
+    from .models import SerializedInventoryItemStatusEnum
+    was_available = old_status_enum == SerializedInventoryItemStatusEnum.AVAILABLE
+    is_available = new_status_enum == SerializedInventoryItemStatusEnum.AVAILABLE
+    return int(is_available) - int(was_available)
+
+def status_change_movement_type(quantity_change):
+    """Movement type recording a serialized item's status change into (+1) or out of (-1) stock."""
+    from .models import StockMovementTypeEnum
+    return StockMovementTypeEnum.ADJUSTMENT_IN if quantity_change > 0 else StockMovementTypeEnum.ADJUSTMENT_OUT
+
+class InsufficientStockError(ValueError):
+    """Raised when a stock decrement would take a product or variant counter below zero."""
+
+    def __init__(self, product_id, variant_id, quantity_change, available=None):
+        self.product_id = product_id
+        self.variant_id = variant_id
+        self.quantity_change = quantity_change
+        self.available = available
+        target = f"variant {variant_id}" if variant_id else f"product {product_id}"
+        super().__init__(f"Insufficient stock for {target}: cannot apply {quantity_change} (available: {available}).")
+
+def _conditional_counter_update(db_session, model, row_id, quantity_change, allow_negative):
+    """
+    Increments model.aggregate_stock_quantity in a single UPDATE, guarded by `qty + change >= 0` unless
+    allow_negative. The row lock taken by the UPDATE serializes writers of this row only.
+    Returns the new quantity, or None if the guard (or a missing row) prevented the update.
+    """
+    counter = model.aggregate_stock_quantity
+    statement = update(model).where(model.id == row_id)
+    if not allow_negative:
+        statement = statement.where(counter + quantity_change >= 0)
+    statement = statement.values({counter: counter + quantity_change}).execution_options(synchronize_session=False)
+
+    if db_session.get_bind().dialect.update_returning:
+        return db_session.execute(statement.returning(counter)).scalar()
+    if db_session.execute(statement).rowcount == 0:
+        return None
+    # MySQL has no RETURNING; the row stays locked by our UPDATE until commit, so this read is consistent.
+    return db_session.execute(select(counter).where(model.id == row_id)).scalar()
+
+def apply_stock_counter_delta(db_session, product_id, quantity_change, variant_id=None, allow_negative=False):
+    """
+    Applies a quantity change to the maintained stock counters of a product (and its variant) as
+    conditional in-database increments: concurrent writers neither overwrite each other nor take a
+    counter below zero. Product then variant is the lock order for every writer.
+    The calling function is responsible for db_session.commit(), or rollback() on error.
+
+    Returns:
+        tuple: (new product quantity, new variant quantity or None); (None, None) for a zero change.
+    Raises:
+        InsufficientStockError: if a counter would go below zero (nothing is left applied
+            for the variant; the caller must roll back the product increment).
+    """
+    from .models import ProductWeightOption
+    if not quantity_change:
+        return None, None
+    product_quantity = _conditional_counter_update(db_session, Product, product_id, quantity_change, allow_negative)
+    if product_quantity is None:
+        available = db_session.execute(select(Product.aggregate_stock_quantity).where(Product.id == product_id)).scalar()
+        raise InsufficientStockError(product_id, None, quantity_change, available)
+    variant_quantity = None
+    if variant_id:
+        variant_quantity = _conditional_counter_update(db_session, ProductWeightOption, variant_id, quantity_change, allow_negative)
+        if variant_quantity is None:
+            available = db_session.execute(select(ProductWeightOption.aggregate_stock_quantity).where(ProductWeightOption.id == variant_id)).scalar()
+            raise InsufficientStockError(product_id, variant_id, quantity_change, available)
+    return product_quantity, variant_quantity
+
+def bulk_insert_serialized_items(db_session, item_rows, movement_type, reason=None, related_user_id=None, batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Inserts serialized items and one stock movement per item with executemany statements,
+    `batch_size` rows at a time, instead of an add/flush round-trip per item.
+    Items inserted as available count +1 towards stock, others 0 (the movement is kept for traceability);
+    counters are updated once per product/variant with the net change.
+    The calling function is responsible for db_session.commit().
+
+    Args:
+        item_rows (list): Dicts of SerializedInventoryItem column values; 'item_uid' and 'product_id' are required.
+
+    Returns:
+        dict: item_uid -> id of the inserted items.
+    """
+    from .models import SerializedInventoryItem, SerializedInventoryItemStatusEnum
+
+    if not item_rows:
+        return {}
+    # RETURNING with executemany is available on SQLite/PostgreSQL/MariaDB; on MySQL the ids are read back by UID.
+    use_returning = db_session.get_bind().dialect.insert_executemany_returning
+    ids_by_uid = {}
+    counter_deltas = defaultdict(int)
+
+    for start in range(0, len(item_rows), batch_size):
+        chunk = [dict(row) for row in item_rows[start:start + batch_size]]
+        for row in chunk:
+            row.setdefault('status', SerializedInventoryItemStatusEnum.AVAILABLE)
+        if use_returning:
+            result = db_session.execute(
+                insert(SerializedInventoryItem).returning(SerializedInventoryItem.id, SerializedInventoryItem.item_uid), chunk
+            )
+            ids_by_uid.update((uid, item_id) for item_id, uid in result)
+        else:
+            db_session.execute(insert(SerializedInventoryItem), chunk)
+            ids_by_uid.update(db_session.execute(
+                select(SerializedInventoryItem.item_uid, SerializedInventoryItem.id)
+                .where(SerializedInventoryItem.item_uid.in_([row['item_uid'] for row in chunk]))
+            ).all())
+
+        movement_rows = []
+        for row in chunk:
+            quantity_change = 1 if row['status'] == SerializedInventoryItemStatusEnum.AVAILABLE else 0
+            counter_deltas[(row['product_id'], row.get('variant_id'))] += quantity_change
+            movement_rows.append({
+                'product_id': row['product_id'], 'variant_id': row.get('variant_id'),
+                'serialized_item_id': ids_by_uid[row['item_uid']], 'movement_type': movement_type,
+                'quantity_change': quantity_change, 'reason': reason, 'related_user_id': related_user_id
+            })
+        db_session.execute(insert(StockMovement), movement_rows)
+
+    for (product_id, variant_id), quantity_change in counter_deltas.items():
+        apply_stock_counter_delta(db_session, product_id, quantity_change, variant_id=variant_id)
+    current_app.logger.debug(f"Bulk inserted {len(item_rows)} serialized items with {movement_type} movements.")
+    return ids_by_uid
+
+def bulk_update_serialized_item_status(db_session, item_ids, new_status_enum, notes=None, note_prefix=None, related_user_id=None,
+                                       excluded_statuses=(), batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Moves serialized items to `new_status_enum` set-wise, `batch_size` ids at a time: the rows are
+    locked, then updated with one compare-and-set UPDATE per previous status. One stock movement
+    is inserted (executemany) per item entering or leaving available stock, and the counters get
+    the net change once per product/variant. With `notes`, the line "<note_prefix>: Status a -> b.
+    Reason: <notes>" is appended to each item's notes. Items whose status (read under the row lock)
+    is in `excluded_statuses` are left untouched.
+    The calling function is responsible for db_session.commit(), or rollback() on error.
+
+    Returns:
+        dict: {"transitioned": int, "stock_changes": [{"product_id", "variant_id", "quantity_change"}]}
+    Raises:
+        InsufficientStockError: if a counter would go below zero (counters have drifted).
+    """
+    from .models import SerializedInventoryItem
+
+    item_model = SerializedInventoryItem
+    use_returning = db_session.get_bind().dialect.update_returning
+    now = datetime.now(timezone.utc)
+    transitioned = 0
+    counter_deltas = defaultdict(int)
+
+    for start in range(0, len(item_ids), batch_size):
+        chunk = item_ids[start:start + batch_size]
+        rows_by_old_status = defaultdict(list)
+        locked_rows = select(item_model.id, item_model.product_id, item_model.variant_id, item_model.status)\
+            .where(item_model.id.in_(chunk), item_model.status != new_status_enum)
+        if excluded_statuses:
+            locked_rows = locked_rows.where(item_model.status.notin_(excluded_statuses))
+        for row in db_session.execute(locked_rows.with_for_update()):
+            rows_by_old_status[row.status].append(row)
+
+        movement_rows = []
+        for old_status_enum, rows in rows_by_old_status.items():
+            values = {item_model.status: new_status_enum, item_model.updated_at: now}
+            if notes:
+                note_line = f"{note_prefix}: Status {old_status_enum.value} -> {new_status_enum.value}. Reason: {notes}"
+                values[item_model.notes] = case((item_model.notes.is_(None), note_line), else_=item_model.notes + "\n" + note_line)
+            statement = update(item_model).where(item_model.id.in_([row.id for row in rows]), item_model.status == old_status_enum)\
+                .values(values).execution_options(synchronize_session=False)
+            if use_returning:
+                updated_ids = set(db_session.execute(statement.returning(item_model.id)).scalars())
+            else:
+                db_session.execute(statement)
+                # The rows are locked FOR UPDATE above, so reading the new status back is consistent.
+                updated_ids = set(db_session.execute(
+                    select(item_model.id).where(item_model.id.in_([row.id for row in rows]), item_model.status == new_status_enum)
+                ).scalars())
+
+            quantity_change = serialized_availability_change(old_status_enum, new_status_enum)
+            for row in rows:
+                if row.id not in updated_ids:
+                    continue
+                transitioned += 1
+                if not quantity_change:
+                    continue
+                counter_deltas[(row.product_id, row.variant_id)] += quantity_change
+                movement_rows.append({
+                    'product_id': row.product_id, 'variant_id': row.variant_id, 'serialized_item_id': row.id,
+                    'movement_type': status_change_movement_type(quantity_change), 'quantity_change': quantity_change,
+                    'reason': f"Status {old_status_enum.value} -> {new_status_enum.value}",
+                    'related_user_id': related_user_id, 'notes': notes or None
+                })
+        if movement_rows:
+            db_session.execute(insert(StockMovement), movement_rows)
+
+    stock_changes = []
+    for (product_id, variant_id), quantity_change in counter_deltas.items():
+        apply_stock_counter_delta(db_session, product_id, quantity_change, variant_id=variant_id)
+        stock_changes.append({"product_id": product_id, "variant_id": variant_id, "quantity_change": quantity_change})
+    current_app.logger.debug(f"Bulk status update to {new_status_enum.value}: {transitioned} of {len(item_ids)} item(s) transitioned.")
+    return {"transitioned": transitioned, "stock_changes": stock_changes}
+
+def recompute_stock_counters(db_session=None, product_ids=None):
+    """
+    Rebuilds product and variant stock counters set-wise from StockMovement.quantity_change
+    (and the reserved counters from StockReservation.quantity), optionally restricted to
+    `product_ids`. The calling function is responsible for commit().
+
+    Returns:
+        tuple: (number of products corrected, number of variants corrected)
+    """
+    from .models import ProductWeightOption, StockReservation
+    session_to_use = db_session or db.session
+
+    product_total = select(func.coalesce(func.sum(StockMovement.quantity_change), 0))\
+        .where(StockMovement.product_id == Product.id).scalar_subquery()
+    variant_total = select(func.coalesce(func.sum(StockMovement.quantity_change), 0))\
+        .where(StockMovement.variant_id == ProductWeightOption.id).scalar_subquery()
+    product_reserved = select(func.coalesce(func.sum(StockReservation.quantity), 0))\
+        .where(StockReservation.product_id == Product.id).scalar_subquery()
+    variant_reserved = select(func.coalesce(func.sum(StockReservation.quantity), 0))\
+        .where(StockReservation.variant_id == ProductWeightOption.id).scalar_subquery()
+
+    product_filters = [or_(Product.aggregate_stock_quantity != product_total, Product.reserved_stock_quantity != product_reserved)]
+    variant_filters = [or_(ProductWeightOption.aggregate_stock_quantity != variant_total, ProductWeightOption.reserved_stock_quantity != variant_reserved)]
+    if product_ids is not None:
+        product_filters.append(Product.id.in_(product_ids))
+        variant_filters.append(ProductWeightOption.product_id.in_(product_ids))
+
+    drifted_products = session_to_use.query(Product).filter(*product_filters).update(
+        {Product.aggregate_stock_quantity: product_total, Product.reserved_stock_quantity: product_reserved}, synchronize_session=False
+    )
+    drifted_variants = session_to_use.query(ProductWeightOption).filter(*variant_filters).update(
+        {ProductWeightOption.aggregate_stock_quantity: variant_total, ProductWeightOption.reserved_stock_quantity: variant_reserved}, synchronize_session=False
+    )
+    current_app.logger.info(f"Recomputed stock counters: {drifted_products} product(s), {drifted_variants} variant(s) corrected.")
+    return drifted_products, drifted_variants
+
+def _utc_midnight(day):
+    """Naive UTC datetime at the start of `day`, matching how DateTime columns are stored."""
+    return datetime.combine(day, time.min)
+
+def _latest_snapshots_query(session_to_use, not_after, product_ids=None):
+    """Rows (product_id, variant_id, quantity) of the latest snapshot of each product/variant at or before `not_after`."""
+    from .models import StockSnapshot
+    latest_filters = [StockSnapshot.snapshot_at <= not_after]
+    if product_ids is not None:
+        latest_filters.append(StockSnapshot.product_id.in_(product_ids))
+    latest = session_to_use.query(
+        StockSnapshot.product_id, StockSnapshot.variant_id, func.max(StockSnapshot.snapshot_at).label('snapshot_at')
+    ).filter(*latest_filters).group_by(StockSnapshot.product_id, StockSnapshot.variant_id).subquery()
+    return session_to_use.query(StockSnapshot.product_id, StockSnapshot.variant_id, StockSnapshot.quantity).join(
+        latest, and_(StockSnapshot.product_id == latest.c.product_id,
+                     StockSnapshot.variant_id.is_not_distinct_from(latest.c.variant_id),
+                     StockSnapshot.snapshot_at == latest.c.snapshot_at)
+    )
+
+def build_stock_snapshots(db_session=None, until_day=None):
+    """
+    Appends daily StockSnapshot rows from the day after the latest snapshot (or the first movement)
+    up to the start of `until_day` (default: today, UTC). Movements are summed per product/variant
+    and day in one grouped query; only keys that moved on a day get a row for it.
+    The calling function is responsible for db_session.commit().
+
+    Returns:
+        int: Number of snapshot rows added.
+    """
+    from .models import StockSnapshot
+    session_to_use = db_session or db.session
+    until = _utc_midnight(until_day or datetime.now(timezone.utc).date())
+
+    start = session_to_use.query(func.max(StockSnapshot.snapshot_at)).scalar()
+    if start is None:
+        first_movement = session_to_use.query(func.min(StockMovement.movement_date)).scalar()
+        if first_movement is None:
+            return 0
+        start = _utc_midnight(first_movement.date())
+    if start >= until:
+        return 0
+
+    running_totals = {(pid, vid): quantity for pid, vid, quantity in _latest_snapshots_query(session_to_use, start)}
+    day_expr = func.date(StockMovement.movement_date)
+    daily_deltas = session_to_use.query(
+        StockMovement.product_id, StockMovement.variant_id, day_expr.label('day'),
+        func.coalesce(func.sum(StockMovement.quantity_change), 0), func.count(StockMovement.id)
+    ).filter(StockMovement.movement_date >= start, StockMovement.movement_date < until)\
+     .group_by(StockMovement.product_id, StockMovement.variant_id, day_expr).order_by(day_expr)
+
+    snapshot_rows = []
+    created = 0
+    for product_id, variant_id, day, quantity_delta, movement_count in daily_deltas.yield_per(BULK_INSERT_BATCH_SIZE):
+        day = day if isinstance(day, date) else date.fromisoformat(str(day)) # SQLite returns 'YYYY-MM-DD'
+        key = (product_id, variant_id)
+        running_totals[key] = running_totals.get(key, 0) + int(quantity_delta)
+        snapshot_rows.append({
+            'product_id': product_id, 'variant_id': variant_id, 'snapshot_at': _utc_midnight(day + timedelta(days=1)),
+            'quantity': running_totals[key], 'movement_count': movement_count
+        })
+        if len(snapshot_rows) >= BULK_INSERT_BATCH_SIZE:
+            session_to_use.execute(insert(StockSnapshot), snapshot_rows)
+            created += len(snapshot_rows); snapshot_rows = []
+    if snapshot_rows:
+        session_to_use.execute(insert(StockSnapshot), snapshot_rows)
+        created += len(snapshot_rows)
+    current_app.logger.info(f"Stock snapshots built from {start.date()} to {until.date()}: {created} row(s).")
+    return created
+
+def stock_at(at, product_ids=None, db_session=None):
+    """
+    Reconstructs stock at the (naive UTC) datetime `at`: the latest snapshot of each product/variant
+    at or before the most recent snapshot boundary, plus the movements from that boundary until `at`.
+
+    Returns:
+        tuple: ({(product_id, variant_id): quantity}, snapshot boundary datetime or None)
+    """
+    from .models import StockSnapshot
+    session_to_use = db_session or db.session
+    boundary = session_to_use.query(func.max(StockSnapshot.snapshot_at)).filter(StockSnapshot.snapshot_at <= at).scalar()
+
+    quantities = defaultdict(int)
+    if boundary is not None:
+        for product_id, variant_id, quantity in _latest_snapshots_query(session_to_use, boundary, product_ids):
+            quantities[(product_id, variant_id)] += quantity
+
+    movement_filters = [StockMovement.movement_date < at]
+    if boundary is not None:
+        movement_filters.append(StockMovement.movement_date >= boundary)
+    if product_ids is not None:
+        movement_filters.append(StockMovement.product_id.in_(product_ids))
+    deltas = session_to_use.query(
+        StockMovement.product_id, StockMovement.variant_id, func.coalesce(func.sum(StockMovement.quantity_change), 0)
+    ).filter(*movement_filters).group_by(StockMovement.product_id, StockMovement.variant_id)
+    for product_id, variant_id, quantity_delta in deltas:
+        quantities[(product_id, variant_id)] += int(quantity_delta)
+    return dict(quantities), boundary
+
 def get_product_id_from_code(product_code, db_session=None):
     """Fetches product ID using product_code with SQLAlchemy (case-insensitive)."""
     from .models import Product 
@@ -1,29 +1,36 @@
 # backend/inventory/routes.py
-import os
 import uuid
 import csv
+import zlib
 from io import StringIO
-from flask import request, jsonify, current_app, url_for, Response, abort as flask_abort, send_from_directory
+from flask import request, jsonify, current_app, url_for, Response, stream_with_context, abort as flask_abort, send_from_directory
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, timezone
-from sqlalchemy import func # For func.upper()
-
-# Assuming your Flask app instance has a 'celery' attribute if using Celery
-# from your_app import celery_app # Example: from .. import celery_app
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import func, and_ # For func.upper()
+from sqlalchemy.orm import aliased
 
 from .. import db
 from ..models import (
     Product, ProductWeightOption, SerializedInventoryItem, StockMovement, 
     Category, CategoryLocalization, ProductLocalization,
-    SerializedInventoryItemStatusEnum, StockMovementTypeEnum # Import Enums
+    ImportJob, ImportJobStatusEnum, AssetTypeEnum,
+    SerializedInventoryItemStatusEnum, StockMovementTypeEnum, ProductTypeEnum # Import Enums
 )
 from ..services.asset_service import (
-    generate_qr_code_for_item,
-    generate_item_passport,
-    generate_product_label_pdf
+    generate_assets_for_batch,
+    generate_passports_for_batch,
+    generate_label_batch,
+    PASSPORT_PATH_PLACEHOLDER
+)
+from ..services.asset_job_service import AssetJobService
+from ..services.b2c_asset_service import LABEL_SHEET_LAYOUTS, LABEL_FORMATS
+from ..services.inventory_import_service import CsvImportError
+from ..services.stock_allocation_service import StockAllocationService
+from ..utils import admin_required, format_datetime_for_display, parse_datetime_from_iso, format_datetime_for_storage, paginate_keyset
+from ..database import (
+    record_stock_movement, apply_stock_counter_delta, bulk_insert_serialized_items, InsufficientStockError,
+    serialized_availability_change, status_change_movement_type, stock_at, bulk_update_serialized_item_status
 )
-from ..utils import admin_required, format_datetime_for_display, parse_datetime_from_iso, format_datetime_for_storage
-from ..database import record_stock_movement 
 
 from . import inventory_bp
 
@@ -42,87 +49,41 @@ def sanitize_input(value, allow_html=False):
     return value_str
 
 # --- Helper for receive_serialized_stock ---
-def _process_single_item_receipt_and_assets(
-        db_session, product_info, variant_id, item_index,
-        batch_number, production_date_iso_str, expiry_date_iso_str,
-        cost_price, notes_for_item, actual_weight_grams_item,
-        current_admin_id, category_info_for_passport):
+def _build_receipt_item_specs(
+        product_info, variant_id, quantity, batch_number,
+        production_date_iso_str, expiry_date_iso_str, actual_weight_grams_item,
+        category_info_for_passport):
     """
-    Processes a single item for stock receipt: generates UID, assets, creates DB object.
-    Returns the SerializedInventoryItem object (not yet committed) and asset details.
-    Can raise exceptions if asset generation fails.
+    Prepares one plain-dict asset spec per received item (UID, localized names, label data).
+    The database is read once for the whole batch so that asset rendering, which may run in
+    other processes, never needs it. Labels are printed on one sheet for the batch, not per item.
     """
-    product_id = product_info.id
-    product_name_for_assets = product_info.name # Default
-    product_sku_prefix = product_info.product_code # Using product_code as sku_prefix
-
-    # Fetch localized names for assets
-    loc_fr = ProductLocalization.query.filter_by(product_id=product_id, lang_code='fr').first()
-    loc_en = ProductLocalization.query.filter_by(product_id=product_id, lang_code='en').first()
-    product_name_fr_for_assets = loc_fr.name_fr if loc_fr and loc_fr.name_fr else product_name_for_assets
-    product_name_en_for_assets = loc_en.name_en if loc_en and loc_en.name_en else product_name_for_assets
+    loc_fr = ProductLocalization.query.filter_by(product_id=product_info.id, lang_code='fr').first()
+    loc_en = ProductLocalization.query.filter_by(product_id=product_info.id, lang_code='en').first()
+    product_name_fr_for_assets = loc_fr.name_fr if loc_fr and loc_fr.name_fr else product_info.name
+    product_name_en_for_assets = loc_en.name_en if loc_en and loc_en.name_en else product_info.name
 
-    item_uid = f"{product_sku_prefix}-{uuid.uuid4().hex[:8].upper()}"
-    
-    item_specific_data_for_passport = {
-        "batch_number": batch_number, "production_date": production_date_iso_str,
-        "expiry_date": expiry_date_iso_str, "actual_weight_grams": actual_weight_grams_item
-    }
-    
-    # --- Conceptual Asynchronous Asset Generation ---
-    # In a real scenario with Celery:
-    # passport_task = generate_item_passport_async.delay(item_uid, product_info.to_dict(), category_info_for_passport, item_specific_data_for_passport)
-    # qr_task = generate_qr_code_for_item_async.delay(item_uid, product_id, product_name_fr_for_assets, product_name_en_for_assets)
-    # label_task = generate_product_label_pdf_async.delay(...)
-    # For now, we do it synchronously.
-    # -----------------------------------------------
-
-    passport_relative_path = generate_item_passport(item_uid, product_info, category_info_for_passport, item_specific_data_for_passport)
-    if not passport_relative_path: raise Exception(f"Failed to generate passport for item {item_index+1}.")
-
-    passport_public_url = url_for('serve_public_asset', filepath=passport_relative_path, _external=True)
-    qr_code_png_relative_path = generate_qr_code_for_item(item_uid, product_id, product_name_fr_for_assets, product_name_en_for_assets)
-    if not qr_code_png_relative_path: raise Exception(f"Failed to generate QR code PNG for item {item_index+1}.")
-    
     weight_for_label = actual_weight_grams_item
     if not weight_for_label and variant_id:
         variant_for_label = ProductWeightOption.query.get(variant_id)
         if variant_for_label: weight_for_label = variant_for_label.weight_grams
 
+    # url_for needs this request's context, so the passport URL is templated here and completed per item.
+    passport_url_template = url_for('serve_public_asset', filepath=PASSPORT_PATH_PLACEHOLDER, _external=True)
     processing_date_for_label_fr = datetime.now(timezone.utc).strftime('%d/%m/%Y')
-    label_pdf_relative_path = generate_product_label_pdf(
-        item_uid=item_uid, product_name_fr=product_name_fr_for_assets, product_name_en=product_name_en_for_assets,
-        weight_grams=weight_for_label, processing_date_str=processing_date_for_label_fr,
-        passport_url=passport_public_url
-    )
-    if not label_pdf_relative_path: raise Exception(f"Failed to generate PDF label for item {item_index+1}.")
-
-    production_date_db = parse_datetime_from_iso(production_date_iso_str) if production_date_iso_str else None
-    expiry_date_db = parse_datetime_from_iso(expiry_date_iso_str) if expiry_date_iso_str else None
-
-    new_item = SerializedInventoryItem(
-        item_uid=item_uid, product_id=product_id, variant_id=variant_id,
-        batch_number=batch_number, production_date=production_date_db, expiry_date=expiry_date_db,
-        cost_price=cost_price, notes=notes_for_item, 
-        status=SerializedInventoryItemStatusEnum.AVAILABLE, # Use Enum
-        qr_code_url=qr_code_png_relative_path, 
-        passport_url=passport_relative_path,
-        label_url=label_pdf_relative_path, 
-        actual_weight_grams=actual_weight_grams_item
-    )
-    db_session.add(new_item)
-    db_session.flush() # To get new_item.id for stock movement
-
-    record_stock_movement(db_session, product_id, StockMovementTypeEnum.RECEIVE_SERIALIZED, # Use Enum
-                          quantity_change=1, variant_id=variant_id, serialized_item_id=new_item.id,
-                          reason="Initial stock receipt via serialized receive", related_user_id=current_admin_id)
-    
-    asset_details = {
-        "item_uid": item_uid, "product_name": product_name_fr_for_assets, "product_code": product_info.product_code,
-        "qr_code_path": qr_code_png_relative_path, "passport_path": passport_relative_path,
-        "label_pdf_path": label_pdf_relative_path
+    product_info_for_assets = {"id": product_info.id, "name": product_info.name, "product_code": product_info.product_code}
+    item_specific_data_for_passport = {
+        "batch_number": batch_number, "production_date": production_date_iso_str,
+        "expiry_date": expiry_date_iso_str, "actual_weight_grams": actual_weight_grams_item
     }
-    return new_item, asset_details
+    return [{
+        "item_uid": f"{product_info.product_code}-{uuid.uuid4().hex[:8].upper()}",
+        "product_info": product_info_for_assets, "category_info": category_info_for_passport,
+        "item_specifics": item_specific_data_for_passport,
+        "product_name_fr": product_name_fr_for_assets, "product_name_en": product_name_en_for_assets,
+        "weight_grams": weight_for_label, "processing_date_str": processing_date_for_label_fr,
+        "passport_url_template": passport_url_template, "render_label": False
+    } for _ in range(quantity)]
 # --- End Helper ---
 
 
@@ -139,12 +100,18 @@ def receive_serialized_stock():
     cost_price_str = data.get('cost_price')
     notes_for_item = data.get('notes', '') # Notes apply per item if generated in loop
     actual_weight_grams_str = data.get('actual_weight_grams')
+    label_layout = data.get('label_layout') or current_app.config.get('LABEL_SHEET_LAYOUT', 'a4')
+    label_format = data.get('label_format') or current_app.config.get('LABEL_FORMAT', 'pdf')
 
     current_admin_id = get_jwt_identity()
     audit_logger = current_app.audit_log_service
 
     if not all([product_code_str, quantity_received_str]):
         return jsonify(message="Product Code and quantity are required", success=False), 400
+    if label_layout not in LABEL_SHEET_LAYOUTS:
+        return jsonify(message=f"Invalid label_layout. Allowed: {', '.join(LABEL_SHEET_LAYOUTS)}", success=False), 400
+    if label_format not in LABEL_FORMATS:
+        return jsonify(message=f"Invalid label_format. Allowed: {', '.join(LABEL_FORMATS)}", success=False), 400
 
     product_info = Product.query.filter(func.upper(Product.product_code) == product_code_str.upper()).first()
     if not product_info:
@@ -173,65 +140,163 @@ def receive_serialized_stock():
             cat_loc_fr = CategoryLocalization.query.filter_by(category_id=category.id, lang_code='fr').first()
             cat_loc_en = CategoryLocalization.query.filter_by(category_id=category.id, lang_code='en').first()
             category_info_for_passport['name_fr'] = (cat_loc_fr.name_fr if cat_loc_fr and cat_loc_fr.name_fr else category.name)
-            category_info_for_passport['name_en'] = (cat_loc_en.name_en if loc_en and loc_en.name_en else category.name)
+            category_info_for_passport['name_en'] = (cat_loc_en.name_en if cat_loc_en and cat_loc_en.name_en else category.name)
             # Populate other localized category fields as needed
 
+    item_specs = _build_receipt_item_specs(
+        product_info, variant_id, quantity_received, batch_number,
+        production_date_iso_str, expiry_date_iso_str, actual_weight_grams_item,
+        category_info_for_passport
+    )
+    product_id = product_info.id
+    product_code = product_info.product_code
+    # End the read transaction before rendering assets so no database locks are held meanwhile.
+    db.session.commit()
+
     generated_items_summary = []
-    all_assets_generated_for_cleanup = []
+    queue_assets = current_app.config.get('ASSET_GENERATION_MODE', 'queued') == 'queued'
 
     try:
-        for i in range(quantity_received):
-            # Pass db.session to the helper if it needs to add to session,
-            # or let it return objects to be added here.
-            # For now, helper adds to session, main route commits.
-            _, asset_details = _process_single_item_receipt_and_assets(
-                db.session, product_info, variant_id, i,
-                batch_number, production_date_iso_str, expiry_date_iso_str,
-                cost_price, notes_for_item, actual_weight_grams_item,
-                current_admin_id, category_info_for_passport
-            )
-            generated_items_summary.append(asset_details)
-            all_assets_generated_for_cleanup.extend([
-                asset_details['qr_code_path'], 
-                asset_details['passport_path'], 
-                asset_details['label_pdf_path']
-            ])
-        
+        # Every label of the receipt in one file: a multi-page PDF (single build) or one ZPL print job.
+        sheet_id = f"{product_code}-{uuid.uuid4().hex[:8].upper()}"
+        label_sheet_path = label_sheet_url = None
+
+        if queue_assets:
+            # Nothing is rendered before the 202: items are stored without asset URLs and `flask asset-worker`
+            # renders the passports, label sheet and QR codes and fills them in. The sheet's path is
+            # reported by the batch status endpoint.
+            asset_results = [{"item_uid": spec['item_uid'], "qr_code_path": None, "passport_path": None, "label_pdf_path": None} for spec in item_specs]
+        else:
+            # Passports share their product/category context, so the whole receipt is rendered in one pass.
+            passport_paths = generate_passports_for_batch(item_specs)
+            for spec in item_specs:
+                spec['passport_path'] = passport_paths[spec['item_uid']]
+                spec['render_passport'] = False
+            label_sheet_path = generate_label_batch(sheet_id, item_specs, label_format=label_format, layout=label_layout)
+            label_sheet_url = url_for('admin_api.serve_asset', asset_relative_path=label_sheet_path)
+            # Renders every item's QR code (and label, if any) in parallel for large batches.
+            # Files are content-addressed blobs: those of a failed receipt stay unreferenced until `flask gc-assets`.
+            asset_results = generate_assets_for_batch(item_specs)
+
+        production_date_db = parse_datetime_from_iso(production_date_iso_str) if production_date_iso_str else None
+        expiry_date_db = parse_datetime_from_iso(expiry_date_iso_str) if expiry_date_iso_str else None
+        new_item_rows = [{
+            "item_uid": asset_details['item_uid'], "product_id": product_id, "variant_id": variant_id,
+            "batch_number": batch_number, "production_date": production_date_db, "expiry_date": expiry_date_db,
+            "cost_price": cost_price, "notes": notes_for_item,
+            "status": SerializedInventoryItemStatusEnum.AVAILABLE,
+            "qr_code_url": asset_details['qr_code_path'],
+            "passport_url": asset_details['passport_path'],
+            "label_url": label_sheet_path,
+            "actual_weight_grams": actual_weight_grams_item
+        } for asset_details in asset_results]
+        # Batched INSERTs of the items and their movements, plus one stock counter update
+        bulk_insert_serialized_items(db.session, new_item_rows, StockMovementTypeEnum.RECEIVE_SERIALIZED,
+                                     reason="Initial stock receipt via serialized receive", related_user_id=current_admin_id)
+
+        if queue_assets:
+            asset_batch_id = AssetJobService.enqueue_receipt(db.session, item_specs, product_id, sheet_id, label_format, label_layout)
+            db.session.commit()
+            item_uids = [spec['item_uid'] for spec in item_specs]
+            audit_logger.log_action(user_id=current_admin_id, action='receive_serialized_stock_success', target_type='product', target_id=product_id, details=f"Received {quantity_received} items for {product_code_str}; assets queued in batch {asset_batch_id}.", status='success', ip_address=request.remote_addr)
+            return jsonify(
+                message=f"{quantity_received} items received successfully. Their assets are being generated.",
+                batch_id=asset_batch_id, item_uids=item_uids,
+                status_url=url_for('inventory_bp.get_asset_batch_status', batch_id=asset_batch_id),
+                success=True
+            ), 202
+
+        # References every stored blob so `flask gc-assets` keeps it: the items are new, so all rows go in one INSERT.
+        label_sheet_type = AssetTypeEnum.LABEL_SHEET_ZPL if label_format == 'zpl' else AssetTypeEnum.LABEL_SHEET_PDF
+        asset_rows = [{"asset_type": label_sheet_type, "related_item_uid": None, "related_product_id": product_id, "file_path": label_sheet_path}]
+        for asset_details in asset_results:
+            asset_rows.extend(AssetJobService.generated_asset_rows(asset_details['item_uid'], product_id, asset_details))
+        AssetJobService.insert_generated_assets(db.session, asset_rows)
         db.session.commit()
-        audit_logger.log_action(user_id=current_admin_id, action='receive_serialized_stock_success', target_type='product', target_id=product_info.id, details=f"Received {quantity_received} items for {product_code_str}.", status='success', ip_address=request.remote_addr)
-        return jsonify(message=f"{quantity_received} items received successfully.", items=generated_items_summary, success=True), 201
+        for spec, asset_details in zip(item_specs, asset_results):
+            generated_items_summary.append(dict(asset_details, product_name=spec['product_name_fr'], product_code=product_code))
+        audit_logger.log_action(user_id=current_admin_id, action='receive_serialized_stock_success', target_type='product', target_id=product_id, details=f"Received {quantity_received} items for {product_code_str}.", status='success', ip_address=request.remote_addr)
+        return jsonify(message=f"{quantity_received} items received successfully.", items=generated_items_summary,
+                       label_sheet_path=label_sheet_path, label_sheet_url=label_sheet_url, success=True), 201
     
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error during batch stock receipt for {product_code_str}: {e}", exc_info=True)
-        # Asset cleanup logic
-        asset_base = current_app.config['ASSET_STORAGE_PATH']
-        for asset_relative_path in all_assets_generated_for_cleanup:
-            if asset_relative_path:
-                try: 
-                    full_asset_path = os.path.join(asset_base, asset_relative_path)
-                    if os.path.exists(full_asset_path):
-                        os.remove(full_asset_path)
-                except OSError as e_clean:
-                     current_app.logger.error(f"Error cleaning up asset {asset_relative_path}: {e_clean}")
-        
-        audit_logger.log_action(user_id=current_admin_id, action='receive_serialized_stock_fail_exception', target_type='product', target_id=product_info.id, details=f"Failed for {product_code_str}: {str(e)}.", status='failure', ip_address=request.remote_addr)
+        audit_logger.log_action(user_id=current_admin_id, action='receive_serialized_stock_fail_exception', target_type='product', target_id=product_id, details=f"Failed for {product_code_str}: {str(e)}.", status='failure', ip_address=request.remote_addr)
         return jsonify(message=f"Failed to receive stock: {str(e)}", success=False), 500
 
 
+@inventory_bp.route('/assets/batches/<string:batch_id>', methods=['GET'])
+@admin_required
+def get_asset_batch_status(batch_id):
+    batch_status = AssetJobService.get_batch_status(batch_id)
+    if batch_status is None:
+        return jsonify(message=f"Asset batch '{batch_id}' not found.", success=False), 404
+    label_sheet_path = batch_status['label_sheet_path']
+    label_sheet_url = url_for('admin_api.serve_asset', asset_relative_path=label_sheet_path) if label_sheet_path else None
+    return jsonify(success=True, label_sheet_url=label_sheet_url, **batch_status), 200
+
+
+SERIALIZED_EXPORT_HEADERS = ['Item UID', 'Product Code', 'Product Name (FR)', 'Product Name (EN)', 
+                             'Variant Weight (g)', 'Variant SKU Suffix', 'Status', 'Batch Number', 
+                             'Production Date', 'Expiry Date', 'Received At', 'Sold At', 
+                             'Cost Price', 'Actual Weight (g)', 'Notes']
+
+def _serialized_export_filters(args):
+    """
+    Builds the export's WHERE clauses from query parameters: status and product_code (comma-separated),
+    received_from / received_to (ISO dates; a date-only received_to includes that whole day).
+    Raises ValueError on invalid values.
+    """
+    filters = []
+    if args.get('status'):
+        try:
+            statuses = [SerializedInventoryItemStatusEnum(value.strip().lower()) for value in args['status'].split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid status filter: '{args['status']}'.")
+        filters.append(SerializedInventoryItem.status.in_(statuses))
+    if args.get('product_code'):
+        product_codes = [code.strip().upper() for code in args['product_code'].split(',') if code.strip()]
+        filters.append(func.upper(Product.product_code).in_(product_codes))
+    for param in ('received_from', 'received_to'):
+        value = args.get(param)
+        if not value:
+            continue
+        parsed = parse_datetime_from_iso(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date for {param}: '{value}'.")
+        if param == 'received_from':
+            filters.append(SerializedInventoryItem.received_at >= parsed)
+        elif len(value) == 10: # Date only: up to the end of that day
+            filters.append(SerializedInventoryItem.received_at < parsed + timedelta(days=1))
+        else:
+            filters.append(SerializedInventoryItem.received_at <= parsed)
+    return filters
+
 @inventory_bp.route('/export/serialized_items', methods=['GET'])
 @admin_required
 def export_serialized_items_csv():
-    # ... (Existing logic, ensure Enums are handled if status is exported as string: item.status.value) ...
-    # This function was already quite detailed and mostly fine.
-    # Ensure that when fetching data, if you access an Enum field, you use .value for the CSV.
+    """
+    Streams serialized items as CSV (optionally gzip-compressed with ?gzip=true). Rows are fetched with a
+    server-side cursor in batches of INVENTORY_EXPORT_BATCH_SIZE and written as they arrive, so memory use
+    does not grow with the inventory. Filters: see _serialized_export_filters().
+    """
     audit_logger = current_app.audit_log_service
     current_admin_id = get_jwt_identity()
+    use_gzip = request.args.get('gzip', 'false').lower() in ('true', '1', 'yes')
+    batch_size = current_app.config.get('INVENTORY_EXPORT_BATCH_SIZE', 1000)
+    try:
+        filters = _serialized_export_filters(request.args)
+    except ValueError as ve:
+        return jsonify(message=str(ve), success=False), 400
+
     try:
+        pl_fr = aliased(ProductLocalization)
+        pl_en = aliased(ProductLocalization)
         items_query = db.session.query(
             SerializedInventoryItem.item_uid, Product.product_code, 
-            func.coalesce(ProductLocalization.name_fr, Product.name).label("product_name_fr"),
-            func.coalesce(ProductLocalization.name_en, Product.name).label("product_name_en"),
+            func.coalesce(pl_fr.name_fr, Product.name).label("product_name_fr"),
+            func.coalesce(pl_en.name_en, Product.name).label("product_name_en"),
             ProductWeightOption.weight_grams.label('variant_weight_grams'), 
             ProductWeightOption.sku_suffix.label('variant_sku_suffix'),
             SerializedInventoryItem.status, SerializedInventoryItem.batch_number, 
@@ -240,52 +305,67 @@ def export_serialized_items_csv():
             SerializedInventoryItem.cost_price, SerializedInventoryItem.actual_weight_grams, 
             SerializedInventoryItem.notes
         ).join(Product, SerializedInventoryItem.product_id == Product.id)\
-         .outerjoin(ProductLocalization, and_(Product.id == ProductLocalization.product_id, ProductLocalization.lang_code == 'fr'))\
-         .outerjoin(ProductLocalization.alias('pl_en'), and_(Product.id == ProductLocalization.alias('pl_en').product_id, ProductLocalization.alias('pl_en').lang_code == 'en'))\
+         .outerjoin(pl_fr, and_(Product.id == pl_fr.product_id, pl_fr.lang_code == 'fr'))\
+         .outerjoin(pl_en, and_(Product.id == pl_en.product_id, pl_en.lang_code == 'en'))\
          .outerjoin(ProductWeightOption, SerializedInventoryItem.variant_id == ProductWeightOption.id)\
+         .filter(*filters)\
          .order_by(Product.product_code, SerializedInventoryItem.item_uid)
 
-        items_data_tuples = items_query.all()
-
-        if not items_data_tuples:
+        if not db.session.query(items_query.exists()).scalar():
             return jsonify(message="No serialized items found to export.", success=False), 404
-
-        output = StringIO()
-        writer = csv.writer(output)
-        headers = ['Item UID', 'Product Code', 'Product Name (FR)', 'Product Name (EN)', 
-                   'Variant Weight (g)', 'Variant SKU Suffix', 'Status', 'Batch Number', 
-                   'Production Date', 'Expiry Date', 'Received At', 'Sold At', 
-                   'Cost Price', 'Actual Weight (g)', 'Notes']
-        writer.writerow(headers)
-
-        for item_tuple in items_data_tuples:
-            # Convert SQLAlchemy Row to something subscriptable or use getattr
-            item_dict = {col.name: getattr(item_tuple, col.name) for col in item_tuple._fields}
-            status_value = item_dict.get('status').value if isinstance(item_dict.get('status'), enum.Enum) else item_dict.get('status', '')
-
-            writer.writerow([
-                item_dict.get('item_uid', ''), item_dict.get('product_code', ''), 
-                item_dict.get('product_name_fr', ''), item_dict.get('product_name_en', ''),
-                item_dict.get('variant_weight_grams', ''), item_dict.get('variant_sku_suffix', ''),
-                status_value, 
-                item_dict.get('batch_number', ''),
-                format_datetime_for_display(item_dict.get('production_date'), fmt='%Y-%m-%d') if item_dict.get('production_date') else '',
-                format_datetime_for_display(item_dict.get('expiry_date'), fmt='%Y-%m-%d') if item_dict.get('expiry_date') else '',
-                format_datetime_for_display(item_dict.get('received_at')) if item_dict.get('received_at') else '',
-                format_datetime_for_display(item_dict.get('sold_at')) if item_dict.get('sold_at') else '',
-                item_dict.get('cost_price', ''), item_dict.get('actual_weight_grams', ''), 
-                item_dict.get('notes', '')
-            ])
-        
-        output.seek(0)
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        filename = f"maison_truvra_serialized_inventory_{timestamp}.csv"
-        audit_logger.log_action(user_id=current_admin_id, action='export_serialized_items_csv_success', details=f"Exported {len(items_data_tuples)} items.", status='success', ip_address=request.remote_addr)
-        return Response(output, mimetype="text/csv", headers={"Content-Disposition": f"attachment;filename={filename}"})
     except Exception as e:
         current_app.logger.error(f"Error exporting CSV: {e}", exc_info=True)
         return jsonify(message="Failed to export serialized items.", success=False), 500
 
+    remote_addr = request.remote_addr
+
+    def generate_csv_chunks():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(SERIALIZED_EXPORT_HEADERS)
+        exported_count = 0
+        try:
+            for item in items_query.yield_per(batch_size): # Server-side cursor where the driver supports it
+                writer.writerow([
+                    item.item_uid or '', item.product_code or '',
+                    item.product_name_fr or '', item.product_name_en or '',
+                    item.variant_weight_grams if item.variant_weight_grams is not None else '', item.variant_sku_suffix or '',
+                    item.status.value if item.status else '',
+                    item.batch_number or '',
+                    format_datetime_for_display(item.production_date, fmt='%Y-%m-%d') if item.production_date else '',
+                    format_datetime_for_display(item.expiry_date, fmt='%Y-%m-%d') if item.expiry_date else '',
+                    format_datetime_for_display(item.received_at) if item.received_at else '',
+                    format_datetime_for_display(item.sold_at) if item.sold_at else '',
+                    item.cost_price if item.cost_price is not None else '',
+                    item.actual_weight_grams if item.actual_weight_grams is not None else '',
+                    item.notes or ''
+                ])
+                exported_count += 1
+                if exported_count % batch_size == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0); buffer.truncate()
+            yield buffer.getvalue()
+        except Exception as e: # Headers are already sent; the truncated download is all we can signal
+            current_app.logger.error(f"Error while streaming CSV export after {exported_count} items: {e}", exc_info=True)
+            audit_logger.log_action(user_id=current_admin_id, action='export_serialized_items_csv_fail', details=f"Export aborted after {exported_count} items: {e}", status='failure', ip_address=remote_addr)
+            raise
+        audit_logger.log_action(user_id=current_admin_id, action='export_serialized_items_csv_success', details=f"Exported {exported_count} items.", status='success', ip_address=remote_addr)
+
+    def gzip_chunks(text_chunks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31: gzip container
+        for text_chunk in text_chunks:
+            compressed = compressor.compress(text_chunk.encode('utf-8'))
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    filename = f"maison_truvra_serialized_inventory_{timestamp}.csv"
+    body = stream_with_context(generate_csv_chunks())
+    if use_gzip:
+        return Response(gzip_chunks(body), mimetype="application/gzip", headers={"Content-Disposition": f"attachment;filename={filename}.gz"})
+    return Response(body, mimetype="text/csv", headers={"Content-Disposition": f"attachment;filename={filename}"})
+
 
 @inventory_bp.route('/import/serialized_items', methods=['POST'])
 @admin_required
@@ -297,125 +377,54 @@ def import_serialized_items_csv():
     if file.filename == '': return jsonify(message="No selected file.", success=False), 400
     if not file.filename.endswith('.csv'): return jsonify(message="Invalid file format. Only CSV.", success=False), 400
 
-    imported_count = 0; updated_count = 0; failed_rows = []; processed_count = 0
-    
-    # Define expected headers and which ones are strictly required for new items
-    # For updates via UID, only UID and fields to update are needed.
-    # For new items, Product Code is essential.
-    expected_headers = ['Item UID', 'Product Code', 'Variant SKU Suffix', 'Status', 
-                        'Batch Number', 'Production Date', 'Expiry Date', 
-                        'Cost Price', 'Actual Weight (g)', 'Notes']
-    required_for_new = ['Product Code'] # Status defaults if not provided
-
+    import_service = current_app.inventory_import_service
     try:
-        stream = StringIO(file.stream.read().decode("UTF-8-sig"), newline=None) # Use UTF-8-sig for BOM
-        reader = csv.DictReader(stream)
-        
-        # Header validation
-        csv_headers = reader.fieldnames
-        if not csv_headers:
-             return jsonify(message="CSV file is empty or has no headers.", success=False), 400
-        
-        missing_required_headers = [h for h in required_for_new if h not in csv_headers]
-        if any(h not in csv_headers for h in ['Product Code']): # At least Product Code must be there
-             return jsonify(message=f"CSV missing essential headers. Required: 'Product Code'. Found: {', '.join(csv_headers)}", success=False), 400
-
-
-        for row_num, row_dict in enumerate(reader, start=1):
-            processed_count += 1
-            # Sanitize string inputs from CSV
-            product_code = sanitize_input(row_dict.get('Product Code', '')).upper()
-            item_uid_csv = sanitize_input(row_dict.get('Item UID', ''))
-            variant_sku_csv = sanitize_input(row_dict.get('Variant SKU Suffix', '')).upper()
-            status_str = sanitize_input(row_dict.get('Status', 'available'))
-            batch_number_csv = sanitize_input(row_dict.get('Batch Number'))
-            notes_csv = sanitize_input(row_dict.get('Notes')) # Basic strip, no HTML allowed by default
-
-            # Validate status enum
-            try:
-                status_enum = SerializedInventoryItemStatusEnum(status_str.lower()) if status_str else SerializedInventoryItemStatusEnum.AVAILABLE
-            except ValueError:
-                failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f"Invalid status value: '{status_str}'."})
-                continue
-            
-            if not product_code and not item_uid_csv: # Must have at least one to identify or create
-                failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Product Code or Item UID is required.'})
-                continue
-            
-            product = None
-            if product_code:
-                product = Product.query.filter(func.upper(Product.product_code) == product_code).first()
-                if not product:
-                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Product Code {product_code} not found.'})
-                    continue
-            
-            variant_id_db = None
-            if product and variant_sku_csv: # Only look for variant if product exists
-                variant = ProductWeightOption.query.filter_by(product_id=product.id, sku_suffix=variant_sku_csv).first()
-                if not variant:
-                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Variant SKU {variant_sku_csv} not found for product {product_code}.'})
-                    continue
-                variant_id_db = variant.id
-            
-            # Parse dates and numbers carefully
-            production_date_db = parse_datetime_from_iso(sanitize_input(row_dict.get('Production Date')))
-            expiry_date_db = parse_datetime_from_iso(sanitize_input(row_dict.get('Expiry Date')))
-            cost_price_db = None
-            if row_dict.get('Cost Price'):
-                try: cost_price_db = float(sanitize_input(row_dict.get('Cost Price')))
-                except ValueError: failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Invalid Cost Price format.'}); continue
-            actual_weight_db = None
-            if row_dict.get('Actual Weight (g)'):
-                try: actual_weight_db = float(sanitize_input(row_dict.get('Actual Weight (g)')))
-                except ValueError: failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Invalid Actual Weight format.'}); continue
-
-            existing_item = None
-            if item_uid_csv:
-                existing_item = SerializedInventoryItem.query.filter_by(item_uid=item_uid_csv).first()
-            
-            if existing_item:
-                if product and existing_item.product_id != product.id: # UID exists but product code mismatch
-                     failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Item UID {item_uid_csv} exists but Product Code mismatch.'}); continue
-                
-                existing_item.status = status_enum
-                if variant_id_db is not None: existing_item.variant_id = variant_id_db # Allow changing variant if needed
-                if batch_number_csv is not None: existing_item.batch_number = batch_number_csv
-                if production_date_db is not None: existing_item.production_date = production_date_db
-                if expiry_date_db is not None: existing_item.expiry_date = expiry_date_db
-                if cost_price_db is not None: existing_item.cost_price = cost_price_db
-                if actual_weight_db is not None: existing_item.actual_weight_grams = actual_weight_db
-                if notes_csv is not None: existing_item.notes = notes_csv
-                existing_item.updated_at = datetime.now(timezone.utc)
-                updated_count += 1
-            else: # New item
-                if not product: # Product code was required for new items
-                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Product Code required for new item.'}); continue
-
-                uid_to_insert = item_uid_csv if item_uid_csv else f"{product.product_code}-{uuid.uuid4().hex[:8].upper()}"
-                # Ensure UID is unique if generated
-                while not item_uid_csv and SerializedInventoryItem.query.filter_by(item_uid=uid_to_insert).first():
-                    uid_to_insert = f"{product.product_code}-{uuid.uuid4().hex[:8].upper()}"
-
-                new_item = SerializedInventoryItem(
-                    item_uid=uid_to_insert, product_id=product.id, variant_id=variant_id_db, 
-                    status=status_enum, batch_number=batch_number_csv, 
-                    production_date=production_date_db, expiry_date=expiry_date_db,
-                    cost_price=cost_price_db, actual_weight_grams=actual_weight_db,
-                    notes=notes_csv
-                )
-                db.session.add(new_item)
-                db.session.flush() 
-                record_stock_movement(db.session, product.id, StockMovementTypeEnum.IMPORT_CSV_NEW, 1, variant_id_db, new_item.id, "CSV Import", current_admin_id)
-                imported_count += 1
-        
-        db.session.commit()
-        audit_logger.log_action(user_id=current_admin_id, action='import_serialized_csv_success', details=f"Imported: {imported_count}, Updated: {updated_count}, Failed: {len(failed_rows)} from {processed_count} rows.", status='success', ip_address=request.remote_addr)
-        return jsonify(message="CSV import processed.", imported=imported_count, updated=updated_count, failed_rows=failed_rows, total_processed=processed_count, success=True), 200
+        # The upload is streamed to disk and imported in committed chunks by an ImportJob (see InventoryImportService).
+        job = import_service.create_serialized_items_job(file, user_id=current_admin_id)
+        audit_logger.log_action(user_id=current_admin_id, action='import_serialized_csv_started', target_type='import_job', target_id=job.id, details=f"Import of {file.filename} queued.", status='info', ip_address=request.remote_addr)
+        import_service.start(job.id)
+    except CsvImportError as e:
+        return jsonify(message=str(e), success=False), 400
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error importing CSV: {e}", exc_info=True)
         return jsonify(message=f"Failed to import CSV: {str(e)}", success=False), 500
 
+    job = db.session.get(ImportJob, job.id)
+    status_url = url_for('inventory_bp.get_import_job', job_id=job.id)
+    if job.status == ImportJobStatusEnum.COMPLETED: # Ran inline (INVENTORY_IMPORT_ASYNC disabled)
+        job_dict = job.to_dict()
+        return jsonify(message="CSV import processed.", imported=job.imported_count, updated=job.updated_count,
+                       failed_rows=job_dict['failed_rows'], total_processed=job.rows_processed,
+                       job=job_dict, status_url=status_url, success=True), 200
+    return jsonify(message="CSV import started.", job=job.to_dict(), status_url=status_url, success=True), 202
+
+@inventory_bp.route('/import/jobs/<int:job_id>', methods=['GET'])
+@admin_required
+def get_import_job(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify(message=f"Import job {job_id} not found.", success=False), 404
+    return jsonify(job=job.to_dict(), success=True), 200
+
+@inventory_bp.route('/import/jobs/<int:job_id>/resume', methods=['POST'])
+@admin_required
+def resume_import_job(job_id):
+    import_service = current_app.inventory_import_service
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify(message=f"Import job {job_id} not found.", success=False), 404
+    if not import_service.is_resumable(job):
+        return jsonify(message=f"Import job {job_id} is {job.status.value} and cannot be resumed.", job=job.to_dict(), success=False), 409
+    try:
+        import_service.start(job.id)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error resuming import job {job_id}: {e}", exc_info=True)
+        return jsonify(message=f"Failed to resume import job {job_id}: {str(e)}", job=db.session.get(ImportJob, job_id).to_dict(), success=False), 500
+    job = db.session.get(ImportJob, job_id)
+    return jsonify(message=f"Import job {job_id} resumed from row {job.rows_processed + 1}.", job=job.to_dict(), success=True), 202
+
 @inventory_bp.route('/stock/adjust', methods=['POST'])
 @admin_required
 def adjust_stock():
@@ -438,32 +447,29 @@ def adjust_stock():
         return jsonify(message=f"Product code '{product_code_str}' not found.", success=False), 404
 
     variant_id_db = None
-    target_stock_entity = product 
     if variant_sku_suffix:
         variant = ProductWeightOption.query.filter_by(product_id=product.id, sku_suffix=variant_sku_suffix.upper()).first()
         if not variant:
             return jsonify(message=f"Variant SKU '{variant_sku_suffix}' not found for product '{product_code_str}'.", success=False), 404
         variant_id_db = variant.id
-        target_stock_entity = variant 
 
     try:
         quantity_change = int(quantity_change_str)
         movement_type_enum = StockMovementTypeEnum(movement_type_str) # Validate against Enum
         
-        if quantity_change != 0:
-            if target_stock_entity.aggregate_stock_quantity is None: target_stock_entity.aggregate_stock_quantity = 0
-            target_stock_entity.aggregate_stock_quantity += quantity_change
-            if target_stock_entity.aggregate_stock_quantity < 0:
-                raise ValueError("Stock quantity cannot go below zero with this adjustment.")
-        
+        # Conditional in-database increments: no lost updates, and never below zero, under concurrent writers
+        new_product_quantity, new_variant_quantity = apply_stock_counter_delta(db.session, product.id, quantity_change, variant_id=variant_id_db)
         record_stock_movement(db.session, product.id, movement_type_enum, 
                               quantity_change=quantity_change,
                               variant_id=variant_id_db, reason=reason, 
-                              related_user_id=current_admin_id, notes=reason)
+                              related_user_id=current_admin_id, notes=reason, update_counters=False)
         db.session.commit()
         audit_logger.log_action(user_id=current_admin_id, action='adjust_stock_success', target_type='product_stock', target_id=product.id, details=f"Stock for {product_code_str} (var: {variant_sku_suffix or 'N/A'}) adjusted by {quantity_change} via {movement_type_enum.value}. Reason: {reason}", status='success', ip_address=request.remote_addr)
-        return jsonify(message="Stock adjusted successfully", success=True), 200
-    except ValueError as ve: # Catches int conversion, enum conversion, stock < 0
+        return jsonify(message="Stock adjusted successfully", product_stock_quantity=new_product_quantity, variant_stock_quantity=new_variant_quantity, success=True), 200
+    except InsufficientStockError as ise:
+        db.session.rollback()
+        return jsonify(message="Stock quantity cannot go below zero with this adjustment.", available=ise.available, success=False), 409
+    except ValueError as ve: # Catches int conversion, enum conversion
         db.session.rollback()
         return jsonify(message=f"Invalid data: {ve}", success=False), 400
     except Exception as e:
@@ -471,6 +477,194 @@ def adjust_stock():
         current_app.logger.error(f"Error adjusting stock for {product_code_str}: {e}", exc_info=True)
         return jsonify(message="Failed to adjust stock", success=False), 500
 
+@inventory_bp.route('/allocations/run', methods=['POST'])
+@admin_required
+def run_fefo_allocation():
+    """
+    Allocates serialized items first-expiry-first-out to paid orders: the given `order_ids`, or the
+    next `batch_size` (default 100) paid orders with outstanding lines. Short lines are reported, not failed.
+    """
+    data = request.json or {}
+    current_admin_id = get_jwt_identity()
+    audit_logger = current_app.audit_log_service
+    try:
+        batch_size = min(max(int(data.get('batch_size', 100)), 1), 1000)
+        order_ids = [int(order_id) for order_id in data.get('order_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify(message="'order_ids' must be a list of integers and 'batch_size' an integer.", success=False), 400
+
+    try:
+        if order_ids:
+            result = StockAllocationService.allocate_orders(order_ids)
+        else:
+            result = StockAllocationService.allocate_pending(batch_size=batch_size)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        audit_logger.log_action(user_id=current_admin_id, action='fefo_allocation_fail', target_type='order', details=str(e), status='failure', ip_address=request.remote_addr)
+        current_app.logger.error(f"Error running FEFO allocation: {e}", exc_info=True)
+        return jsonify(message="Failed to allocate stock to orders.", success=False), 500
+
+    audit_logger.log_action(user_id=current_admin_id, action='fefo_allocation_success', target_type='order', details=f"Allocated {result['items_allocated']} item(s) to {result['lines_allocated']} line(s); {len(result['short_lines'])} line(s) short.", status='success', ip_address=request.remote_addr)
+    return jsonify(success=True, **result), 200
+
+@inventory_bp.route('/stock/at', methods=['GET'])
+@admin_required
+def get_stock_at():
+    """
+    Stock per product/variant at a point in time, reconstructed from the nearest daily snapshot plus
+    the movements since (see database.stock_at). `at`: ISO datetime, or a date for the end of that day.
+    Optional `product_code` (comma-separated). Values use current list prices (variant price or base price).
+    """
+    at_str = request.args.get('at')
+    if not at_str:
+        return jsonify(message="Parameter 'at' (ISO date or datetime) is required.", success=False), 400
+    at_dt = parse_datetime_from_iso(at_str)
+    if at_dt is None:
+        return jsonify(message=f"Invalid 'at' value: '{at_str}'.", success=False), 400
+    if len(at_str) == 10: # Date only: stock at the end of that day
+        at_dt += timedelta(days=1)
+    at_naive_utc = at_dt.astimezone(timezone.utc).replace(tzinfo=None) # DateTime columns hold naive UTC
+
+    try:
+        product_ids = None
+        if request.args.get('product_code'):
+            product_codes = [code.strip().upper() for code in request.args['product_code'].split(',') if code.strip()]
+            product_ids = [pid for (pid,) in db.session.query(Product.id).filter(func.upper(Product.product_code).in_(product_codes))]
+            if not product_ids:
+                return jsonify(message="Product not found", success=False), 404
+
+        quantities, boundary = stock_at(at_naive_utc, product_ids=product_ids)
+        involved_product_ids = {pid for pid, _ in quantities}
+        products = {p.id: p for p in db.session.query(Product.id, Product.product_code, Product.name, Product.base_price).filter(Product.id.in_(involved_product_ids))}
+        variants = {v.id: v for v in db.session.query(ProductWeightOption.id, ProductWeightOption.sku_suffix, ProductWeightOption.price).filter(ProductWeightOption.product_id.in_(involved_product_ids))}
+
+        stock_by_product = {}
+        for (product_id, variant_id), quantity in sorted(quantities.items(), key=lambda kv: (kv[0][0], kv[0][1] or 0)):
+            product = products.get(product_id)
+            if product is None: # Product deleted since
+                continue
+            entry = stock_by_product.setdefault(product_id, {
+                "product_id": product_id, "product_code": product.product_code, "name": product.name,
+                "quantity": 0, "value_at_list_price": 0.0, "variants": []
+            })
+            variant = variants.get(variant_id) if variant_id else None
+            unit_price = (variant.price if variant else product.base_price) or 0.0
+            entry["quantity"] += quantity
+            entry["value_at_list_price"] += quantity * unit_price
+            if variant_id:
+                entry["variants"].append({"variant_id": variant_id, "sku_suffix": variant.sku_suffix if variant else None, "quantity": quantity})
+
+        stock_list = list(stock_by_product.values())
+        for entry in stock_list:
+            entry["value_at_list_price"] = round(entry["value_at_list_price"], 2)
+        return jsonify(
+            at=at_naive_utc.isoformat(), snapshot_boundary=boundary.isoformat() if boundary else None,
+            products=stock_list, total_quantity=sum(e["quantity"] for e in stock_list),
+            total_value_at_list_price=round(sum(e["value_at_list_price"] for e in stock_list), 2),
+            success=True
+        ), 200
+    except Exception as e:
+        current_app.logger.error(f"Error reconstructing stock at {at_str}: {e}", exc_info=True)
+        return jsonify(message="Failed to reconstruct stock", success=False), 500
+
+def _stock_movement_filters(args):
+    """
+    Builds the movement query's WHERE clauses from query parameters: product_code and movement_type
+    (comma-separated), related_order_id, related_user_id, date_from / date_to (ISO; a date-only
+    date_to includes that whole day). Raises ValueError on invalid values.
+    """
+    filters = []
+    if args.get('product_code'):
+        product_codes = [code.strip().upper() for code in args['product_code'].split(',') if code.strip()]
+        product_ids = [pid for (pid,) in db.session.query(Product.id).filter(func.upper(Product.product_code).in_(product_codes))]
+        filters.append(StockMovement.product_id.in_(product_ids))
+    if args.get('movement_type'):
+        try:
+            movement_types = [StockMovementTypeEnum(value.strip().lower()) for value in args['movement_type'].split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid movement_type filter: '{args['movement_type']}'.")
+        filters.append(StockMovement.movement_type.in_(movement_types))
+    for param, column in (('related_order_id', StockMovement.related_order_id), ('related_user_id', StockMovement.related_user_id)):
+        if args.get(param):
+            try:
+                filters.append(column == int(args[param]))
+            except ValueError:
+                raise ValueError(f"Invalid {param}: '{args[param]}'.")
+    for param in ('date_from', 'date_to'):
+        value = args.get(param)
+        if not value:
+            continue
+        parsed = parse_datetime_from_iso(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date for {param}: '{value}'.")
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None) # DateTime columns hold naive UTC
+        if param == 'date_from':
+            filters.append(StockMovement.movement_date >= parsed)
+        elif len(value) == 10: # Date only: up to the end of that day
+            filters.append(StockMovement.movement_date < parsed + timedelta(days=1))
+        else:
+            filters.append(StockMovement.movement_date <= parsed)
+    return filters
+
+STOCK_MOVEMENT_GROUPINGS = ('day', 'type')
+
+@inventory_bp.route('/stock/movements', methods=['GET'])
+@admin_required
+def get_stock_movements():
+    """
+    Stock movements across products, newest first, filtered as in _stock_movement_filters.
+    Keyset-paginated on (movement_date, id): pass `cursor` (empty for the first page) and `per_page`
+    (max 500); `include_total=true` adds a COUNT. With `group_by=day`, `type` or `day,type`, returns
+    instead the movement count and summed quantity/weight change per group (unpaginated).
+    """
+    try:
+        filters = _stock_movement_filters(request.args)
+    except ValueError as ve:
+        return jsonify(message=str(ve), success=False), 400
+
+    group_by = [value.strip().lower() for value in request.args.get('group_by', '').split(',') if value.strip()]
+    if any(value not in STOCK_MOVEMENT_GROUPINGS for value in group_by):
+        return jsonify(message=f"Invalid group_by. Allowed: {', '.join(STOCK_MOVEMENT_GROUPINGS)}", success=False), 400
+
+    try:
+        if group_by:
+            group_columns = []
+            if 'day' in group_by:
+                group_columns.append(func.date(StockMovement.movement_date).label('day'))
+            if 'type' in group_by:
+                group_columns.append(StockMovement.movement_type)
+            rows = db.session.query(
+                *group_columns, func.count(StockMovement.id).label('movement_count'),
+                func.coalesce(func.sum(StockMovement.quantity_change), 0).label('quantity_change'),
+                func.coalesce(func.sum(StockMovement.weight_change_grams), 0.0).label('weight_change_grams')
+            ).filter(*filters).group_by(*group_columns).order_by(*group_columns).all()
+            groups = []
+            for row in rows:
+                group = {"movement_count": row.movement_count, "quantity_change": int(row.quantity_change), "weight_change_grams": float(row.weight_change_grams)}
+                if 'day' in group_by:
+                    group["day"] = str(row.day) # date() comes back as a string on SQLite, a date elsewhere
+                if 'type' in group_by:
+                    group["movement_type"] = row.movement_type.value if row.movement_type else None
+                groups.append(group)
+            return jsonify(groups=groups, group_by=group_by, success=True), 200
+
+        per_page = min(max(request.args.get('per_page', 100, type=int), 1), 500)
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+        query = StockMovement.query.filter(*filters)
+        movements, next_cursor, total = paginate_keyset(
+            query, StockMovement.movement_date, StockMovement.id, cursor=request.args.get('cursor') or None,
+            per_page=per_page, descending=True, include_total=include_total
+        )
+        pagination_data = {"per_page": per_page, "next_cursor": next_cursor, "has_more": next_cursor is not None}
+        if include_total: pagination_data["total_items"] = total
+        return jsonify(movements=[m.to_dict() for m in movements], pagination=pagination_data, success=True), 200
+    except ValueError as ve: # Malformed cursor
+        return jsonify(message=str(ve), success=False), 400
+    except Exception as e:
+        current_app.logger.error(f"Error querying stock movements: {e}", exc_info=True)
+        return jsonify(message="Failed to fetch stock movements", success=False), 500
+
 @inventory_bp.route('/product/<string:product_code>', methods=['GET'])
 @admin_required
 def get_admin_product_inventory_details(product_code):
@@ -504,6 +698,7 @@ def get_admin_product_inventory_details(product_code):
         if not (variant_sku_suffix and not target_variant_id): 
             movements_models = movements_query.order_by(StockMovement.movement_date.desc()).limit(100).all()
             details['stock_movements_log'] = [m.to_dict() for m in movements_models] # Assuming to_dict handles Enum.value
+        details['stock_movements_url'] = url_for('inventory_bp.get_stock_movements', product_code=product.product_code) # Full, paginated history
         
         return jsonify(details=details, success=True), 200
     except Exception as e:
@@ -511,6 +706,23 @@ def get_admin_product_inventory_details(product_code):
         return jsonify(message="Failed to fetch inventory details", success=False), 500
 
 
+# Statuses an admin can manually set. Others (like 'sold', 'allocated') are system-set.
+MANUAL_ITEM_STATUSES = [
+    SerializedInventoryItemStatusEnum.AVAILABLE, 
+    SerializedInventoryItemStatusEnum.DAMAGED, 
+    SerializedInventoryItemStatusEnum.RECALLED, 
+    SerializedInventoryItemStatusEnum.RESERVED_INTERNAL, 
+    SerializedInventoryItemStatusEnum.MISSING
+]
+# Items in these statuses are linked to an order line (order_item_id); manual and bulk updates must not move
+# them, or the jar would count as stock again while its order line silently loses its allocation.
+ORDER_HELD_ITEM_STATUSES = (
+    SerializedInventoryItemStatusEnum.ALLOCATED,
+    SerializedInventoryItemStatusEnum.SOLD
+)
+BULK_STATUS_MAX_UIDS = 10000 # Larger selections should use the batch_number filter
+BULK_STATUS_AUDIT_MAX_UIDS = 100 # UIDs listed in a bulk update's audit entry; larger selections are logged as a count
+
 @inventory_bp.route('/serialized/items/<string:item_uid>/status', methods=['PUT'])
 @admin_required
 def update_serialized_item_status(item_uid):
@@ -528,16 +740,8 @@ def update_serialized_item_status(item_uid):
     except ValueError:
         return jsonify(message=f"Invalid status value: '{new_status_str}'.", success=False), 400
 
-    # Define statuses an admin can manually set. Others (like 'sold', 'allocated') are system-set.
-    allowed_manual_statuses = [
-        SerializedInventoryItemStatusEnum.AVAILABLE, 
-        SerializedInventoryItemStatusEnum.DAMAGED, 
-        SerializedInventoryItemStatusEnum.RECALLED, 
-        SerializedInventoryItemStatusEnum.RESERVED_INTERNAL, 
-        SerializedInventoryItemStatusEnum.MISSING
-    ]
-    if new_status_enum not in allowed_manual_statuses:
-        return jsonify(message=f"Invalid status for manual update. Allowed: {', '.join(s.value for s in allowed_manual_statuses)}", success=False), 400
+    if new_status_enum not in MANUAL_ITEM_STATUSES:
+        return jsonify(message=f"Invalid status for manual update. Allowed: {', '.join(s.value for s in MANUAL_ITEM_STATUSES)}", success=False), 400
 
     try:
         item = SerializedInventoryItem.query.filter_by(item_uid=item_uid).first()
@@ -546,30 +750,123 @@ def update_serialized_item_status(item_uid):
         old_status_enum = item.status # This is already an Enum member
         if old_status_enum == new_status_enum:
             return jsonify(message="Status unchanged.", item_status=new_status_enum.value, success=True), 200
+        if old_status_enum in ORDER_HELD_ITEM_STATUSES:
+            return jsonify(message=f"Item {item_uid} is {old_status_enum.value} for an order; change it through its order, not manually.", success=False), 409
 
-        item.status = new_status_enum
-        current_item_notes = item.notes or ""
+        item_notes = item.notes
         if notes:
-            item.notes = f"{current_item_notes}\n[{format_datetime_for_display(None)} by AdminID:{current_admin_id}]: Status {old_status_enum.value} -> {new_status_enum.value}. Reason: {notes}".strip()
-        item.updated_at = datetime.now(timezone.utc)
-        
-        qty_change_agg = 0
-        if old_status_enum == SerializedInventoryItemStatusEnum.AVAILABLE and new_status_enum != SerializedInventoryItemStatusEnum.AVAILABLE: 
-            qty_change_agg = -1
-        elif old_status_enum != SerializedInventoryItemStatusEnum.AVAILABLE and new_status_enum == SerializedInventoryItemStatusEnum.AVAILABLE: 
-            qty_change_agg = 1
+            item_notes = f"{item.notes or ''}\n[{format_datetime_for_display(None)} by AdminID:{current_admin_id}]: Status {old_status_enum.value} -> {new_status_enum.value}. Reason: {notes}".strip()
+        # Compare-and-set on the status, so two concurrent updates cannot both count the same transition
+        updated = SerializedInventoryItem.query.filter(
+            SerializedInventoryItem.id == item.id, SerializedInventoryItem.status == old_status_enum
+        ).update({
+            SerializedInventoryItem.status: new_status_enum, SerializedInventoryItem.notes: item_notes,
+            SerializedInventoryItem.updated_at: datetime.now(timezone.utc)
+        }, synchronize_session=False)
+        if not updated:
+            db.session.rollback()
+            return jsonify(message=f"Status of {item_uid} was changed concurrently; reload and retry.", success=False), 409
         
+        qty_change_agg = serialized_availability_change(old_status_enum, new_status_enum)
         if qty_change_agg != 0:
-            target_stock_entity = ProductWeightOption.query.get(item.variant_id) if item.variant_id else Product.query.get(item.product_id)
-            if target_stock_entity:
-                if target_stock_entity.aggregate_stock_quantity is None: target_stock_entity.aggregate_stock_quantity = 0
-                target_stock_entity.aggregate_stock_quantity += qty_change_agg
+            record_stock_movement(db.session, item.product_id, status_change_movement_type(qty_change_agg),
+                                  quantity_change=qty_change_agg, variant_id=item.variant_id, serialized_item_id=item.id,
+                                  reason=f"Status {old_status_enum.value} -> {new_status_enum.value}",
+                                  related_user_id=current_admin_id, notes=notes or None)
         
         db.session.commit()
         audit_logger.log_action(user_id=current_admin_id, action='update_item_status_success', target_type='serialized_item', target_id=item_uid, details=f"Status of {item_uid} from '{old_status_enum.value}' to '{new_status_enum.value}'. Notes: {notes}", status='success', ip_address=request.remote_addr)
         return jsonify(message=f"Status of {item_uid} updated to {new_status_enum.value}.", success=True), 200
+    except InsufficientStockError as ise:
+        db.session.rollback()
+        current_app.logger.error(f"Stock counter inconsistent while updating status for {item_uid}: {ise}")
+        return jsonify(message=f"Stock counters are inconsistent for this item's product ({ise}); run `flask recompute-stock`.", success=False), 409
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error updating status for {item_uid}: {e}", exc_info=True)
         return jsonify(message="Failed to update item status", success=False), 500
 
+
+@inventory_bp.route('/serialized/items/status', methods=['POST'])
+@admin_required
+def bulk_update_serialized_items_status():
+    """
+    Transitions many serialized items at once (e.g. a recall): select them with `item_uids` (list) or
+    `batch_number` (optionally narrowed by `product_code`). Counters, stock movements and item notes are
+    updated set-wise (see database.bulk_update_serialized_item_status) and one summary audit entry is written.
+    """
+    data = request.json or {}
+    new_status_str = data.get('status')
+    notes = sanitize_input(data.get('notes', ''))
+    item_uids = data.get('item_uids')
+    batch_number = sanitize_input(data.get('batch_number'))
+    product_code = data.get('product_code')
+    current_admin_id = get_jwt_identity()
+    audit_logger = current_app.audit_log_service
+
+    if not new_status_str: return jsonify(message="New status required", success=False), 400
+    try:
+        new_status_enum = SerializedInventoryItemStatusEnum(new_status_str.lower())
+    except ValueError:
+        return jsonify(message=f"Invalid status value: '{new_status_str}'.", success=False), 400
+    if new_status_enum not in MANUAL_ITEM_STATUSES:
+        return jsonify(message=f"Invalid status for manual update. Allowed: {', '.join(s.value for s in MANUAL_ITEM_STATUSES)}", success=False), 400
+    if bool(item_uids) == bool(batch_number):
+        return jsonify(message="Provide either 'item_uids' or 'batch_number'.", success=False), 400
+    if item_uids is not None and (not isinstance(item_uids, list) or len(item_uids) > BULK_STATUS_MAX_UIDS):
+        return jsonify(message=f"'item_uids' must be a list of at most {BULK_STATUS_MAX_UIDS} UIDs; use 'batch_number' for larger selections.", success=False), 400
+
+    selection_query = db.session.query(SerializedInventoryItem.id, SerializedInventoryItem.item_uid, SerializedInventoryItem.status)
+    if item_uids:
+        item_uids = list({sanitize_input(str(uid)) for uid in item_uids} - {'', None})
+        selection_query = selection_query.filter(SerializedInventoryItem.item_uid.in_(item_uids))
+        selection_label = f"{len(item_uids)} listed UID(s)"
+    else:
+        selection_query = selection_query.filter(SerializedInventoryItem.batch_number == batch_number)
+        selection_label = f"batch {batch_number}"
+        if product_code:
+            product = Product.query.filter(func.upper(Product.product_code) == product_code.upper()).first()
+            if not product:
+                return jsonify(message=f"Product code '{product_code}' not found.", success=False), 404
+            selection_query = selection_query.filter(SerializedInventoryItem.product_id == product.id)
+            selection_label += f" of {product.product_code}"
+
+    try:
+        selected = selection_query.all()
+        if not selected:
+            return jsonify(message="No items match the selection.", success=False), 404
+        # Allocated/sold items stay with their orders (re-checked under the row lock by the bulk update)
+        order_held_uids = sorted(uid for _, uid, status in selected if status in ORDER_HELD_ITEM_STATUSES)
+        result = bulk_update_serialized_item_status(
+            db.session, [item_id for item_id, _, status in selected if status not in ORDER_HELD_ITEM_STATUSES], new_status_enum,
+            notes=notes or None, note_prefix=f"[{format_datetime_for_display(None)} by AdminID:{current_admin_id}]",
+            related_user_id=current_admin_id, excluded_statuses=ORDER_HELD_ITEM_STATUSES
+        )
+        db.session.commit()
+    except InsufficientStockError as ise:
+        db.session.rollback()
+        current_app.logger.error(f"Stock counter inconsistent during bulk status update of {selection_label}: {ise}")
+        return jsonify(message=f"Stock counters are inconsistent ({ise}); run `flask recompute-stock`.", success=False), 409
+    except Exception as e:
+        db.session.rollback()
+        audit_logger.log_action(user_id=current_admin_id, action='bulk_update_item_status_fail', target_type='serialized_item', details=f"{selection_label} -> {new_status_enum.value}: {e}", status='failure', ip_address=request.remote_addr)
+        current_app.logger.error(f"Error in bulk status update of {selection_label}: {e}", exc_info=True)
+        return jsonify(message="Failed to update item statuses", success=False), 500
+
+    not_found_uids = sorted(set(item_uids) - {uid for _, uid, _ in selected}) if item_uids else []
+    audit_details = f"{result['transitioned']} of {len(selected)} item(s) from {selection_label} set to '{new_status_enum.value}'."
+    if item_uids:
+        selected_uids = sorted(uid for _, uid, _ in selected)
+        listed_uids = ', '.join(selected_uids[:BULK_STATUS_AUDIT_MAX_UIDS])
+        if len(selected_uids) > BULK_STATUS_AUDIT_MAX_UIDS:
+            listed_uids += f" (+{len(selected_uids) - BULK_STATUS_AUDIT_MAX_UIDS} more)"
+        audit_details += f" Items: {listed_uids}."
+    if order_held_uids:
+        audit_details += f" Skipped {len(order_held_uids)} allocated/sold item(s)."
+    audit_details += f" Net stock change: {sum(c['quantity_change'] for c in result['stock_changes'])}. Notes: {notes}"
+    audit_logger.log_action(user_id=current_admin_id, action='bulk_update_item_status_success', target_type='serialized_item', target_id=batch_number or None, details=audit_details, status='success', ip_address=request.remote_addr)
+    return jsonify(
+        message=f"{result['transitioned']} item(s) updated to {new_status_enum.value}.",
+        matched=len(selected), transitioned=result['transitioned'], unchanged=len(selected) - result['transitioned'],
+        not_found_uids=not_found_uids, order_held_uids=order_held_uids, stock_changes=result['stock_changes'], success=True
+    ), 200
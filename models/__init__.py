@@ -10,13 +10,13 @@ from .product_models import (
     ProductB2BTierPrice, ProductLocalization, CategoryLocalization
 )
 from .order_models import Order, OrderItem, QuoteRequest, QuoteRequestItem, Invoice, InvoiceItem
-from .inventory_models import SerializedInventoryItem, StockMovement
-from .utility_models import Review, Cart, CartItem, NewsletterSubscription, Setting, GeneratedAsset, AuditLog
+from .inventory_models import SerializedInventoryItem, StockMovement, StockSnapshot, StockReservation
+from .utility_models import Review, Cart, CartItem, NewsletterSubscription, Setting, GeneratedAsset, AssetJob, ImportJob, StaticJsonJob, AuditLog
 from .enums import (
     UserRoleEnum, ProfessionalStatusEnum, B2BPricingTierEnum, ProductTypeEnum, 
     PreservationTypeEnum, SerializedInventoryItemStatusEnum, StockMovementTypeEnum, 
     OrderStatusEnum, InvoiceStatusEnum, AuditLogStatusEnum, AssetTypeEnum, 
-    NewsletterTypeEnum, QuoteRequestStatusEnum
+    NewsletterTypeEnum, QuoteRequestStatusEnum, AssetJobStatusEnum, ImportJobStatusEnum, StaticJsonJobStatusEnum
 )
 
 # You can optionally create an __all__ variable to define the public API of this package
@@ -25,10 +25,10 @@ __all__ = [
     'Category', 'Product', 'ProductImage', 'ProductWeightOption', 'ProductB2BTierPrice',
     'ProductLocalization', 'CategoryLocalization',
     'Order', 'OrderItem', 'QuoteRequest', 'QuoteRequestItem', 'Invoice', 'InvoiceItem',
-    'SerializedInventoryItem', 'StockMovement',
-    'Review', 'Cart', 'CartItem', 'NewsletterSubscription', 'Setting', 'GeneratedAsset', 'AuditLog',
+    'SerializedInventoryItem', 'StockMovement', 'StockSnapshot', 'StockReservation',
+    'Review', 'Cart', 'CartItem', 'NewsletterSubscription', 'Setting', 'GeneratedAsset', 'AssetJob', 'ImportJob', 'StaticJsonJob', 'AuditLog',
     'UserRoleEnum', 'ProfessionalStatusEnum', 'B2BPricingTierEnum', 'ProductTypeEnum',
     'PreservationTypeEnum', 'SerializedInventoryItemStatusEnum', 'StockMovementTypeEnum',
     'OrderStatusEnum', 'InvoiceStatusEnum', 'AuditLogStatusEnum', 'AssetTypeEnum',
-    'NewsletterTypeEnum', 'QuoteRequestStatusEnum'
+    'NewsletterTypeEnum', 'QuoteRequestStatusEnum', 'AssetJobStatusEnum', 'ImportJobStatusEnum', 'StaticJsonJobStatusEnum'
 ]
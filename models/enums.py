@@ -112,11 +112,32 @@ class AssetTypeEnum(enum.Enum):
     QR_CODE = "qr_code"
     PASSPORT_HTML = "passport_html"
     LABEL_PDF = "label_pdf"
+    LABEL_SHEET_PDF = "label_sheet_pdf"
+    LABEL_SHEET_ZPL = "label_sheet_zpl"
+    INVOICE_PDF = "invoice_pdf"
     PRODUCT_IMAGE = "product_image"
     CATEGORY_IMAGE = "category_image"
     PROFESSIONAL_DOCUMENT = "professional_document"
     PURCHASE_ORDER_FILE = "purchase_order_file"
 
+class AssetJobStatusEnum(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class ImportJobStatusEnum(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class StaticJsonJobStatusEnum(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
 class NewsletterTypeEnum(enum.Enum):
     B2C = "b2c"
     B2B = "b2b"
@@ -23,7 +23,7 @@ class SerializedInventoryItem(db.Model):
     supplier_id = db.Column(db.Integer, nullable=True)
     received_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     sold_at = db.Column(db.DateTime, nullable=True)
-    order_item_id = db.Column(db.Integer, db.ForeignKey('order_items.id', ondelete='SET NULL'), unique=True, index=True, nullable=True)
+    order_item_id = db.Column(db.Integer, db.ForeignKey('order_items.id', ondelete='SET NULL'), index=True, nullable=True) # Several jars per order line (FEFO allocation)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
@@ -59,6 +59,14 @@ class StockMovement(db.Model):
     movement_date = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     notes = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_stock_movements_product_variant_date', 'product_id', 'variant_id', 'movement_date'),
+        db.Index('ix_stock_movements_product_date', 'product_id', 'movement_date'),
+        db.Index('ix_stock_movements_type_date', 'movement_type', 'movement_date'),
+        db.Index('ix_stock_movements_user_date', 'related_user_id', 'movement_date'),
+        db.Index('ix_stock_movements_order_date', 'related_order_id', 'movement_date'),
+    )
+
     product = db.relationship('Product', back_populates='stock_movements')
     variant = db.relationship('ProductWeightOption', back_populates='stock_movements')
     serialized_item = db.relationship('SerializedInventoryItem', back_populates='stock_movements')
@@ -70,5 +78,61 @@ class StockMovement(db.Model):
             "serialized_item_id": self.serialized_item_id,
             "movement_type": self.movement_type.value if self.movement_type else None,
             "quantity_change": self.quantity_change, "weight_change_grams": self.weight_change_grams,
-            "reason": self.reason, "movement_date": self.movement_date.isoformat(), "notes": self.notes
+            "reason": self.reason, "movement_date": self.movement_date.isoformat(), "notes": self.notes,
+            "related_order_id": self.related_order_id, "related_user_id": self.related_user_id
+        }
+
+class StockSnapshot(db.Model):
+    """
+    Cumulative stock of a product/variant (variant_id NULL: movements without a variant) from all
+    movements dated before snapshot_at. Rows are sparse: a day only gets a row for the keys that moved
+    that day, earlier rows carry forward. Built by `flask snapshot-stock`.
+    """
+    __tablename__ = 'stock_snapshots'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    variant_id = db.Column(db.Integer, db.ForeignKey('product_weight_options.id', ondelete='CASCADE'), nullable=True)
+    snapshot_at = db.Column(db.DateTime, nullable=False, index=True) # Exclusive upper bound (midnight UTC)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    movement_count = db.Column(db.Integer, nullable=False, default=0) # Movements of the day that led to this row
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'variant_id', 'snapshot_at', name='uq_stock_snapshot_key_day'),
+        db.Index('ix_stock_snapshots_product_at', 'product_id', 'snapshot_at'),
+    )
+
+    def to_dict(self):
+        return {
+            "product_id": self.product_id, "variant_id": self.variant_id,
+            "snapshot_at": self.snapshot_at.isoformat() if self.snapshot_at else None,
+            "quantity": self.quantity, "movement_count": self.movement_count
+        }
+
+class StockReservation(db.Model):
+    """
+    Quantity of a product/variant held for a cart line (and, once checked out, its order) until expires_at.
+    Rows are mirrored by Product/ProductWeightOption.reserved_stock_quantity; only StockReservationService
+    should write them. Cart links are SET NULL so that deleting a cart never drops a hold behind the
+    counters' back: orphaned holds simply expire and are swept.
+    """
+    __tablename__ = 'stock_reservations'
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('carts.id', ondelete='SET NULL'), nullable=True, index=True)
+    cart_item_id = db.Column(db.Integer, db.ForeignKey('cart_items.id', ondelete='SET NULL'), nullable=True, index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True)
+    variant_id = db.Column(db.Integer, db.ForeignKey('product_weight_options.id', ondelete='CASCADE'), nullable=True, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (db.UniqueConstraint('cart_id', 'product_id', 'variant_id', name='uq_stock_reservation_cart_line'),)
+
+    def to_dict(self):
+        return {
+            "id": self.id, "cart_id": self.cart_id, "order_id": self.order_id,
+            "product_id": self.product_id, "variant_id": self.variant_id, "quantity": self.quantity,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None
         }
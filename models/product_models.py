@@ -3,6 +3,8 @@ from .base import db
 from .enums import ProductTypeEnum, PreservationTypeEnum, B2BPricingTierEnum
 from datetime import datetime, timezone
 
+_LOCALIZATION_NOT_LOADED = object() # Product.to_dict default: query the localization itself
+
 class Category(db.Model):
     __tablename__ = 'categories'
     id = db.Column(db.Integer, primary_key=True)
@@ -53,6 +55,13 @@ class Product(db.Model):
     preservation_type = db.Column(db.Enum(PreservationTypeEnum, name="preservation_type_enum_v2"), nullable=True, default=PreservationTypeEnum.NOT_SPECIFIED)
     notes_internal = db.Column(db.Text, nullable=True) 
     supplier_info = db.Column(db.String(255), nullable=True) 
+    # Maintained counter: running total of StockMovement.quantity_change for this product, across all
+    # of its variants. Updated by record_stock_movement; rebuilt by `flask recompute-stock`.
+    # It is ledger stock (every variant, active or not); availability moves of serialized items are
+    # recorded as +/-1 movements, so non-AVAILABLE items are not counted.
+    aggregate_stock_quantity = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # Maintained counter: quantity held by active StockReservation rows (see StockReservationService).
+    reserved_stock_quantity = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
@@ -67,31 +76,10 @@ class Product(db.Model):
     localizations = db.relationship('ProductLocalization', back_populates='product', lazy='dynamic', cascade="all, delete-orphan")
     generated_assets = db.relationship('GeneratedAsset', foreign_keys='GeneratedAsset.related_product_id', back_populates='product_asset_owner', lazy='dynamic')
     b2b_tier_prices = db.relationship('ProductB2BTierPrice', back_populates='product', lazy='dynamic', cascade="all, delete-orphan")
-
-    @property
-    def aggregate_stock_quantity(self):
-        if self.type == ProductTypeEnum.VARIABLE_WEIGHT:
-            total_variant_stock = db.session.query(
-                db.func.sum(ProductWeightOption.aggregate_stock_quantity)
-            ).filter(
-                ProductWeightOption.product_id == self.id,
-                ProductWeightOption.is_active == True
-            ).scalar()
-            return total_variant_stock or 0
-        elif self.type == ProductTypeEnum.SIMPLE:
-            from .inventory_models import SerializedInventoryItem, SerializedInventoryItemStatusEnum
-            simple_serialized_stock = db.session.query(
-                db.func.count(SerializedInventoryItem.id)
-            ).filter(
-                SerializedInventoryItem.product_id == self.id,
-                SerializedInventoryItem.variant_id == None,
-                SerializedInventoryItem.status == SerializedInventoryItemStatusEnum.AVAILABLE
-            ).scalar()
-            return simple_serialized_stock or 0
-        return 0
         
-    def to_dict(self, lang_code='fr'):
-        loc = self.localizations.filter_by(lang_code=lang_code).first()
+    def to_dict(self, lang_code='fr', localization=_LOCALIZATION_NOT_LOADED):
+        """`localization`: this product's ProductLocalization for `lang_code` (or None), when listings prefetch them."""
+        loc = self.localizations.filter_by(lang_code=lang_code).first() if localization is _LOCALIZATION_NOT_LOADED else localization
         name_display = self.name 
         description_display = self.description
         long_description_display = self.long_description
@@ -99,8 +87,14 @@ class Product(db.Model):
         return {
             "id": self.id, "name": name_display,
             # ... (all other fields for the dictionary) ...
-            "aggregate_stock_quantity": self.aggregate_stock_quantity
+            "aggregate_stock_quantity": self.aggregate_stock_quantity,
+            "available_stock_quantity": self.available_stock_quantity
         }
+    @property
+    def available_stock_quantity(self):
+        """Stock that can still be put in a cart: on hand minus active reservations."""
+        return max((self.aggregate_stock_quantity or 0) - (self.reserved_stock_quantity or 0), 0)
+
     def __repr__(self): return f'<Product {self.name}>'
 
 class ProductImage(db.Model):
@@ -121,6 +115,7 @@ class ProductWeightOption(db.Model):
     price = db.Column(db.Float, nullable=False)
     sku_suffix = db.Column(db.String(50), nullable=False) 
     aggregate_stock_quantity = db.Column(db.Integer, default=0, nullable=False) 
+    reserved_stock_quantity = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     is_active = db.Column(db.Boolean, default=True, index=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -134,6 +129,10 @@ class ProductWeightOption(db.Model):
     __table_args__ = (db.UniqueConstraint('product_id', 'weight_grams', name='uq_product_weight_v2'),
                       db.UniqueConstraint('product_id', 'sku_suffix', name='uq_product_sku_suffix_v2'))
 
+    @property
+    def available_stock_quantity(self):
+        return max((self.aggregate_stock_quantity or 0) - (self.reserved_stock_quantity or 0), 0)
+
 class ProductB2BTierPrice(db.Model):
     __tablename__ = 'product_b2b_tier_prices'
     id = db.Column(db.Integer, primary_key=True)
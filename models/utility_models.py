@@ -1,6 +1,7 @@
 # backend/models/utility_models.py
+import json
 from .base import db
-from .enums import AuditLogStatusEnum, AssetTypeEnum, NewsletterTypeEnum
+from .enums import AuditLogStatusEnum, AssetTypeEnum, NewsletterTypeEnum, AssetJobStatusEnum, ImportJobStatusEnum, StaticJsonJobStatusEnum
 from datetime import datetime, timezone
 
 class NewsletterSubscription(BaseModel):
@@ -99,12 +100,100 @@ class GeneratedAsset(db.Model):
     asset_type = db.Column(db.Enum(AssetTypeEnum, name="asset_type_enum_v2"), nullable=False, index=True)
     related_item_uid = db.Column(db.String(100), db.ForeignKey('serialized_inventory_items.item_uid', ondelete='SET NULL'), index=True, nullable=True) 
     related_product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), index=True, nullable=True) 
-    file_path = db.Column(db.String(255), nullable=False, unique=True) 
+    file_path = db.Column(db.String(255), nullable=False, index=True) # Asset store blobs are shared; each row is one reference
     generated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     inventory_item_asset_owner = db.relationship('SerializedInventoryItem', back_populates='generated_assets', foreign_keys=[related_item_uid])
     product_asset_owner = db.relationship('Product', back_populates='generated_assets', foreign_keys=[related_product_id])
 
+class AssetJob(db.Model):
+    __tablename__ = 'asset_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), nullable=False, index=True) # Groups the jobs of one stock receipt
+    job_type = db.Column(db.String(20), nullable=False, default='item_assets', server_default='item_assets') # 'item_assets' or 'receipt_batch' (see AssetJobService)
+    item_uid = db.Column(db.String(100), db.ForeignKey('serialized_inventory_items.item_uid', ondelete='CASCADE'), index=True, nullable=True) # None for receipt_batch jobs
+    status = db.Column(db.Enum(AssetJobStatusEnum, name="asset_job_status_enum"), nullable=False, default=AssetJobStatusEnum.QUEUED, index=True)
+    payload = db.Column(db.Text, nullable=False) # JSON asset spec (see services.asset_service.generate_item_assets), or the receipt's specs
+    result = db.Column(db.Text, nullable=True) # JSON outputs of a receipt_batch job (label sheet path)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    last_error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        return {
+            "id": self.id, "batch_id": self.batch_id, "job_type": self.job_type, "item_uid": self.item_uid,
+            "status": self.status.value if self.status else None,
+            "attempts": self.attempts, "max_attempts": self.max_attempts, "last_error": self.last_error,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    import_type = db.Column(db.String(50), nullable=False, index=True) # e.g. 'serialized_items_csv'
+    status = db.Column(db.Enum(ImportJobStatusEnum, name="import_job_status_enum"), nullable=False, default=ImportJobStatusEnum.QUEUED, index=True)
+    original_filename = db.Column(db.String(255), nullable=True)
+    file_path = db.Column(db.String(255), nullable=False) # Stored upload, read again when the job is resumed
+    file_size_bytes = db.Column(db.Integer, nullable=True)
+    bytes_processed = db.Column(db.Integer, nullable=False, default=0)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0) # Committed data rows; a resumed job skips these
+    imported_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_rows = db.Column(db.Text, nullable=True) # JSON list, capped (see INVENTORY_IMPORT_MAX_REPORTED_FAILURES)
+    last_error = db.Column(db.Text, nullable=True)
+    created_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        progress = None
+        if self.file_size_bytes:
+            progress = 100.0 if self.status == ImportJobStatusEnum.COMPLETED else round(min(self.bytes_processed / self.file_size_bytes, 1.0) * 100, 1)
+        return {
+            "id": self.id, "import_type": self.import_type,
+            "status": self.status.value if self.status else None,
+            "original_filename": self.original_filename, "progress_percent": progress,
+            "rows_processed": self.rows_processed, "imported": self.imported_count,
+            "updated": self.updated_count, "failed": self.failed_count,
+            "failed_rows": json.loads(self.failed_rows) if self.failed_rows else [],
+            "last_error": self.last_error,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class StaticJsonJob(db.Model):
+    __tablename__ = 'static_json_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    job_uid = db.Column(db.String(32), unique=True, nullable=False, index=True) # Polled by the admin API
+    status = db.Column(db.Enum(StaticJsonJobStatusEnum, name="static_json_job_status_enum"), nullable=False, default=StaticJsonJobStatusEnum.QUEUED, index=True)
+    full_rebuild = db.Column(db.Boolean, nullable=False, default=False)
+    product_ids = db.Column(db.Text, nullable=True) # JSON list of products whose static entries are stale
+    category_ids = db.Column(db.Text, nullable=True) # JSON list of categories whose static entries are stale
+    errors = db.Column(db.Text, nullable=True) # JSON list
+    locked_by = db.Column(db.String(100), nullable=True) # Claim token of the regeneration run handling the job
+    requested_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_uid, "status": self.status.value if self.status else None,
+            "full_rebuild": self.full_rebuild,
+            "requested_at": self.requested_at.isoformat() if self.requested_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "errors": json.loads(self.errors) if self.errors else []
+        }
+
 class AuditLog(db.Model):
     __tablename__ = 'audit_log'
     id = db.Column(db.Integer, primary_key=True)
@@ -6,6 +6,10 @@ from models.enums import OrderStatus, PaymentStatus
 from config import Config
 from services.b2b_invoice_service import create_b2b_invoice_from_order
 from services.b2b_loyalty_service import get_discount_for_tier, add_points_for_order
+from services.stock_reservation_service import StockReservationService
+from services.stock_allocation_service import StockAllocationService
+from database import InsufficientStockError
+from utils import paginate_keyset
 
 order_blueprint = Blueprint('order', __name__)
 stripe.api_key = Config.STRIPE_SECRET_KEY # Ensure you have this in your config
@@ -21,6 +25,14 @@ def create_order():
     if not cart or not cart.items:
         return jsonify({'error': 'Your cart is empty'}), 400
 
+    # Hold the cart's stock first, so limited items cannot be sold to two customers.
+    try:
+        for item in cart.items:
+            StockReservationService.reserve(cart.id, item.product_id, item.quantity, variant_id=item.variant_id, cart_item_id=item.id)
+    except InsufficientStockError as e:
+        db.session.rollback()
+        return jsonify(error='Some items in your cart are no longer available in the requested quantity.', product_id=e.product_id, available=e.available), 409
+
     subtotal = cart.get_total_price()
     
     # 1. Apply Partnership Discount
@@ -32,15 +44,15 @@ def create_order():
     
     amount_after_discount = subtotal - discount_amount
 
-    # 2. Apply Referral Credit
+    # 2. Apply Referral Credit (deducted from the balance once the payment intent exists)
     credit_used = 0
     if use_credit and current_user.referral_credit_balance > 0:
-        credit_to_apply = min(current_user.referral_credit_balance, amount_after_discount)
-        credit_used = credit_to_apply
-        current_user.referral_credit_balance -= credit_used
+        credit_used = min(current_user.referral_credit_balance, amount_after_discount)
     
     final_amount = round(amount_after_discount - credit_used, 2)
     
+    # Commit the order and its holds before calling Stripe: the guarded reservation UPDATEs lock the
+    # product/variant rows until commit, which must not last for a network call.
     try:
         new_order = Order(
             user_id=current_user.id,
@@ -54,18 +66,36 @@ def create_order():
         db.session.flush()
 
         for item in cart.items:
-            order_item = OrderItem(order_id=new_order.id, product_id=item.product_id, quantity=item.quantity, price=item.product.price)
+            # variant_id keeps the line on the variant its stock was reserved for (allocation, counters, reservation release)
+            order_item = OrderItem(order_id=new_order.id, product_id=item.product_id, variant_id=item.variant_id, quantity=item.quantity, price=item.product.price)
             db.session.add(order_item)
 
+        StockReservationService.hold_for_order(cart.id, new_order.id) # Held until payment or the payment window expires
+        order_id = new_order.id
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify(error=str(e)), 500
+
+    try:
         payment_intent = stripe.PaymentIntent.create(
             amount=int(final_amount * 100),
             currency='eur',
-            metadata={'order_id': new_order.id}
+            metadata={'order_id': order_id}
         )
-        
-        new_payment = Payment(order_id=new_order.id, stripe_payment_intent_id=payment_intent.id, amount=final_amount, status=PaymentStatus.PENDING)
-        db.session.add(new_payment)
+    except Exception as e:
+        # Compensating transaction: give the stock back and cancel the order; the cart is kept for a retry.
+        db.session.rollback()
+        StockReservationService.release_order(order_id)
+        db.session.query(Order).filter(Order.id == order_id).update({Order.status: OrderStatus.CANCELLED}, synchronize_session=False)
+        db.session.commit()
+        return jsonify(error=str(e)), 502
 
+    try:
+        new_payment = Payment(order_id=order_id, stripe_payment_intent_id=payment_intent.id, amount=final_amount, status=PaymentStatus.PENDING)
+        db.session.add(new_payment)
+        if credit_used:
+            current_user.referral_credit_balance -= credit_used
         CartItem.query.filter_by(cart_id=cart.id).delete()
         db.session.commit()
 
@@ -96,11 +126,14 @@ def stripe_webhook():
         
         order = Order.query.get(order_id)
         if order:
+            order.status = OrderStatus.PAID # Also makes lines left short here visible to `flask allocate-orders`
+            StockAllocationService.allocate_orders([order.id]) # FEFO jars + SALE movements
+
             # --- AWARD LOYALTY POINTS ---
             add_points_for_order(order)
             # --------------------------
 
-            # ... (rest of the logic for order/payment status update and B2C/B2B invoice)
+            # ... (rest of the logic for payment status update and B2C/B2B invoice)
             if isinstance(order.user, B2BUser):
                 create_b2b_invoice_from_order(order)
             db.session.commit()
@@ -109,6 +142,22 @@ def stripe_webhook():
 
 
 
+def _order_history_page(query):
+    """
+    Returns (orders, next_cursor) for an order history query.
+    Without a `cursor` argument the full history is returned as before; with one
+    (empty for the first page) it is paginated on (order_date, id), newest first.
+    """
+    cursor = request.args.get('cursor')
+    if cursor is None:
+        return query.order_by(Order.order_date.desc()).all(), None
+    per_page = request.args.get('per_page', 20, type=int)
+    if per_page < 1:
+        raise ValueError("per_page must be a positive integer.")
+    orders_models, next_cursor, _ = paginate_keyset(query, Order.order_date, Order.id, cursor=cursor or None, per_page=per_page, descending=True)
+    return orders_models, next_cursor
+
+
 @orders_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_order_history():
@@ -127,7 +176,7 @@ def get_order_history():
         else: # B2C or other roles if any
             query = query.filter(Order.is_b2b_order == False) # Explicitly check for False for B2C
 
-        orders_models = query.order_by(Order.order_date.desc()).all()
+        orders_models, next_cursor = _order_history_page(query)
         
         orders_data = []
         for o_model in orders_models:
@@ -140,7 +189,9 @@ def get_order_history():
                 'invoice_number': o_model.invoice.invoice_number if o_model.invoice else None
             })
         audit_logger.log_action(user_id=current_user_id, action='get_order_history_success', status='success', ip_address=request.remote_addr)
-        return jsonify(orders=orders_data, success=True), 200
+        return jsonify(orders=orders_data, next_cursor=next_cursor, success=True), 200
+    except ValueError as ve:
+        return jsonify(message=str(ve), success=False), 400
     except Exception as e:
         current_app.logger.error(f"Error fetching order history for user {current_user_id}: {e}", exc_info=True)
         audit_logger.log_action(user_id=current_user_id, action='get_order_history_fail', details=str(e), status='failure', ip_address=request.remote_addr)
@@ -274,7 +325,8 @@ def download_invoice(invoice_id):
 
     try:
         current_app.audit_log_service.log_action(user_id=user_id, action='download_invoice', target_type='invoice', target_id=invoice_id, status='success', ip_address=request.remote_addr)
-        return send_from_directory(asset_storage_directory, invoice.pdf_path, as_attachment=True)
+        # Stored PDFs are hash-named blobs; download them under the invoice number.
+        return send_from_directory(asset_storage_directory, invoice.pdf_path, as_attachment=True, download_name=f"{invoice.invoice_number}.pdf")
     except Exception as e:
         current_app.logger.error(f"Error sending invoice file {invoice.pdf_path}: {e}", exc_info=True)
         abort(500, description="Error serving invoice file.")
@@ -289,7 +341,7 @@ def get_order_history():
     current_user_id = get_jwt_identity()
     audit_logger = current_app.audit_log_service
     try:
-        orders_models = Order.query.filter_by(user_id=current_user_id).order_by(Order.order_date.desc()).all()
+        orders_models, next_cursor = _order_history_page(Order.query.filter_by(user_id=current_user_id))
         orders = []
         for o_model in orders_models:
             orders.append({
@@ -300,7 +352,9 @@ def get_order_history():
                 'currency': o_model.currency
             })
         audit_logger.log_action(user_id=current_user_id, action='get_order_history', status='success', ip_address=request.remote_addr)
-        return jsonify(orders=orders, success=True), 200
+        return jsonify(orders=orders, next_cursor=next_cursor, success=True), 200
+    except ValueError as ve:
+        return jsonify(message=str(ve), success=False), 400
     except Exception as e:
         current_app.logger.error(f"Error fetching order history for user {current_user_id}: {e}", exc_info=True)
         audit_logger.log_action(user_id=current_user_id, action='get_order_history_fail', details=str(e), status='failure', ip_address=request.remote_addr)
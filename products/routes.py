@@ -1,19 +1,89 @@
 # backend/products/routes.py
-from flask import Blueprint, request, jsonify, current_app, url_for
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Blueprint, request, jsonify, current_app, url_for, make_response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func, or_
-from sqlalchemy.orm import joinedload, selectinload # For eager loading
+from sqlalchemy import case, func
+from sqlalchemy.orm import contains_eager, joinedload # For eager loading
 
 from .. import db
-from ..models import Product, Category, ProductImage, ProductWeightOption, Review, User # Assuming Enums are used in models
-from ..utils import format_datetime_for_display, generate_slug
+from ..models import Product, Category, ProductImage, ProductWeightOption, Review, User, ProductTypeEnum
+from ..utils import format_datetime_for_display, generate_slug, paginate_keyset
 
 products_bp = Blueprint('products_bp', __name__, url_prefix='/api/products')
 
 def get_locale():
     return request.headers.get('Accept-Language', 'en').split(',')[0].split('-')[0]
 
+# sort param -> (column, descending). Cursor mode paginates on (column, Product.id).
+PRODUCT_SORT_OPTIONS = {
+    'name_asc': (Product.name, False),
+    'name_desc': (Product.name, True),
+    'price_asc': (Product.base_price, False),
+    'price_desc': (Product.base_price, True),
+    'date_desc': (Product.created_at, True),
+}
+
+def _catalog_json_response(body, status=200):
+    """Wraps an already-serialized JSON body (e.g. from the catalog cache) in a response."""
+    return current_app.response_class(body, status=status, mimetype=current_app.json.mimetype)
+
+def _catalog_validators():
+    """
+    Computes the (strong ETag, Last-Modified) pair for the current public catalog request.
+
+    Both derive from the catalog version, which admin writes bump, plus a time bucket of
+    CATALOG_CACHE_TTL_SECONDS so that stock and review changes (which do not bump the version)
+    surface within the same bound the server-side catalog cache already allows.
+    """
+    version, version_updated_at = current_app.catalog_cache.get_version_info()
+    bucket_seconds = current_app.config.get('CATALOG_CACHE_TTL_SECONDS', 60)
+    bucket_start = int(time.time() // bucket_seconds * bucket_seconds) if bucket_seconds > 0 else 0
+    validator_source = f"{version}|{bucket_start}|{request.host}|{request.full_path}|{get_locale()}"
+    etag = hashlib.sha256(validator_source.encode('utf-8')).hexdigest()[:32]
+
+    last_modified = datetime.fromtimestamp(bucket_start, tz=timezone.utc)
+    if version_updated_at:
+        if version_updated_at.tzinfo is None: # SQLite returns naive datetimes; they are stored as UTC
+            version_updated_at = version_updated_at.replace(tzinfo=timezone.utc)
+        last_modified = max(last_modified, version_updated_at)
+    return etag, last_modified.replace(microsecond=0)
+
+def _set_catalog_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('CATALOG_HTTP_MAX_AGE', 0)
+    response.cache_control.must_revalidate = True
+    response.vary.add('Accept-Language')
+    return response
+
+def catalog_conditional_get(view_func):
+    """
+    Answers If-None-Match / If-Modified-Since revalidations of public catalog endpoints
+    with 304 Not Modified before the view runs, and stamps validators on 200 responses.
+    """
+    @wraps(view_func)
+    def decorated_view(*args, **kwargs):
+        etag, last_modified = _catalog_validators()
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag) # Strong comparison; If-Modified-Since is then ignored
+        else:
+            not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        if not_modified:
+            return _set_catalog_validators(current_app.response_class(status=304), etag, last_modified)
+
+        response = make_response(view_func(*args, **kwargs))
+        if response.status_code == 200:
+            _set_catalog_validators(response, etag, last_modified)
+        return response
+    return decorated_view
+
 @products_bp.route('/', methods=['GET'])
+@catalog_conditional_get
 def get_products():
     lang = get_locale() 
     try:
@@ -21,37 +91,36 @@ def get_products():
         per_page = request.args.get('per_page', 12, type=int)
         category_slug = request.args.get('category_slug')
         search_term = request.args.get('search')
-        sort_by = request.args.get('sort', 'name_asc')
+        # Searches rank by relevance unless the caller asks for an explicit sort.
+        sort_by = request.args.get('sort') or ('relevance' if search_term else 'name_asc')
         featured_str = request.args.get('featured')
+        # Passing `cursor` (empty for the first page) opts into keyset pagination.
+        cursor = request.args.get('cursor')
+        cursor_mode = cursor is not None
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
 
         if page < 1 or per_page < 1:
             return jsonify(message='Page and per_page parameters must be positive integers.', success=False), 400
 
+        # Full URLs in the payload depend on the host, so it is part of the key as well.
+        cache_key = ('products', request.host, lang, page, per_page, category_slug, search_term, sort_by, featured_str, cursor, include_total)
+        catalog_cache = current_app.catalog_cache
+        cached_body = catalog_cache.get(cache_key)
+        if cached_body is not None:
+            return _catalog_json_response(cached_body)
+        catalog_version = catalog_cache.get_version()
+
         query = Product.query.join(Category, Product.category_id == Category.id)\
                              .filter(Product.is_active == True, Category.is_active == True)
         
-        # Eager load related data for listing if needed, selectively
-        # For example, if main_image_url is usually enough, and variants are only for some.
-        # If variants and all images are ALWAYS shown in list items, then eager load:
-        query = query.options(
-            selectinload(Product.weight_options.and_(ProductWeightOption.is_active == True)), # Only active variants
-            selectinload(Product.images) # Could filter for primary or specific types if needed
-        )
+        # Product.weight_options is a dynamic relationship (no eager loading); the page's variants are
+        # loaded below with one query.
+        query = query.options(contains_eager(Product.category)) # Already joined above; avoids a lazy load per listed product
 
 
         if category_slug:
             query = query.filter(Category.slug == category_slug)
         
-        if search_term:
-            term_like = f"%{search_term.lower()}%"
-            query = query.filter(
-                or_(
-                    func.lower(Product.name).like(term_like),
-                    func.lower(Product.description).like(term_like),
-                    func.lower(Product.product_code).like(term_like)
-                )
-            )
-        
         featured = None
         if featured_str:
             if featured_str.lower() == 'true': featured = True
@@ -59,16 +128,47 @@ def get_products():
         if featured is not None:
             query = query.filter(Product.is_featured == featured)
 
-        if sort_by == 'name_desc': query = query.order_by(Product.name.desc())
-        elif sort_by == 'price_asc': query = query.order_by(Product.base_price.asc())
-        elif sort_by == 'price_desc': query = query.order_by(Product.base_price.desc())
-        elif sort_by == 'date_desc': query = query.order_by(Product.created_at.desc())
-        else: query = query.order_by(Product.name.asc())
+        search_rank = None
+        search_truncated = False
+        if search_term:
+            # The search applies the same filters before its PRODUCT_SEARCH_MAX_RESULTS cap, so the cap only
+            # drops the least relevant matches; the response says when it did.
+            search_service = current_app.product_search_service
+            ranked_ids = search_service.search(search_term, category_slug=category_slug, featured=featured)
+            search_truncated = len(ranked_ids) >= search_service.max_results
+            query = query.filter(Product.id.in_(ranked_ids))
+            search_rank = {product_id: position for position, product_id in enumerate(ranked_ids)}
+
+        if sort_by == 'relevance' and search_rank:
+            sort_column, sort_descending = case(search_rank, value=Product.id, else_=len(search_rank)), False
+        else:
+            sort_column, sort_descending = PRODUCT_SORT_OPTIONS.get(sort_by, PRODUCT_SORT_OPTIONS['name_asc'])
+        next_cursor = None
+        if cursor_mode:
+            sort_value_getter = None
+            if sort_by == 'relevance' and search_rank:
+                sort_value_getter = lambda p: search_rank.get(p.id, len(search_rank))
+            elif sort_column is Product.base_price: # Nullable; keyset comparisons need a concrete value
+                sort_column = func.coalesce(Product.base_price, 0.0)
+                sort_value_getter = lambda p: p.base_price or 0.0
+            products_models, next_cursor, total_products = paginate_keyset(
+                query, sort_column, Product.id, cursor=cursor or None, per_page=per_page,
+                descending=sort_descending, include_total=include_total, sort_value_getter=sort_value_getter
+            )
+        else:
+            query = query.order_by(sort_column.desc() if sort_descending else sort_column.asc(), Product.id.asc())
+            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            products_models = pagination.items
+            total_products = pagination.total
+            total_pages = pagination.pages
 
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        products_models = pagination.items
-        total_products = pagination.total
-        total_pages = pagination.pages
+        # Active variants of the whole page in one query, whatever the page size
+        variable_ids = [p.id for p in products_models if p.type == ProductTypeEnum.VARIABLE_WEIGHT]
+        variants_by_product = {}
+        if variable_ids:
+            for option in ProductWeightOption.query.filter(ProductWeightOption.product_id.in_(variable_ids), ProductWeightOption.is_active == True)\
+                                                   .order_by(ProductWeightOption.product_id, ProductWeightOption.id):
+                variants_by_product.setdefault(option.product_id, []).append(option)
 
         products_list = []
         for p_model in products_models:
@@ -79,6 +179,7 @@ def get_products():
                 'type': p_model.type.value if p_model.type else None, # Use .value for Enums
                 'unit_of_measure': p_model.unit_of_measure, 'is_featured': p_model.is_featured,
                 'aggregate_stock_quantity': p_model.aggregate_stock_quantity,
+                'available_stock_quantity': p_model.available_stock_quantity, # Net of cart/order reservations
                 'product_code': p_model.product_code,
                 'category_name': p_model.category.name if p_model.category else None,
                 'category_slug': p_model.category.slug if p_model.category else None,
@@ -90,15 +191,26 @@ def get_products():
                 except Exception as e_url: current_app.logger.warning(f"URL gen error for product image {p_model.main_image_url}: {e_url}")
             
             if p_model.type == ProductTypeEnum.VARIABLE_WEIGHT: # Use Enum member
-                # Variants already loaded via selectinload if that option is used
                 product_dict['weight_options'] = [
                     {'option_id': opt.id, 'weight_grams': opt.weight_grams, 'price': opt.price, 
-                     'sku_suffix': opt.sku_suffix, 'aggregate_stock_quantity': opt.aggregate_stock_quantity} 
-                    for opt in p_model.weight_options # Access directly due to selectinload
+                     'sku_suffix': opt.sku_suffix, 'aggregate_stock_quantity': opt.aggregate_stock_quantity,
+                     'available_stock_quantity': opt.available_stock_quantity} 
+                    for opt in variants_by_product.get(p_model.id, [])
                 ]
             products_list.append(product_dict)
         
-        return jsonify({"products": products_list, "page": page, "per_page": per_page, "total_products": total_products, "total_pages": total_pages, "success": True}), 200
+        if cursor_mode:
+            response_data = {"products": products_list, "per_page": per_page, "next_cursor": next_cursor, "has_more": next_cursor is not None, "success": True}
+            if include_total: response_data["total_products"] = total_products
+        else:
+            response_data = {"products": products_list, "page": page, "per_page": per_page, "total_products": total_products, "total_pages": total_pages, "success": True}
+        if search_term:
+            # total_products counts at most search_max_results matches
+            response_data["search_max_results"] = current_app.product_search_service.max_results
+            response_data["search_truncated"] = search_truncated
+        body = current_app.json.dumps(response_data)
+        catalog_cache.set(cache_key, body, version=catalog_version)
+        return _catalog_json_response(body)
     except ValueError as ve:
         return jsonify(message=str(ve), success=False), 400
     except Exception as e:
@@ -106,6 +218,7 @@ def get_products():
         return jsonify(message="Failed to fetch products", success=False), 500
 
 @products_bp.route('/categories', methods=['GET'])
+@catalog_conditional_get
 def get_categories():
     try:
         # Efficiently count active products per category using a subquery
@@ -188,25 +301,17 @@ def submit_review(product_id):
 # (Other product routes: get_product_detail_by_slug_or_code, get_category_detail remain largely the same,
 # ensure they use .value for Enums in responses if applicable)
 @products_bp.route('/<string:slug_or_code>', methods=['GET'])
+@catalog_conditional_get
 def get_product_detail_by_slug_or_code(slug_or_code):
     # ... (existing logic) ...
     # Ensure Enums are converted to .value for JSON response
     # product_details['type'] = product_model.type.value if product_model.type else None
     # ...
+    # images, weight_options and reviews are dynamic relationships: each is read below with one filtered query.
     product_model = Product.query.filter(Product.is_active == True)\
-                                 .options(
-                                     selectinload(Product.images),
-                                     selectinload(Product.weight_options.and_(ProductWeightOption.is_active==True)),
-                                     selectinload(Product.reviews.and_(Review.is_approved==True)).joinedload(Review.user)
-                                 )\
                                  .filter(Product.slug == slug_or_code).first()
     if not product_model:
         product_model = Product.query.filter(Product.is_active == True)\
-                                     .options(
-                                         selectinload(Product.images),
-                                         selectinload(Product.weight_options.and_(ProductWeightOption.is_active==True)),
-                                         selectinload(Product.reviews.and_(Review.is_approved==True)).joinedload(Review.user)
-                                     )\
                                      .filter(func.upper(Product.product_code) == slug_or_code.upper()).first()
     if not product_model:
         return jsonify(message="Product not found or not active", success=False), 404
@@ -218,7 +323,7 @@ def get_product_detail_by_slug_or_code(slug_or_code):
             except Exception as e_url: current_app.logger.warning(f"URL gen error for product image {product_model.main_image_url}: {e_url}")
         
         product_details['additional_images'] = []
-        for img_model in product_model.images: # Already loaded
+        for img_model in product_model.images: # One query
             img_dict = {'id': img_model.id, 'image_url': img_model.image_url, 'alt_text': img_model.alt_text, 'is_primary': img_model.is_primary, 'image_full_url': None}
             if img_model.image_url:
                 try: img_dict['image_full_url'] = url_for('serve_public_asset', filepath=img_model.image_url, _external=True)
@@ -227,14 +332,15 @@ def get_product_detail_by_slug_or_code(slug_or_code):
 
         product_details['weight_options'] = []
         if product_model.type == ProductTypeEnum.VARIABLE_WEIGHT: # Use Enum
-            for opt in product_model.weight_options: # Already loaded
+            for opt in product_model.weight_options.filter(ProductWeightOption.is_active == True): # Active variants, one query
                 product_details['weight_options'].append(
                     {'option_id': opt.id, 'weight_grams': opt.weight_grams, 'price': opt.price, 
-                     'sku_suffix': opt.sku_suffix, 'aggregate_stock_quantity': opt.aggregate_stock_quantity}
+                     'sku_suffix': opt.sku_suffix, 'aggregate_stock_quantity': opt.aggregate_stock_quantity,
+                     'available_stock_quantity': opt.available_stock_quantity}
                 )
         
         product_details['reviews'] = []
-        for rev_model in product_model.reviews: # Already loaded (approved only)
+        for rev_model in product_model.reviews.filter(Review.is_approved == True).options(joinedload(Review.user)): # Approved only, one query
             product_details['reviews'].append({
                 'id': rev_model.id, 'rating': rev_model.rating, 'comment': rev_model.comment,
                 'review_date': format_datetime_for_display(rev_model.review_date),
@@ -246,6 +352,7 @@ def get_product_detail_by_slug_or_code(slug_or_code):
         return jsonify(message="Failed to fetch product details", success=False), 500
 
 @products_bp.route('/categories/<string:category_slug_or_code>', methods=['GET'])
+@catalog_conditional_get
 def get_category_detail(category_slug_or_code):
     # ... (existing logic) ...
     # Ensure Enums are converted to .value for JSON response if category model uses them
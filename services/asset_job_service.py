@@ -0,0 +1,273 @@
+# services/asset_job_service.py
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, insert, or_, update
+
+from .. import db
+from ..models import AssetJob, AssetJobStatusEnum, AssetTypeEnum, GeneratedAsset, SerializedInventoryItem
+from .asset_service import generate_item_assets, generate_passports_for_batch, generate_label_batch
+
+ITEM_ASSETS_JOB = 'item_assets' # One item's QR code (and label, if any)
+RECEIPT_BATCH_JOB = 'receipt_batch' # A whole receipt's passports and label sheet
+
+
+class AssetJobService:
+    """
+    Database-backed queue for inventory asset generation (passport, QR code, label).
+
+    Stock receipts enqueue one receipt_batch job, which renders the passports and the label sheet
+    of the whole receipt and then queues one item_assets job (QR code) per item in the same batch;
+    `flask asset-worker` processes claim jobs with a conditional UPDATE (so several workers can run
+    side by side without a broker), render the assets, record GeneratedAsset rows and retry
+    failures with exponential backoff.
+    """
+
+    @staticmethod
+    def enqueue_item_assets(db_session, item_specs, batch_id=None):
+        """
+        Adds one queued job per asset spec. The calling function is responsible for db_session.commit().
+
+        Returns:
+            str: The batch id to poll with get_batch_status().
+        """
+        batch_id = batch_id or uuid.uuid4().hex
+        max_attempts = current_app.config.get('ASSET_JOB_MAX_ATTEMPTS', 3)
+        db_session.add_all([
+            AssetJob(batch_id=batch_id, job_type=ITEM_ASSETS_JOB, item_uid=spec['item_uid'], payload=json.dumps(spec),
+                     status=AssetJobStatusEnum.QUEUED, max_attempts=max_attempts)
+            for spec in item_specs
+        ])
+        return batch_id
+
+    @staticmethod
+    def enqueue_receipt(db_session, item_specs, product_id, sheet_id, label_format, label_layout):
+        """
+        Queues the assets of a stock receipt as one receipt_batch job: it renders the passports in one
+        pass, prints every label on one sheet (PDF or ZPL) and queues the per-item QR code jobs.
+        The calling function is responsible for commit().
+
+        Returns:
+            str: The batch id to poll with get_batch_status().
+        """
+        batch_id = uuid.uuid4().hex
+        db_session.add(AssetJob(
+            batch_id=batch_id, job_type=RECEIPT_BATCH_JOB, status=AssetJobStatusEnum.QUEUED,
+            max_attempts=current_app.config.get('ASSET_JOB_MAX_ATTEMPTS', 3),
+            payload=json.dumps({"specs": item_specs, "product_id": product_id, "sheet_id": sheet_id,
+                                "label_format": label_format, "label_layout": label_layout})
+        ))
+        return batch_id
+
+    @staticmethod
+    def generated_asset_rows(item_uid, product_id, asset_details):
+        """GeneratedAsset column values (dicts) for the generated files of an item; files not generated are left out."""
+        assets = [
+            (AssetTypeEnum.QR_CODE, asset_details.get('qr_code_path')),
+            (AssetTypeEnum.PASSPORT_HTML, asset_details.get('passport_path')),
+            (AssetTypeEnum.LABEL_PDF, asset_details.get('label_pdf_path')),
+        ]
+        return [{"asset_type": asset_type, "related_item_uid": item_uid, "related_product_id": product_id, "file_path": path}
+                for asset_type, path in assets if path]
+
+    @staticmethod
+    def insert_generated_assets(db_session, rows):
+        """
+        Inserts GeneratedAsset rows (see generated_asset_rows) with one executemany INSERT. For items that
+        have no rows yet, e.g. a new receipt; the rows are the references that keep shared asset store
+        blobs alive. The calling function is responsible for commit().
+        """
+        if rows:
+            db_session.execute(insert(GeneratedAsset), rows)
+
+    @staticmethod
+    def record_generated_assets(db_session, item_uid, product_id, asset_details):
+        """
+        Records the generated files of an item as GeneratedAsset rows, replacing the item's earlier rows
+        of the same types (a retried job rewrites them). The calling function is responsible for commit().
+        """
+        rows = AssetJobService.generated_asset_rows(item_uid, product_id, asset_details)
+        if not rows:
+            return
+        db_session.query(GeneratedAsset).filter(
+            GeneratedAsset.related_item_uid == item_uid, GeneratedAsset.asset_type.in_([row['asset_type'] for row in rows])
+        ).delete(synchronize_session=False)
+        AssetJobService.insert_generated_assets(db_session, rows)
+
+    @staticmethod
+    def _claimable_filter(now):
+        lock_timeout = timedelta(seconds=current_app.config.get('ASSET_JOB_LOCK_TIMEOUT_SECONDS', 600))
+        return or_(
+            and_(AssetJob.status == AssetJobStatusEnum.QUEUED, AssetJob.run_after <= now),
+            # A worker that died mid-job leaves it RUNNING; it becomes claimable again after the lock timeout.
+            and_(AssetJob.status == AssetJobStatusEnum.RUNNING, AssetJob.locked_at < now - lock_timeout)
+        )
+
+    @staticmethod
+    def claim_jobs(worker_id, limit=10):
+        """
+        Atomically claims up to `limit` runnable jobs for `worker_id`. Each candidate is taken with an
+        UPDATE that re-checks the claimable condition, so concurrent workers never claim the same job.
+
+        Returns:
+            list: The claimed AssetJob ids.
+        """
+        now = datetime.now(timezone.utc)
+        claimable = AssetJobService._claimable_filter(now)
+        candidate_ids = [job_id for (job_id,) in db.session.query(AssetJob.id).filter(claimable).order_by(AssetJob.id).limit(limit)]
+        claimed_ids = []
+        for job_id in candidate_ids:
+            updated = db.session.query(AssetJob).filter(AssetJob.id == job_id, claimable).update({
+                AssetJob.status: AssetJobStatusEnum.RUNNING, AssetJob.locked_by: worker_id,
+                AssetJob.locked_at: now, AssetJob.attempts: AssetJob.attempts + 1
+            }, synchronize_session=False)
+            if updated:
+                claimed_ids.append(job_id)
+        db.session.commit()
+        return claimed_ids
+
+    @staticmethod
+    def _update_if_owned(job_id, worker_id, values):
+        """
+        Applies `values` to a job only while `worker_id` still holds it (RUNNING, locked_by unchanged).
+        A job whose lock timed out may have been reclaimed by another worker. Returns True if updated.
+        """
+        return db.session.query(AssetJob).filter(
+            AssetJob.id == job_id, AssetJob.locked_by == worker_id, AssetJob.status == AssetJobStatusEnum.RUNNING
+        ).update(values, synchronize_session=False) > 0
+
+    @staticmethod
+    def run_job(job_id, worker_id):
+        """
+        Renders the assets of one job claimed by `worker_id` and records the outcome. Ownership is
+        re-checked before running (refreshing locked_at, as jobs of a claimed round run one after
+        another) and again in the transaction that stores the results. A job reclaimed by another
+        worker meanwhile is skipped, or its results are discarded. Returns True on success.
+        """
+        if not AssetJobService._update_if_owned(job_id, worker_id, {AssetJob.locked_at: datetime.now(timezone.utc)}):
+            db.session.rollback()
+            current_app.logger.warning(f"Asset job {job_id} is no longer held by {worker_id}; skipped.")
+            return False
+        db.session.commit()
+        job = db.session.get(AssetJob, job_id)
+        payload = json.loads(job.payload)
+        job_type, item_uid, batch_id = job.job_type, job.item_uid, job.batch_id
+        try:
+            if job_type == RECEIPT_BATCH_JOB:
+                result = AssetJobService._run_receipt_batch(batch_id, payload)
+            else:
+                result = AssetJobService._run_item_assets(item_uid, payload)
+            if not AssetJobService._update_if_owned(job_id, worker_id, {
+                AssetJob.status: AssetJobStatusEnum.SUCCEEDED, AssetJob.completed_at: datetime.now(timezone.utc),
+                AssetJob.last_error: None, AssetJob.locked_by: None, AssetJob.result: result
+            }):
+                db.session.rollback() # Reclaimed meanwhile: the other worker's run records the results
+                current_app.logger.warning(f"Asset job {job_id} was reclaimed while {worker_id} ran it; results discarded.")
+                return False
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(AssetJob, job_id)
+            values = {AssetJob.last_error: str(e)[:2000], AssetJob.locked_by: None}
+            if job.attempts >= job.max_attempts:
+                values[AssetJob.status] = AssetJobStatusEnum.FAILED
+                current_app.logger.error(f"Asset job {job_id} ({job_type}, item {item_uid}) failed permanently after {job.attempts} attempts: {e}", exc_info=True)
+            else:
+                backoff = current_app.config.get('ASSET_JOB_RETRY_BACKOFF_SECONDS', 30) * (2 ** (job.attempts - 1))
+                values[AssetJob.status] = AssetJobStatusEnum.QUEUED
+                values[AssetJob.run_after] = datetime.now(timezone.utc) + timedelta(seconds=backoff)
+                current_app.logger.warning(f"Asset job {job_id} ({job_type}, item {item_uid}) failed (attempt {job.attempts}), retrying in {backoff}s: {e}")
+            AssetJobService._update_if_owned(job_id, worker_id, values)
+            db.session.commit()
+            return False
+
+    @staticmethod
+    def _run_item_assets(item_uid, spec):
+        """Renders one item's assets and stores their paths on the item. The caller commits. Returns the job result (None)."""
+        asset_details = generate_item_assets(spec)
+        item_urls = {
+            SerializedInventoryItem.qr_code_url: asset_details['qr_code_path'],
+            SerializedInventoryItem.passport_url: asset_details['passport_path'],
+        }
+        if asset_details['label_pdf_path']: # Receipt items are printed on their batch's label sheet instead
+            item_urls[SerializedInventoryItem.label_url] = asset_details['label_pdf_path']
+        db.session.query(SerializedInventoryItem).filter(SerializedInventoryItem.item_uid == item_uid).update(item_urls, synchronize_session=False)
+        AssetJobService.record_generated_assets(db.session, item_uid, spec.get('product_info', {}).get('id'), asset_details)
+        return None
+
+    @staticmethod
+    def _run_receipt_batch(batch_id, payload):
+        """
+        Renders a receipt's passports and its label sheet, links them to the items and queues the
+        items' QR code jobs. The caller commits, so a retried job never leaves item jobs behind from
+        an earlier attempt. Returns the job result: JSON with the sheet's path.
+        """
+        specs = payload['specs']
+        product_id = payload['product_id']
+        passport_paths = generate_passports_for_batch(specs)
+        for spec in specs:
+            spec['passport_path'] = passport_paths[spec['item_uid']]
+            spec['render_passport'] = False
+        label_sheet_path = generate_label_batch(payload['sheet_id'], specs, label_format=payload['label_format'], layout=payload['label_layout'])
+
+        ids_by_uid = dict(db.session.query(SerializedInventoryItem.item_uid, SerializedInventoryItem.id)
+                          .filter(SerializedInventoryItem.item_uid.in_(list(passport_paths))).all())
+        db.session.execute(update(SerializedInventoryItem), [
+            {"id": ids_by_uid[uid], "passport_url": path, "label_url": label_sheet_path}
+            for uid, path in passport_paths.items() if uid in ids_by_uid
+        ])
+        label_sheet_type = AssetTypeEnum.LABEL_SHEET_ZPL if payload['label_format'] == 'zpl' else AssetTypeEnum.LABEL_SHEET_PDF
+        # A failed attempt rolls back entirely, so the receipt's items have no rows yet: plain INSERT, no delete.
+        asset_rows = [{"asset_type": label_sheet_type, "related_item_uid": None, "related_product_id": product_id, "file_path": label_sheet_path}]
+        for uid, path in passport_paths.items():
+            asset_rows.extend(AssetJobService.generated_asset_rows(uid, product_id, {"passport_path": path}))
+        AssetJobService.insert_generated_assets(db.session, asset_rows)
+        AssetJobService.enqueue_item_assets(db.session, specs, batch_id=batch_id)
+        return json.dumps({"label_sheet_path": label_sheet_path})
+
+    @staticmethod
+    def get_batch_status(batch_id):
+        """Returns per-status counts and per-item job details for a batch, or None if unknown."""
+        jobs = AssetJob.query.filter_by(batch_id=batch_id).order_by(AssetJob.id).all()
+        if not jobs:
+            return None
+        counts = {status.value: 0 for status in AssetJobStatusEnum}
+        for job in jobs:
+            counts[job.status.value] += 1
+        pending = counts[AssetJobStatusEnum.QUEUED.value] + counts[AssetJobStatusEnum.RUNNING.value]
+        label_sheet_path = None
+        for job in jobs:
+            if job.job_type == RECEIPT_BATCH_JOB and job.result:
+                label_sheet_path = json.loads(job.result).get('label_sheet_path')
+        return {"batch_id": batch_id, "total": len(jobs), "counts": counts, "done": pending == 0,
+                "label_sheet_path": label_sheet_path, "jobs": [job.to_dict() for job in jobs]}
+
+
+@click.command('asset-worker')
+@click.option('--once', is_flag=True, help='Process the currently runnable jobs and exit.')
+@click.option('--batch-size', default=10, show_default=True, help='Jobs claimed per polling round.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+@with_appcontext
+def asset_worker_command(once, batch_size, poll_interval):
+    """Runs the inventory asset generation worker."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    click.echo(f'Asset worker {worker_id} started.')
+    while True:
+        job_ids = AssetJobService.claim_jobs(worker_id, limit=batch_size)
+        for job_id in job_ids:
+            AssetJobService.run_job(job_id, worker_id)
+        if job_ids:
+            succeeded = db.session.query(func.count(AssetJob.id)).filter(AssetJob.id.in_(job_ids), AssetJob.status == AssetJobStatusEnum.SUCCEEDED).scalar()
+            click.echo(f'Processed {len(job_ids)} asset job(s): {succeeded} succeeded.')
+        elif once:
+            break
+        else:
+            time.sleep(poll_interval)
@@ -0,0 +1,157 @@
+# services/asset_service.py
+# Inventory asset generation (passport, QR code, label) used by the inventory routes.
+# Single-item functions delegate to B2CAssetService; generate_assets_for_batch() fans a
+# receipt batch out across a process pool, and generate_label_batch() prints its labels in one file.
+# Labels are PDF (ReportLab) or ZPL (thermal printers), selected by LABEL_FORMAT.
+# Every file is written through the content-addressed AssetStore; blobs of a failed batch are
+# left unreferenced and removed by `flask gc-assets`.
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Flask, current_app
+
+from .b2c_asset_service import B2CAssetService
+
+# Config keys the asset renderers read; copied into each pool worker's minimal app.
+ASSET_CONFIG_KEYS = ('ASSET_STORAGE_PATH', 'APP_BASE_URL_FRONTEND',
+                     'LABEL_FORMAT', 'LABEL_ZPL_WIDTH_DOTS', 'LABEL_ZPL_HEIGHT_DOTS', 'QR_CODE_FORMAT', 'QR_CODE_PNG_BOX_SIZE',
+                     'PASSPORT_PRECOMPRESS')
+
+# Placeholder substituted with the passport's relative path to build its public URL in workers,
+# which have no request context for url_for().
+PASSPORT_PATH_PLACEHOLDER = '__PASSPORT_PATH__'
+
+
+def generate_qr_code_for_item(item_uid, product_name_fr, product_name_en, passport_url=None):
+    """Generates the passport QR code image (SVG or PNG) for an item. Returns its path relative to ASSET_STORAGE_PATH."""
+    return B2CAssetService.generate_qr_code_for_item(item_uid, product_name_fr or product_name_en, passport_url=passport_url)
+
+
+def generate_item_passport(item_uid, product_info, category_info, item_specifics):
+    """
+    Generates the HTML passport for an item. `product_info` may be a Product model or a dict.
+    Returns its path relative to ASSET_STORAGE_PATH.
+    """
+    if not isinstance(product_info, dict):
+        product_info = {'id': product_info.id, 'name': product_info.name, 'product_code': product_info.product_code}
+    return B2CAssetService.generate_item_passport_html(item_uid, dict(product_info, category=category_info), item_specifics)
+
+
+def generate_passports_for_batch(item_specs):
+    """
+    Renders the passports of asset specs (see generate_item_assets) in one pass per product: the
+    product/category context is built once per product, not once per item.
+
+    Returns:
+        dict: item_uid -> passport path relative to ASSET_STORAGE_PATH.
+    """
+    specs_by_product = {}
+    for spec in item_specs:
+        specs_by_product.setdefault(spec['product_info'].get('id'), []).append(spec)
+    paths = {}
+    for product_specs in specs_by_product.values():
+        first_spec = product_specs[0]
+        paths.update(B2CAssetService.generate_item_passports_html(
+            [(spec['item_uid'], spec['item_specifics']) for spec in product_specs],
+            dict(first_spec['product_info'], category=first_spec['category_info'])
+        ))
+    return paths
+
+
+def generate_product_label_pdf(item_uid, product_name_fr, product_name_en, weight_grams, processing_date_str, passport_url):
+    """Generates the PDF label for an item. Returns its path relative to ASSET_STORAGE_PATH."""
+    return B2CAssetService.generate_product_label_pdf(item_uid, product_name_fr or product_name_en, weight_grams, processing_date_str, passport_url)
+
+
+def generate_product_label(item_uid, product_name_fr, product_name_en, weight_grams, processing_date_str, passport_url):
+    """Generates the label for an item in LABEL_FORMAT ('pdf' or 'zpl'). Returns its path relative to ASSET_STORAGE_PATH."""
+    if current_app.config.get('LABEL_FORMAT', 'pdf') == 'zpl':
+        return B2CAssetService.generate_product_label_zpl(item_uid, product_name_fr or product_name_en, product_name_en or product_name_fr,
+                                                          weight_grams, processing_date_str, passport_url)
+    return generate_product_label_pdf(item_uid, product_name_fr, product_name_en, weight_grams, processing_date_str, passport_url)
+
+
+def generate_label_batch(batch_id, item_specs, label_format=None, layout=None):
+    """
+    Prints the labels of asset specs (see generate_item_assets) into one file: a multi-page PDF laid
+    out per LABEL_SHEET_LAYOUT (or `layout`), or a ZPL job, per LABEL_FORMAT (or `label_format`).
+    The specs' passports must be rendered already (their 'passport_path' goes into the QR codes).
+    Returns its path relative to ASSET_STORAGE_PATH.
+    """
+    config = current_app.config
+    labels = []
+    for spec in item_specs:
+        labels.append({
+            'item_uid': spec['item_uid'], 'product_name': spec['product_name_fr'] or spec['product_name_en'],
+            'product_name_fr': spec['product_name_fr'] or spec['product_name_en'],
+            'product_name_en': spec['product_name_en'] or spec['product_name_fr'],
+            'weight_grams': spec['weight_grams'], 'processing_date_str': spec['processing_date_str'],
+            'passport_url': spec['passport_url_template'].replace(PASSPORT_PATH_PLACEHOLDER, spec['passport_path'])
+        })
+    if (label_format or config.get('LABEL_FORMAT', 'pdf')) == 'zpl':
+        return B2CAssetService.generate_label_sheet_zpl(batch_id, labels)
+    return B2CAssetService.generate_label_sheet_pdf(batch_id, labels, layout or config.get('LABEL_SHEET_LAYOUT', 'a4'))
+
+
+def generate_item_assets(spec):
+    """
+    Renders the passport, QR code and label of one item described by `spec` (a plain dict, so it
+    can be sent to a worker process).
+    Specs with 'render_label': False skip the per-item label (their batch is printed on a label sheet),
+    and specs with 'render_passport': False reuse the 'passport_path' rendered for their batch.
+
+    Returns:
+        dict: item_uid plus qr_code_path, passport_path and label_pdf_path (relative paths; label may
+        be None, and is a .zpl file when LABEL_FORMAT is 'zpl').
+    """
+    item_uid = spec['item_uid']
+    if spec.get('render_passport', True):
+        passport_path = generate_item_passport(item_uid, spec['product_info'], spec['category_info'], spec['item_specifics'])
+        if not passport_path: raise Exception(f"Failed to generate passport for item {item_uid}.")
+    else:
+        passport_path = spec['passport_path']
+
+    # The QR image and the label encode the same URL, so its QR matrix is computed once.
+    passport_url = spec['passport_url_template'].replace(PASSPORT_PATH_PLACEHOLDER, passport_path)
+    qr_code_path = generate_qr_code_for_item(item_uid, spec['product_name_fr'], spec['product_name_en'], passport_url=passport_url)
+    if not qr_code_path: raise Exception(f"Failed to generate QR code image for item {item_uid}.")
+
+    label_pdf_path = None
+    if spec.get('render_label', True):
+        label_pdf_path = generate_product_label(
+            item_uid, spec['product_name_fr'], spec['product_name_en'],
+            spec['weight_grams'], spec['processing_date_str'], passport_url
+        )
+        if not label_pdf_path: raise Exception(f"Failed to generate PDF label for item {item_uid}.")
+    return {"item_uid": item_uid, "qr_code_path": qr_code_path, "passport_path": passport_path, "label_pdf_path": label_pdf_path}
+
+
+def _init_asset_worker(asset_config):
+    """Process pool initializer: gives the worker a minimal app context so the renderers can read config."""
+    worker_app = Flask('asset_worker')
+    worker_app.config.update(asset_config)
+    worker_app.app_context().push()
+
+
+def generate_assets_for_batch(specs):
+    """
+    Renders the assets for every spec, in order. Batches of at least ASSET_PARALLEL_MIN_BATCH
+    items are spread over a process pool of ASSET_GENERATION_WORKERS processes (default: CPU count).
+    If any item fails, the error is raised; blobs already stored for the batch stay unreferenced
+    until `flask gc-assets` removes them.
+
+    Returns:
+        list: generate_item_assets() results, in the same order as `specs`.
+    """
+    config = current_app.config
+    max_workers = min(config.get('ASSET_GENERATION_WORKERS') or os.cpu_count() or 1, len(specs))
+    if max_workers <= 1 or len(specs) < config.get('ASSET_PARALLEL_MIN_BATCH', 8):
+        return [generate_item_assets(spec) for spec in specs]
+
+    asset_config = {key: config.get(key) for key in ASSET_CONFIG_KEYS if config.get(key) is not None}
+    chunksize = max(1, len(specs) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_asset_worker, initargs=(asset_config,)) as pool:
+        results = list(pool.map(generate_item_assets, specs, chunksize=chunksize))
+    current_app.logger.info(f"Generated assets for {len(results)} items across {max_workers} processes.")
+    return results
+
@@ -0,0 +1,146 @@
+# services/asset_store_service.py
+# Content-addressed store for generated files (QR codes, passports, labels, invoices).
+# A blob is named after the SHA-256 of its bytes and sharded two levels deep,
+#   <ASSET_STORAGE_PATH>/cas/<kind>/<hash[0:2]>/<hash[2:4]>/<hash>.<ext>
+# so identical files are stored once and no directory holds more than a few hundred entries.
+# Blobs are shared: the GeneratedAsset rows with a blob's file_path are its references, and
+# `flask gc-assets` deletes the blobs no row references any more.
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, func
+
+from .. import db
+from ..models import GeneratedAsset
+
+ASSET_STORE_DIRNAME = 'cas' # Relative paths of blobs start with 'cas/'
+ASSET_STORE_KINDS = ('qr_codes', 'passports', 'labels', 'invoices')
+TEMP_PREFIX = '.tmp-'
+
+
+def _write_atomically(full_path, data):
+    """Writes `data` through a temporary file in the target directory, so readers never see a partial blob."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, full_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class AssetStore:
+    """
+    Writes generated files as deduplicated, hash-named blobs. Needs no database, so it also runs in
+    asset worker processes; whoever stores a blob records the GeneratedAsset row that keeps it alive.
+    """
+
+    @staticmethod
+    def root():
+        return os.path.join(current_app.config['ASSET_STORAGE_PATH'], ASSET_STORE_DIRNAME)
+
+    @staticmethod
+    def is_blob(relative_path):
+        """True if `relative_path` (relative to ASSET_STORAGE_PATH) points into the store."""
+        return bool(relative_path) and relative_path.replace(os.sep, '/').startswith(f"{ASSET_STORE_DIRNAME}/")
+
+    @staticmethod
+    def full_path(relative_path):
+        return os.path.join(current_app.config['ASSET_STORAGE_PATH'], *relative_path.split('/'))
+
+    @staticmethod
+    def put(kind, data, extension, precompress=False):
+        """
+        Stores `data` (bytes) as a blob of `kind`, unless an identical blob already exists. With
+        `precompress`, a gzip copy is kept next to it as <blob>.gz (for serve_public_asset).
+
+        Returns:
+            str: The blob's path relative to ASSET_STORAGE_PATH.
+        """
+        if kind not in ASSET_STORE_KINDS:
+            raise ValueError(f"Unknown asset kind '{kind}'. Allowed: {', '.join(ASSET_STORE_KINDS)}")
+        digest = hashlib.sha256(data).hexdigest()
+        relative_path = '/'.join((ASSET_STORE_DIRNAME, kind, digest[:2], digest[2:4], f"{digest}.{extension}"))
+        full_path = AssetStore.full_path(relative_path)
+        if os.path.exists(full_path):
+            # Reused: refresh the mtime so gc-assets' grace period covers the reference about to be recorded.
+            os.utime(full_path, None)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            _write_atomically(full_path, data)
+        if precompress and not os.path.exists(f"{full_path}.gz"):
+            _write_atomically(f"{full_path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+        return relative_path
+
+    @staticmethod
+    def reference_counts(relative_paths):
+        """GeneratedAsset rows per blob path, for the given paths (paths without rows are left out)."""
+        relative_paths = list(relative_paths)
+        if not relative_paths:
+            return {}
+        return dict(db.session.execute(
+            select(GeneratedAsset.file_path, func.count(GeneratedAsset.id))
+            .where(GeneratedAsset.file_path.in_(relative_paths)).group_by(GeneratedAsset.file_path)
+        ).all())
+
+    @staticmethod
+    def collect_garbage(grace_seconds=None, dry_run=False):
+        """
+        Deletes blobs (with their .gz copies) that no GeneratedAsset row references and that are older
+        than `grace_seconds` (default ASSET_STORE_GC_GRACE_SECONDS), so blobs whose row is not committed
+        yet survive. Works one shard directory at a time, with one reference query per directory.
+        Leftover temporary files of interrupted writes are removed too.
+
+        Returns:
+            dict: {"blobs_removed": int, "bytes_freed": int} (what would be removed, with `dry_run`).
+        """
+        if grace_seconds is None:
+            grace_seconds = current_app.config.get('ASSET_STORE_GC_GRACE_SECONDS', 86400)
+        cutoff = time.time() - grace_seconds
+        base = current_app.config['ASSET_STORAGE_PATH']
+        blobs_removed = 0
+        bytes_freed = 0
+        for dirpath, _, filenames in os.walk(AssetStore.root()):
+            files_by_blob = {}
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                if filename.startswith(TEMP_PREFIX):
+                    if os.path.getmtime(full_path) < cutoff and not dry_run:
+                        os.remove(full_path)
+                    continue
+                blob_name = filename[:-len('.gz')] if filename.endswith('.gz') else filename
+                files_by_blob.setdefault(os.path.relpath(os.path.join(dirpath, blob_name), base).replace(os.sep, '/'), []).append(full_path)
+            if not files_by_blob:
+                continue
+            referenced = AssetStore.reference_counts(files_by_blob)
+            for relative_path, full_paths in files_by_blob.items():
+                if relative_path in referenced:
+                    continue
+                if any(os.path.getmtime(full_path) >= cutoff for full_path in full_paths):
+                    continue
+                blobs_removed += 1
+                for full_path in full_paths:
+                    bytes_freed += os.path.getsize(full_path)
+                    if not dry_run:
+                        os.remove(full_path)
+        current_app.logger.info(f"Asset store GC{' (dry run)' if dry_run else ''}: {blobs_removed} unreferenced blob(s), {bytes_freed} bytes.")
+        return {"blobs_removed": blobs_removed, "bytes_freed": bytes_freed}
+
+
+@click.command('gc-assets')
+@click.option('--grace-hours', type=float, default=None, help='Keep unreferenced blobs younger than this (default: ASSET_STORE_GC_GRACE_SECONDS).')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+@with_appcontext
+def gc_assets_command(grace_hours, dry_run):
+    """Deletes generated-asset blobs no GeneratedAsset row references."""
+    result = AssetStore.collect_garbage(grace_seconds=grace_hours * 3600 if grace_hours is not None else None, dry_run=dry_run)
+    click.echo(f"{'Would remove' if dry_run else 'Removed'} {result['blobs_removed']} blob(s), {result['bytes_freed']} bytes.")
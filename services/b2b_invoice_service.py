@@ -8,7 +8,9 @@ from .. import db
 from ..models import (Invoice, InvoiceItem, Order, User,
                     InvoiceStatusEnum, OrderStatusEnum, UserRoleEnum
                     db, B2BInvoice)
+from ..models import GeneratedAsset, AssetTypeEnum
 from ..utils import sanitize_input
+from .asset_store_service import AssetStore
 from jinja2 import Environment, FileSystemLoader
 
 def get_invoice_html(invoice):
@@ -199,15 +201,9 @@ def create_b2b_invoice_from_order(order):
         
         html_string = render_template('b2b_invoice_template.html', **context)
         
-        pdf_filename = f"{invoice.invoice_number}.pdf"
-        invoice_pdf_dir = current_app.config['INVOICE_PDF_PATH']
-        os.makedirs(invoice_pdf_dir, exist_ok=True)
-        pdf_full_path = os.path.join(invoice_pdf_dir, pdf_filename)
-        
-        HTML(string=html_string).write_pdf(pdf_full_path)
-        
-        base_asset_path = current_app.config['ASSET_STORAGE_PATH']
-        relative_path = os.path.relpath(pdf_full_path, base_asset_path).replace(os.sep, '/')
-        
+        # Stored as an asset store blob; the GeneratedAsset row is its reference (the caller commits).
+        relative_path = AssetStore.put('invoices', HTML(string=html_string).write_pdf(), 'pdf')
+        db.session.add(GeneratedAsset(asset_type=AssetTypeEnum.INVOICE_PDF, file_path=relative_path))
+
         current_app.logger.info(f"Generated PDF for B2B invoice {invoice.invoice_number} at {relative_path}")
         return relative_path
@@ -1,39 +1,100 @@
 # services/b2c_asset_service.py
+import io
 import os
-import qrcode
 from flask import current_app, url_for
-from reportlab.lib.pagesizes import A7
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as ReportLabImage
+from reportlab.lib.pagesizes import A4, A7
+from reportlab.platypus import SimpleDocTemplate, BaseDocTemplate, PageTemplate, Frame, Paragraph, Spacer, PageBreak, KeepInFrame, Table, TableStyle, Image as ReportLabImage
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import mm
-from reportlab.graphics.barcode import qr as reportlab_qr
-from reportlab.graphics.shapes import Drawing
 from datetime import datetime
 
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from .asset_store_service import AssetStore
+from .qr_code_service import QrCodeService
+
+LABEL_SHEET_LAYOUTS = ('a4', 'a7')
+LABEL_SHEET_COLUMNS, LABEL_SHEET_ROWS = 2, 4 # A4 portrait holds 2 x 4 landscape A7 labels
+LABEL_SHEET_MARGIN = 5*mm
+
+LABEL_FORMATS = ('pdf', 'zpl')
+
+_label_styles = None
+
+def _get_label_styles():
+    """The label stylesheet, built once per process and shared by every label rendered."""
+    global _label_styles
+    if _label_styles is None:
+        _label_styles = getSampleStyleSheet()
+    return _label_styles
+
+_passport_template = None
+
+def _get_passport_template():
+    """The passport Jinja template, compiled once per process (also in asset worker processes, which have no app templates)."""
+    global _passport_template
+    if _passport_template is None:
+        template_dir = os.path.join(os.path.dirname(__file__), '..', 'templates')
+        env = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(['html']), auto_reload=False)
+        _passport_template = env.get_template('passport_template.html')
+    return _passport_template
+
+def _label_flowables(item_uid, product_name, weight_grams, processing_date_str, passport_url, styles):
+    """The content of one label: name, weight, processing date, UID and the passport QR code."""
+    return [
+        Paragraph(product_name, styles['Title']),
+        Spacer(1, 4*mm),
+        Paragraph(f"Net Weight: {weight_grams}g", styles['Normal']),
+        Paragraph(f"Processed: {processing_date_str}", styles['Normal']),
+        Paragraph(f"UID: {item_uid}", styles['Code']),
+        Spacer(1, 4*mm),
+        QrCodeService.reportlab_drawing(passport_url, 20*mm), # Same cached matrix as the item's QR image
+    ]
+
+def _zpl_text(value):
+    """Field data for a ^FH_ field: the ZPL control characters (and the escape character) as hex escapes."""
+    return str(value).replace('_', '_5F').replace('^', '_5E').replace('~', '_7E')
+
+def _zpl_label(item_uid, product_name_fr, product_name_en, weight_grams, processing_date_str, passport_url, width_dots, height_dots):
+    """
+    One label as a ZPL II format (^XA ... ^XZ): bilingual name, weight, processing date, UID and a
+    native printer-rendered QR code (^BQ) of the passport URL. Text is UTF-8 (^CI28).
+    """
+    qr_magnification = 5 if height_dots >= 400 else 3
+    qr_size = 33 * qr_magnification # Version 4 QR code (fits a passport URL) plus quiet zone, roughly
+    text_width = width_dots - qr_size - 60
+    qr_x, qr_y = width_dots - qr_size - 20, max(height_dots - qr_size - 20, 20)
+    return (
+        "^XA^CI28"
+        f"^PW{width_dots}^LL{height_dots}"
+        f"^FO20,20^A0N,38,38^FB{text_width},2,0,L^FH_^FD{_zpl_text(product_name_fr)}^FS"
+        f"^FO20,105^A0N,28,28^FB{text_width},2,0,L^FH_^FD{_zpl_text(product_name_en)}^FS"
+        f"^FO20,180^A0N,26,26^FH_^FDPoids net / Net weight: {_zpl_text(weight_grams)}g^FS"
+        f"^FO20,215^A0N,26,26^FH_^FDConditionne le / Processed: {_zpl_text(processing_date_str)}^FS"
+        f"^FO20,{height_dots - 50}^A0N,24,24^FH_^FDUID: {_zpl_text(item_uid)}^FS"
+        f"^FO{qr_x},{qr_y}^BQN,2,{qr_magnification}^FH_^FDQA,{_zpl_text(passport_url)}^FS"
+        "^XZ\n"
+    )
+
 class B2CAssetService:
     @staticmethod
-    def generate_qr_code_for_item(item_uid, product_name):
+    def generate_qr_code_for_item(item_uid, product_name, passport_url=None):
         """
-        Generates a QR code PNG file that links to the item's public passport URL.
+        Generates a QR code image (QR_CODE_FORMAT: compact 'svg' or 'png') that links to the item's
+        passport: `passport_url`, or the frontend passport page by default. The URL is encoded once
+        per process and the matrix reused by the item's labels (see QrCodeService).
 
         Returns:
-            str: The relative path to the saved QR code image.
+            str: The relative path to the QR code image (a blob in the asset store).
         """
-        qr_folder_abs = current_app.config['QR_CODE_FOLDER']
-        os.makedirs(qr_folder_abs, exist_ok=True)
+        if not passport_url:
+            frontend_base_url = current_app.config.get('APP_BASE_URL_FRONTEND', 'http://localhost:8000')
+            passport_url = f"{frontend_base_url}/passport/{item_uid}"
 
-        frontend_base_url = current_app.config.get('APP_BASE_URL_FRONTEND', 'http://localhost:8000')
-        passport_public_url = f"{frontend_base_url}/passport/{item_uid}"
-
-        qr_filename = f"qr_passport_{item_uid}.png"
-        qr_filepath_full = os.path.join(qr_folder_abs, qr_filename)
-
-        img = qrcode.make(passport_public_url)
-        img.save(qr_filepath_full)
+        image_format = current_app.config.get('QR_CODE_FORMAT', 'svg')
+        qr_image = QrCodeService.render(passport_url, image_format=image_format, box_size=current_app.config.get('QR_CODE_PNG_BOX_SIZE', 10))
         current_app.logger.info(f"Passport QR Code generated for item {item_uid}")
-
-        base_asset_path = current_app.config['ASSET_STORAGE_PATH']
-        return os.path.relpath(qr_filepath_full, base_asset_path).replace(os.sep, '/')
+        return AssetStore.put('qr_codes', qr_image, image_format)
 
     @staticmethod
     def generate_item_passport_html(item_uid, product_info, item_specifics):
@@ -43,29 +104,37 @@ class B2CAssetService:
         Returns:
             str: The relative path to the saved HTML file.
         """
-        passport_folder_abs = current_app.config['PASSPORT_FOLDER']
-        os.makedirs(passport_folder_abs, exist_ok=True)
-        passport_filename = f"passport_{item_uid}.html"
-        passport_filepath_full = os.path.join(passport_folder_abs, passport_filename)
-
-        # Simplified HTML generation logic for brevity
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head><title>Product Passport {item_uid}</title></head>
-        <body>
-            <h1>Passport for {product_info.get('name')}</h1>
-            <p><strong>UID:</strong> {item_uid}</p>
-            <p><strong>Batch:</strong> {item_specifics.get('batch_number', 'N/A')}</p>
-            <p><strong>Production Date:</strong> {item_specifics.get('production_date', 'N/A')}</p>
-        </body>
-        </html>
+        return B2CAssetService.generate_item_passports_html([(item_uid, item_specifics)], product_info)[item_uid]
+
+    @staticmethod
+    def generate_item_passports_html(items, product_info, precompress=None):
+        """
+        Renders the passports of many items of one product from the precompiled passport template.
+        The product/category context is built once for the whole call; each item only adds its UID and
+        specifics. With `precompress` (default: PASSPORT_PRECOMPRESS) a .html.gz is stored next to each
+        passport for serve_public_asset.
+
+        Args:
+            items (list): (item_uid, item_specifics dict) pairs.
+            product_info (dict): Product fields, with the category dict under 'category'.
+
+        Returns:
+            dict: item_uid -> relative path of the HTML file (a blob in the asset store).
         """
-        with open(passport_filepath_full, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        if precompress is None:
+            precompress = current_app.config.get('PASSPORT_PRECOMPRESS', True)
 
-        base_asset_path = current_app.config['ASSET_STORAGE_PATH']
-        return os.path.relpath(passport_filepath_full, base_asset_path).replace(os.sep, '/')
+        template = _get_passport_template()
+        category = product_info.get('category') or {}
+        shared_context = {
+            "product": product_info, "category": category,
+            "category_name": category.get('name_fr') or category.get('name_en') or category.get('name'),
+        }
+        paths = {}
+        for item_uid, item_specifics in items:
+            html_bytes = template.render(shared_context, item_uid=item_uid, item=item_specifics or {}).encode('utf-8')
+            paths[item_uid] = AssetStore.put('passports', html_bytes, 'html', precompress=precompress)
+        return paths
 
 
     @staticmethod
@@ -74,34 +143,95 @@ class B2CAssetService:
         Generates a product label as a PDF file using ReportLab.
 
         Returns:
-            str: The relative path to the saved PDF label.
+            str: The relative path to the PDF label (a blob in the asset store).
         """
-        label_folder_abs = current_app.config['LABEL_FOLDER']
-        os.makedirs(label_folder_abs, exist_ok=True)
-        pdf_filename = f"label_pdf_{item_uid}.pdf"
-        pdf_filepath_full = os.path.join(label_folder_abs, pdf_filename)
-
-        doc = SimpleDocTemplate(pdf_filepath_full, pagesize=A7, leftMargin=4*mm, rightMargin=4*mm, topMargin=4*mm, bottomMargin=4*mm)
-        styles = getSampleStyleSheet()
-        story = []
-
-        # Simplified PDF generation logic for brevity
-        story.append(Paragraph(product_name, styles['Title']))
-        story.append(Spacer(1, 4*mm))
-        story.append(Paragraph(f"Net Weight: {weight_grams}g", styles['Normal']))
-        story.append(Paragraph(f"Processed: {processing_date_str}", styles['Normal']))
-        story.append(Paragraph(f"UID: {item_uid}", styles['Code']))
-        story.append(Spacer(1, 4*mm))
-        
-        qr_code = reportlab_qr.QrCodeWidget(passport_url)
-        bounds = qr_code.getBounds()
-        width = bounds[2] - bounds[0]
-        height = bounds[3] - bounds[1]
-        drawing = Drawing(20*mm, 20*mm, transform=[20*mm/width, 0, 0, 20*mm/height, 0, 0])
-        drawing.add(qr_code)
-        story.append(drawing)
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A7, leftMargin=4*mm, rightMargin=4*mm, topMargin=4*mm, bottomMargin=4*mm)
+        story = _label_flowables(item_uid, product_name, weight_grams, processing_date_str, passport_url, _get_label_styles())
         
         doc.build(story)
-        
-        base_asset_path = current_app.config['ASSET_STORAGE_PATH']
-        return os.path.relpath(pdf_filepath_full, base_asset_path).replace(os.sep, '/')
+        return AssetStore.put('labels', buffer.getvalue(), 'pdf')
+
+    @staticmethod
+    def generate_label_sheet_pdf(sheet_id, labels, layout='a4'):
+        """
+        Renders many labels into one PDF with a single ReportLab build: on A4 sheets of
+        LABEL_SHEET_COLUMNS x LABEL_SHEET_ROWS labels ('a4'), or one A7 label per page ('a7').
+        `labels` are dicts with item_uid, product_name, weight_grams, processing_date_str and passport_url.
+
+        Returns:
+            str: The relative path to the PDF (a blob in the asset store).
+        """
+        if layout not in LABEL_SHEET_LAYOUTS:
+            raise ValueError(f"Unknown label sheet layout '{layout}'. Allowed: {', '.join(LABEL_SHEET_LAYOUTS)}")
+        buffer = io.BytesIO()
+
+        styles = _get_label_styles()
+        label_contents = [
+            _label_flowables(label['item_uid'], label['product_name'], label['weight_grams'],
+                             label['processing_date_str'], label['passport_url'], styles)
+            for label in labels
+        ]
+
+        if layout == 'a7':
+            doc = SimpleDocTemplate(buffer, pagesize=A7, leftMargin=4*mm, rightMargin=4*mm, topMargin=4*mm, bottomMargin=4*mm)
+            story = []
+            for index, content in enumerate(label_contents):
+                if index:
+                    story.append(PageBreak())
+                story.extend(content)
+            doc.build(story)
+        else:
+            page_width, page_height = A4
+            cell_width = (page_width - 2 * LABEL_SHEET_MARGIN) / LABEL_SHEET_COLUMNS
+            cell_height = int((page_height - 2 * LABEL_SHEET_MARGIN) / LABEL_SHEET_ROWS) # Whole points, so rounding never pushes a row off the page
+            doc = BaseDocTemplate(buffer, pagesize=A4)
+            # Zero frame padding so that exactly LABEL_SHEET_ROWS rows fit each page; the table splits across pages.
+            frame = Frame(LABEL_SHEET_MARGIN, LABEL_SHEET_MARGIN, page_width - 2 * LABEL_SHEET_MARGIN, page_height - 2 * LABEL_SHEET_MARGIN,
+                          leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0)
+            doc.addPageTemplates([PageTemplate(id='label_sheet', frames=[frame])])
+            cells = [KeepInFrame(cell_width - 6*mm, cell_height - 6*mm, content, mode='shrink') for content in label_contents]
+            cells += [''] * (-len(cells) % LABEL_SHEET_COLUMNS)
+            rows = [cells[start:start + LABEL_SHEET_COLUMNS] for start in range(0, len(cells), LABEL_SHEET_COLUMNS)]
+            table = Table(rows, colWidths=[cell_width] * LABEL_SHEET_COLUMNS, rowHeights=[cell_height] * len(rows))
+            table.setStyle(TableStyle([
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('LEFTPADDING', (0, 0), (-1, -1), 3*mm), ('RIGHTPADDING', (0, 0), (-1, -1), 3*mm),
+                ('TOPPADDING', (0, 0), (-1, -1), 3*mm), ('BOTTOMPADDING', (0, 0), (-1, -1), 3*mm),
+                ('GRID', (0, 0), (-1, -1), 0.25, '#BBBBBB'), # Cut guides
+            ]))
+            doc.build([table])
+        current_app.logger.info(f"Label sheet {sheet_id} generated with {len(labels)} label(s) ({layout}).")
+        return AssetStore.put('labels', buffer.getvalue(), 'pdf')
+
+    @staticmethod
+    def generate_product_label_zpl(item_uid, product_name_fr, product_name_en, weight_grams, processing_date_str, passport_url):
+        """
+        Generates a product label as ZPL for thermal printers (LABEL_ZPL_WIDTH_DOTS x LABEL_ZPL_HEIGHT_DOTS).
+
+        Returns:
+            str: The relative path to the .zpl file (a blob in the asset store).
+        """
+        zpl = _zpl_label(item_uid, product_name_fr, product_name_en, weight_grams, processing_date_str, passport_url,
+                         current_app.config.get('LABEL_ZPL_WIDTH_DOTS', 800), current_app.config.get('LABEL_ZPL_HEIGHT_DOTS', 560))
+        return AssetStore.put('labels', zpl.encode('utf-8'), 'zpl')
+
+    @staticmethod
+    def generate_label_sheet_zpl(sheet_id, labels):
+        """
+        Writes the labels of a batch as one ZPL file (one format per label) that can be sent to a
+        thermal printer as a single job. `labels` are as for generate_label_sheet_pdf, plus
+        product_name_fr / product_name_en.
+
+        Returns:
+            str: The relative path to the .zpl file (a blob in the asset store).
+        """
+        width_dots = current_app.config.get('LABEL_ZPL_WIDTH_DOTS', 800)
+        height_dots = current_app.config.get('LABEL_ZPL_HEIGHT_DOTS', 560)
+        zpl = ''.join(
+            _zpl_label(label['item_uid'], label['product_name_fr'], label['product_name_en'], label['weight_grams'],
+                       label['processing_date_str'], label['passport_url'], width_dots, height_dots)
+            for label in labels
+        )
+        current_app.logger.info(f"ZPL label batch {sheet_id} generated with {len(labels)} label(s).")
+        return AssetStore.put('labels', zpl.encode('utf-8'), 'zpl')
@@ -5,8 +5,9 @@ import os
 from datetime import datetime, timezone
 
 from .. import db
-from ..models import Invoice, InvoiceItem, Order, User, SerializedInventoryItem, InvoiceStatusEnum, OrderStatusEnum
+from ..models import Invoice, InvoiceItem, Order, User, SerializedInventoryItem, InvoiceStatusEnum, OrderStatusEnum, GeneratedAsset, AssetTypeEnum
 from ..utils import format_datetime_for_display
+from .asset_store_service import AssetStore
 
 class B2CInvoiceService:
     """Handles invoice creation for B2C (retail) orders."""
@@ -128,16 +129,10 @@ class B2CInvoiceService:
         
         html_string = render_template('invoice_template.html', **context)
         
-        pdf_filename = f"{invoice.invoice_number}.pdf"
-        invoice_pdf_dir = current_app.config['INVOICE_PDF_PATH']
-        os.makedirs(invoice_pdf_dir, exist_ok=True)
-        pdf_full_path = os.path.join(invoice_pdf_dir, pdf_filename)
+        # Stored as an asset store blob; the GeneratedAsset row is its reference (the caller commits).
+        relative_path = AssetStore.put('invoices', HTML(string=html_string).write_pdf(), 'pdf')
+        db.session.add(GeneratedAsset(asset_type=AssetTypeEnum.INVOICE_PDF, file_path=relative_path))
 
-        HTML(string=html_string).write_pdf(pdf_full_path)
-
-        base_asset_path = current_app.config['ASSET_STORAGE_PATH']
-        relative_path = os.path.relpath(pdf_full_path, base_asset_path).replace(os.sep, '/')
-        
         current_app.logger.info(f"Generated PDF for invoice {invoice.invoice_number} at {relative_path}")
         return relative_path
 
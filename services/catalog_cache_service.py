@@ -0,0 +1,126 @@
+# services/catalog_cache_service.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import cast
+
+from .. import db
+from ..models import Setting
+
+CATALOG_VERSION_SETTING_KEY = 'catalog_version'
+
+
+class CatalogCacheService:
+    """
+    Versioned read-through cache for serialized public catalog responses.
+
+    Entries are keyed by the request parameters and tagged with the catalog version
+    stored in the `settings` table. Admin catalog writes bump that version in the same
+    transaction, which invalidates every cached entry in every worker process.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._version_updated_at = None
+        self._version_checked_at = 0.0
+
+    def _config(self, key, default):
+        app = self.app or current_app
+        return app.config.get(key, default)
+
+    @property
+    def enabled(self):
+        return self._config('CATALOG_CACHE_ENABLED', True)
+
+    def _read_version_row(self):
+        row = db.session.query(Setting.value, Setting.updated_at).filter(Setting.key == CATALOG_VERSION_SETTING_KEY).first()
+        if not row:
+            return 0, None
+        try:
+            return int(row.value), row.updated_at
+        except (TypeError, ValueError):
+            current_app.logger.warning(f"Non-integer catalog version in settings: {row.value!r}. Treating as 0.")
+            return 0, row.updated_at
+
+    def get_version_info(self):
+        """
+        Returns the current catalog version and the time it was last bumped.
+        The version is re-read from the database at most once per CATALOG_VERSION_CHECK_SECONDS.
+
+        Returns:
+            tuple: (int version, datetime or None updated_at)
+        """
+        check_interval = self._config('CATALOG_VERSION_CHECK_SECONDS', 2)
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked_at < check_interval:
+                return self._version, self._version_updated_at
+
+        version, updated_at = self._read_version_row()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+            self._version = version
+            self._version_updated_at = updated_at
+            self._version_checked_at = now
+        return version, updated_at
+
+    def get_version(self):
+        return self.get_version_info()[0]
+
+    def bump_version(self, db_session=None):
+        """
+        Increments the catalog version within the caller's transaction.
+        The calling function is responsible for db_session.commit().
+        """
+        session_to_use = db_session or db.session
+        now_utc = datetime.now(timezone.utc)
+        updated = session_to_use.query(Setting).filter(Setting.key == CATALOG_VERSION_SETTING_KEY).update(
+            {Setting.value: cast(Setting.value, db.Integer) + 1, Setting.updated_at: now_utc},
+            synchronize_session=False
+        )
+        if not updated:
+            session_to_use.add(Setting(key=CATALOG_VERSION_SETTING_KEY, value='1', description="Public catalog cache version (bumped on admin catalog writes)."))
+        # Force the next read to go back to the database so this process sees the new version immediately.
+        with self._lock:
+            self._version_checked_at = 0.0
+
+    def get(self, key):
+        """Returns the cached serialized body for `key` at the current catalog version, or None."""
+        if not self.enabled:
+            return None
+        version = self.get_version()
+        max_age = self._config('CATALOG_CACHE_TTL_SECONDS', 60)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_version, stored_at, body = entry
+            if entry_version != version or time.monotonic() - stored_at > max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body, version=None):
+        if not self.enabled:
+            return
+        if version is None:
+            version = self.get_version()
+        max_entries = self._config('CATALOG_CACHE_MAX_ENTRIES', 2048)
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version_checked_at = 0.0
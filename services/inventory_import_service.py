@@ -0,0 +1,396 @@
+# services/inventory_import_service.py
+import csv
+import io
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from .. import db
+from ..database import (
+    bulk_insert_serialized_items, record_stock_movement,
+    serialized_availability_change, status_change_movement_type
+)
+from ..models import (
+    ImportJob, ImportJobStatusEnum, Product, ProductWeightOption, SerializedInventoryItem,
+    SerializedInventoryItemStatusEnum, StockMovementTypeEnum
+)
+from ..utils import sanitize_input, parse_datetime_from_iso
+
+SERIALIZED_ITEMS_CSV = 'serialized_items_csv'
+UID_LOOKUP_CHUNK_SIZE = 500 # Item UIDs per IN (...) lookup query
+
+
+class CsvImportError(ValueError):
+    """Raised when an uploaded CSV cannot be imported at all (e.g. missing headers)."""
+
+
+def _open_csv(file_path):
+    """Opens a stored upload for incremental parsing. Returns (text stream, DictReader)."""
+    text_stream = io.TextIOWrapper(open(file_path, 'rb'), encoding='utf-8-sig', newline='') # utf-8-sig drops a BOM
+    return text_stream, csv.DictReader(text_stream)
+
+
+def _load_items_by_uid(item_uids):
+    """Loads existing serialized items for the given UIDs in chunked IN queries."""
+    item_uids = list(item_uids)
+    items_by_uid = {}
+    for start in range(0, len(item_uids), UID_LOOKUP_CHUNK_SIZE):
+        chunk = item_uids[start:start + UID_LOOKUP_CHUNK_SIZE]
+        items_by_uid.update((item.item_uid, item) for item in SerializedInventoryItem.query.filter(SerializedInventoryItem.item_uid.in_(chunk)))
+    return items_by_uid
+
+
+def _existing_item_uids(item_uids):
+    item_uids = list(item_uids)
+    existing = set()
+    for start in range(0, len(item_uids), UID_LOOKUP_CHUNK_SIZE):
+        chunk = item_uids[start:start + UID_LOOKUP_CHUNK_SIZE]
+        existing.update(uid for (uid,) in db.session.query(SerializedInventoryItem.item_uid).filter(SerializedInventoryItem.item_uid.in_(chunk)))
+    return existing
+
+
+def _generate_item_uid(product_code, taken_uids):
+    """A UID not in `taken_uids` (a set), which is added to it."""
+    uid = f"{product_code}-{uuid.uuid4().hex[:8].upper()}"
+    while uid in taken_uids:
+        uid = f"{product_code}-{uuid.uuid4().hex[:8].upper()}"
+    taken_uids.add(uid)
+    return uid
+
+
+class _CatalogLookup:
+    """Product and variant ids for an import, loaded in bulk for each chunk's unseen codes and kept across chunks."""
+
+    def __init__(self):
+        self.products_by_code = {} # upper product_code -> (product id, product_code) or None
+        self.variant_ids = {} # product id -> {sku_suffix: variant id}
+
+    def preload(self, product_codes):
+        missing_codes = [code for code in product_codes if code not in self.products_by_code]
+        if missing_codes:
+            self.products_by_code.update((code, None) for code in missing_codes)
+            for product_id, product_code in db.session.query(Product.id, Product.product_code).filter(func.upper(Product.product_code).in_(missing_codes)):
+                self.products_by_code[product_code.upper()] = (product_id, product_code)
+        missing_product_ids = [p[0] for p in self.products_by_code.values() if p and p[0] not in self.variant_ids]
+        if missing_product_ids:
+            self.variant_ids.update((product_id, {}) for product_id in missing_product_ids)
+            for variant_id, product_id, sku_suffix in db.session.query(ProductWeightOption.id, ProductWeightOption.product_id, ProductWeightOption.sku_suffix)\
+                    .filter(ProductWeightOption.product_id.in_(missing_product_ids)):
+                self.variant_ids[product_id][(sku_suffix or '').upper()] = variant_id
+
+
+class InventoryImportService:
+    """
+    Streaming, resumable import of serialized inventory CSV files.
+
+    The upload is stored on disk and tracked by an ImportJob row. Rows are parsed incrementally
+    and processed in chunks of INVENTORY_IMPORT_CHUNK_SIZE: lookups are preloaded per chunk, new
+    items are bulk inserted, and each chunk commits together with the job's progress counters, so
+    an interrupted job resumes after its last committed row. With INVENTORY_IMPORT_ASYNC enabled
+    jobs run in a background thread; otherwise (e.g. in tests) they run inline.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+
+    def _config(self, key, default):
+        app = self.app or current_app
+        return app.config.get(key, default)
+
+    def create_serialized_items_job(self, file_storage, user_id=None):
+        """
+        Stores an uploaded CSV and creates its queued ImportJob. Only the header line is read here.
+        Raises CsvImportError if the file cannot be imported.
+        """
+        import_folder = self._config('INVENTORY_IMPORT_FOLDER', None) or os.path.join(self._config('UPLOAD_FOLDER', '.'), 'imports')
+        os.makedirs(import_folder, exist_ok=True)
+        file_path = os.path.join(import_folder, f"serialized_items_{uuid.uuid4().hex}.csv")
+        file_storage.save(file_path) # Streams to disk in chunks
+
+        try:
+            text_stream, reader = _open_csv(file_path)
+            with text_stream:
+                csv_headers = reader.fieldnames
+            if not csv_headers:
+                raise CsvImportError("CSV file is empty or has no headers.")
+            if 'Product Code' not in csv_headers: # At least Product Code must be there
+                raise CsvImportError(f"CSV missing essential headers. Required: 'Product Code'. Found: {', '.join(csv_headers)}")
+        except (CsvImportError, UnicodeDecodeError) as e:
+            os.remove(file_path)
+            if isinstance(e, UnicodeDecodeError):
+                raise CsvImportError("CSV file must be UTF-8 encoded.") from e
+            raise
+
+        job = ImportJob(
+            import_type=SERIALIZED_ITEMS_CSV, status=ImportJobStatusEnum.QUEUED,
+            original_filename=file_storage.filename, file_path=file_path,
+            file_size_bytes=os.path.getsize(file_path), created_by_user_id=user_id
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def is_resumable(self, job):
+        """A job can be (re)started unless it completed or is still being worked on by a live worker."""
+        if job.status in (ImportJobStatusEnum.QUEUED, ImportJobStatusEnum.FAILED):
+            return True
+        if job.status == ImportJobStatusEnum.RUNNING:
+            stale_after = timedelta(seconds=self._config('INVENTORY_IMPORT_STALE_SECONDS', 300))
+            last_progress = job.updated_at or job.started_at
+            if last_progress and last_progress.tzinfo is None:
+                last_progress = last_progress.replace(tzinfo=timezone.utc)
+            return last_progress is None or last_progress < datetime.now(timezone.utc) - stale_after
+        return False
+
+    def start(self, job_id):
+        """Runs the job in a background thread, or inline when INVENTORY_IMPORT_ASYNC is disabled."""
+        if not self._config('INVENTORY_IMPORT_ASYNC', True):
+            self.run(job_id)
+            return
+        app = self.app or current_app._get_current_object()
+
+        def _run_in_app_context():
+            with app.app_context():
+                try:
+                    self.run(job_id)
+                except Exception as e: # Already recorded on the job; never let the thread die noisily
+                    app.logger.error(f"Import job {job_id} stopped: {e}")
+
+        threading.Thread(target=_run_in_app_context, name=f'inventory-import-{job_id}', daemon=True).start()
+
+    def run(self, job_id):
+        """
+        Processes (or resumes) an import job until the end of its file. Each chunk is committed
+        with the job's counters; an error marks the job FAILED and is re-raised.
+        """
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            raise ValueError(f"Import job {job_id} not found.")
+        chunk_size = max(1, self._config('INVENTORY_IMPORT_CHUNK_SIZE', 1000))
+        job.status = ImportJobStatusEnum.RUNNING
+        job.started_at = job.started_at or datetime.now(timezone.utc)
+        job.last_error = None
+        db.session.commit()
+        current_app.logger.info(f"Import job {job_id} started at row {job.rows_processed + 1} ({job.original_filename}).")
+
+        try:
+            text_stream, reader = _open_csv(job.file_path)
+            with text_stream:
+                lookup = _CatalogLookup()
+                skip_rows = job.rows_processed
+                chunk = []
+                for row_num, row_dict in enumerate(reader, start=1):
+                    if row_num <= skip_rows: # Already committed by a previous run
+                        continue
+                    chunk.append((row_num, row_dict))
+                    if len(chunk) >= chunk_size:
+                        self._import_chunk(job, chunk, lookup, text_stream.buffer.tell())
+                        chunk = []
+                if chunk:
+                    self._import_chunk(job, chunk, lookup, text_stream.buffer.tell())
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(ImportJob, job_id)
+            job.status = ImportJobStatusEnum.FAILED
+            job.last_error = str(e)[:2000]
+            db.session.commit()
+            current_app.logger.error(f"Import job {job_id} failed after {job.rows_processed} rows: {e}", exc_info=True)
+            current_app.audit_log_service.log_action(user_id=job.created_by_user_id, action='import_serialized_csv_fail', target_type='import_job', target_id=job.id, details=f"Failed after {job.rows_processed} rows: {e}", status='failure')
+            raise
+
+        job.status = ImportJobStatusEnum.COMPLETED
+        job.bytes_processed = job.file_size_bytes or job.bytes_processed
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+        current_app.audit_log_service.log_action(user_id=job.created_by_user_id, action='import_serialized_csv_success', target_type='import_job', target_id=job.id, details=f"Imported: {job.imported_count}, Updated: {job.updated_count}, Failed: {job.failed_count} from {job.rows_processed} rows.", status='success')
+        try:
+            os.remove(job.file_path)
+        except OSError as e:
+            current_app.logger.warning(f"Could not remove processed import file {job.file_path}: {e}")
+        return job
+
+    def _import_chunk(self, job, rows, lookup, bytes_processed):
+        """Imports one chunk of (row number, row dict) pairs and commits it with the job's progress."""
+        current_admin_id = job.created_by_user_id
+        imported_count = 0; updated_count = 0; failed_rows = []
+
+        parsed_rows = []
+        for row_num, row_dict in rows:
+            # Sanitize string inputs from CSV
+            parsed_rows.append((row_num, row_dict, {
+                'product_code': (sanitize_input(row_dict.get('Product Code')) or '').upper(),
+                'item_uid': sanitize_input(row_dict.get('Item UID')) or '',
+                'variant_sku': (sanitize_input(row_dict.get('Variant SKU Suffix')) or '').upper(),
+                'status': sanitize_input(row_dict.get('Status')) or 'available',
+                'batch_number': sanitize_input(row_dict.get('Batch Number')),
+                'notes': sanitize_input(row_dict.get('Notes')), # Basic strip, no HTML allowed by default
+            }))
+        # Every lookup of the chunk is done up front, so rows cost no per-row queries.
+        lookup.preload({fields['product_code'] for _, _, fields in parsed_rows if fields['product_code']})
+        existing_items_by_uid = _load_items_by_uid({fields['item_uid'] for _, _, fields in parsed_rows if fields['item_uid']})
+        new_item_rows = {} # item_uid -> column values, bulk inserted after the loop
+        taken_uids = set(existing_items_by_uid) # Kept up to date with new_item_rows, so generating a UID is O(1)
+        generated_uids = set()
+
+        for row_num, row_dict, fields in parsed_rows:
+            product_code = fields['product_code']
+            item_uid_csv = fields['item_uid']
+            variant_sku_csv = fields['variant_sku']
+            status_str = fields['status']
+            batch_number_csv = fields['batch_number']
+            notes_csv = fields['notes']
+
+            # Validate status enum
+            try:
+                status_enum = SerializedInventoryItemStatusEnum(status_str.lower())
+            except ValueError:
+                failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f"Invalid status value: '{status_str}'."})
+                continue
+
+            if not product_code and not item_uid_csv: # Must have at least one to identify or create
+                failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Product Code or Item UID is required.'})
+                continue
+
+            product = None # (id, product_code)
+            if product_code:
+                product = lookup.products_by_code.get(product_code)
+                if not product:
+                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Product Code {product_code} not found.'})
+                    continue
+
+            variant_id_db = None
+            if product and variant_sku_csv: # Only look for variant if product exists
+                variant_id_db = lookup.variant_ids.get(product[0], {}).get(variant_sku_csv)
+                if variant_id_db is None:
+                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Variant SKU {variant_sku_csv} not found for product {product_code}.'})
+                    continue
+
+            # Parse dates and numbers carefully
+            production_date_db = parse_datetime_from_iso(sanitize_input(row_dict.get('Production Date')))
+            expiry_date_db = parse_datetime_from_iso(sanitize_input(row_dict.get('Expiry Date')))
+            cost_price_db = None
+            if row_dict.get('Cost Price'):
+                try: cost_price_db = float(sanitize_input(row_dict.get('Cost Price')))
+                except ValueError: failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Invalid Cost Price format.'}); continue
+            actual_weight_db = None
+            if row_dict.get('Actual Weight (g)'):
+                try: actual_weight_db = float(sanitize_input(row_dict.get('Actual Weight (g)')))
+                except ValueError: failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Invalid Actual Weight format.'}); continue
+
+            existing_item = existing_items_by_uid.get(item_uid_csv) if item_uid_csv else None
+            pending_row = new_item_rows.get(item_uid_csv) if item_uid_csv else None
+
+            if pending_row: # UID already created earlier in this chunk; apply the row to the pending insert
+                if product and pending_row['product_id'] != product[0]:
+                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Item UID {item_uid_csv} exists but Product Code mismatch.'}); continue
+                pending_row['status'] = status_enum
+                for column, value in (('variant_id', variant_id_db), ('batch_number', batch_number_csv), ('production_date', production_date_db),
+                                      ('expiry_date', expiry_date_db), ('cost_price', cost_price_db), ('actual_weight_grams', actual_weight_db), ('notes', notes_csv)):
+                    if value is not None: pending_row[column] = value
+                updated_count += 1
+            elif existing_item:
+                if product and existing_item.product_id != product[0]: # UID exists but product code mismatch
+                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': f'Item UID {item_uid_csv} exists but Product Code mismatch.'}); continue
+
+                old_status_enum = existing_item.status
+                old_variant_id = existing_item.variant_id
+                existing_item.status = status_enum
+                if variant_id_db is not None: existing_item.variant_id = variant_id_db # Allow changing variant if needed
+                if batch_number_csv is not None: existing_item.batch_number = batch_number_csv
+                if production_date_db is not None: existing_item.production_date = production_date_db
+                if expiry_date_db is not None: existing_item.expiry_date = expiry_date_db
+                if cost_price_db is not None: existing_item.cost_price = cost_price_db
+                if actual_weight_db is not None: existing_item.actual_weight_grams = actual_weight_db
+                if notes_csv is not None: existing_item.notes = notes_csv
+                existing_item.updated_at = datetime.now(timezone.utc)
+                status_reason = f"CSV Import status {old_status_enum.value} -> {status_enum.value}"
+                if existing_item.variant_id != old_variant_id:
+                    # Moved to another variant: the jar leaves the old variant's stock (if it counted there)
+                    # and enters the new one's (if it counts now); the product total nets out.
+                    move_reason = f"CSV Import variant {old_variant_id} -> {existing_item.variant_id}; {status_reason}"
+                    if old_status_enum == SerializedInventoryItemStatusEnum.AVAILABLE:
+                        record_stock_movement(db.session, existing_item.product_id, StockMovementTypeEnum.TRANSFER_OUT,
+                                              quantity_change=-1, variant_id=old_variant_id, serialized_item_id=existing_item.id,
+                                              reason=move_reason, related_user_id=current_admin_id)
+                    if status_enum == SerializedInventoryItemStatusEnum.AVAILABLE:
+                        record_stock_movement(db.session, existing_item.product_id, StockMovementTypeEnum.TRANSFER_IN,
+                                              quantity_change=1, variant_id=existing_item.variant_id, serialized_item_id=existing_item.id,
+                                              reason=move_reason, related_user_id=current_admin_id)
+                else:
+                    availability_change = serialized_availability_change(old_status_enum, status_enum)
+                    if availability_change:
+                        record_stock_movement(db.session, existing_item.product_id, status_change_movement_type(availability_change),
+                                              quantity_change=availability_change, variant_id=existing_item.variant_id,
+                                              serialized_item_id=existing_item.id, reason=status_reason,
+                                              related_user_id=current_admin_id)
+                updated_count += 1
+            else: # New item
+                if not product: # Product code was required for new items
+                    failed_rows.append({'row': row_num, 'uid': item_uid_csv, 'error': 'Product Code required for new item.'}); continue
+
+                uid_to_insert = item_uid_csv
+                if not uid_to_insert:
+                    uid_to_insert = _generate_item_uid(product[1], taken_uids)
+                    generated_uids.add(uid_to_insert)
+                taken_uids.add(uid_to_insert)
+                new_item_rows[uid_to_insert] = {
+                    'item_uid': uid_to_insert, 'product_id': product[0], 'variant_id': variant_id_db,
+                    'status': status_enum, 'batch_number': batch_number_csv,
+                    'production_date': production_date_db, 'expiry_date': expiry_date_db,
+                    'cost_price': cost_price_db, 'actual_weight_grams': actual_weight_db,
+                    'notes': notes_csv
+                }
+                imported_count += 1
+
+        # Generated UIDs only avoid the UIDs of this chunk; re-roll the (rare) ones already in the database.
+        product_codes_by_id = {p[0]: p[1] for p in lookup.products_by_code.values() if p}
+        clashing_uids = _existing_item_uids(generated_uids)
+        while clashing_uids:
+            rerolled_uids = set()
+            for uid in clashing_uids:
+                row = new_item_rows.pop(uid)
+                row['item_uid'] = _generate_item_uid(product_codes_by_id[row['product_id']], taken_uids) # Still holds the clashing UIDs
+                new_item_rows[row['item_uid']] = row
+                rerolled_uids.add(row['item_uid'])
+            clashing_uids = _existing_item_uids(rerolled_uids)
+
+        # Batched INSERTs of the new items and their IMPORT_CSV_NEW movements (+1 only for available items)
+        bulk_insert_serialized_items(db.session, list(new_item_rows.values()), StockMovementTypeEnum.IMPORT_CSV_NEW,
+                                     reason="CSV Import", related_user_id=current_admin_id)
+
+        # Progress is committed with the chunk's data, so rows_processed is always an exact resume point.
+        job.rows_processed = rows[-1][0]
+        job.bytes_processed = bytes_processed
+        job.imported_count += imported_count
+        job.updated_count += updated_count
+        job.failed_count += len(failed_rows)
+        if failed_rows:
+            reported_failures = json.loads(job.failed_rows) if job.failed_rows else []
+            max_reported = self._config('INVENTORY_IMPORT_MAX_REPORTED_FAILURES', 1000)
+            reported_failures.extend(failed_rows[:max(0, max_reported - len(reported_failures))])
+            job.failed_rows = json.dumps(reported_failures)
+        db.session.commit()
+        current_app.logger.info(f"Import job {job.id}: {job.rows_processed} rows processed ({job.imported_count} imported, {job.updated_count} updated, {job.failed_count} failed).")
+
+
+@click.command('run-import-job')
+@click.argument('job_id', type=int)
+@with_appcontext
+def run_import_job_command(job_id):
+    """Runs or resumes an inventory import job in the foreground."""
+    import_service = current_app.inventory_import_service
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        raise click.ClickException(f'Import job {job_id} not found.')
+    if job.status == ImportJobStatusEnum.COMPLETED:
+        click.echo(f'Import job {job_id} is already completed.')
+        return
+    job = import_service.run(job_id)
+    click.echo(f'Import job {job_id} completed: {job.imported_count} imported, {job.updated_count} updated, {job.failed_count} failed.')
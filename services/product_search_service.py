@@ -0,0 +1,289 @@
+# services/product_search_service.py
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from unidecode import unidecode
+
+from .. import db
+from ..models import Category, Product, ProductLocalization
+
+SEARCH_FTS_TABLE = 'product_search_fts'
+SEARCH_FIELDS = ('name', 'product_code', 'localized_names', 'description')
+# Relevance weight per field, in SEARCH_FIELDS order: a hit in the name beats a hit in the description.
+SEARCH_FIELD_WEIGHTS = (10.0, 8.0, 6.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold_search_text(value):
+    """Lower-cases and strips accents so that 'Truffe Été' and 'truffe ete' index identically."""
+    if not value:
+        return ''
+    return unidecode(str(value)).lower()
+
+
+def tokenize_search_text(value):
+    return _TOKEN_RE.findall(fold_search_text(value))
+
+
+class ProductSearchService:
+    """
+    Full-text product search over name, description, product code and FR/EN localizations.
+    Only active products are indexed; searches apply the category/featured filters themselves, so
+    PRODUCT_SEARCH_MAX_RESULTS caps the filtered matches, not the raw ones.
+
+    On SQLite the index is an FTS5 virtual table ranked with bm25(), kept in sync by the admin
+    product routes via index_product/remove_product. On other databases (MySQL in production) an
+    in-process inverted index is built lazily per worker and tagged with the catalog version: admin
+    catalog writes bump that version (see CatalogCacheService), so every worker rebuilds its index
+    on its next search.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock() # One rebuild at a time per worker; searches keep the old index meanwhile
+        self._fts_ready = False
+        self._postings = None # token -> {product_id: weighted term frequency}
+        self._vocabulary = [] # sorted tokens, for prefix lookups
+        self._filter_values = {} # product_id -> (category slug, is_featured), for search filters
+        self._doc_count = 0
+        self._index_version = None # Catalog version the in-process index was built from
+
+    def _config(self, key, default):
+        app = self.app or current_app
+        return app.config.get(key, default)
+
+    @property
+    def uses_fts(self):
+        backend = self._config('PRODUCT_SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            return db.engine.dialect.name == 'sqlite'
+        return backend == 'fts5'
+
+    # --- Documents ---
+    def _load_documents(self, product_ids=None):
+        """Loads folded search documents for active products, in two queries regardless of count."""
+        product_query = db.session.query(Product.id, Product.name, Product.product_code, Product.description)\
+                                  .filter(Product.is_active == True)
+        loc_query = db.session.query(
+            ProductLocalization.product_id, ProductLocalization.name_fr, ProductLocalization.name_en,
+            ProductLocalization.description_fr, ProductLocalization.description_en
+        )
+        if product_ids is not None:
+            product_query = product_query.filter(Product.id.in_(product_ids))
+            loc_query = loc_query.filter(ProductLocalization.product_id.in_(product_ids))
+
+        localized_names = defaultdict(list)
+        localized_descriptions = defaultdict(list)
+        for loc in loc_query:
+            localized_names[loc.product_id].extend(v for v in (loc.name_fr, loc.name_en) if v)
+            localized_descriptions[loc.product_id].extend(v for v in (loc.description_fr, loc.description_en) if v)
+
+        documents = {}
+        for row in product_query:
+            documents[row.id] = (
+                fold_search_text(row.name),
+                fold_search_text(row.product_code),
+                fold_search_text(' '.join(localized_names[row.id])),
+                fold_search_text(' '.join([row.description or ''] + localized_descriptions[row.id])),
+            )
+        return documents
+
+    # --- SQLite FTS5 backend ---
+    def _ensure_fts_table(self):
+        if self._fts_ready:
+            return
+        exists = db.session.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_FTS_TABLE}
+        ).first()
+        if not exists:
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE {SEARCH_FTS_TABLE} USING fts5({', '.join(SEARCH_FIELDS)}, tokenize = 'unicode61')"
+            ))
+            self._fts_write(self._load_documents(), replace=False)
+            db.session.commit()
+            current_app.logger.info(f"Created and populated {SEARCH_FTS_TABLE}.")
+        self._fts_ready = True
+
+    def _fts_write(self, documents, replace=True):
+        if replace and documents:
+            db.session.execute(text(f"DELETE FROM {SEARCH_FTS_TABLE} WHERE rowid = :id"), [{'id': pid} for pid in documents])
+        if documents:
+            db.session.execute(
+                text(f"INSERT INTO {SEARCH_FTS_TABLE} (rowid, {', '.join(SEARCH_FIELDS)}) VALUES (:id, :name, :product_code, :localized_names, :description)"),
+                [dict(zip(('id',) + SEARCH_FIELDS, (pid,) + doc)) for pid, doc in documents.items()]
+            )
+
+    def _fts_search(self, tokens, limit, category_slug=None, featured=None):
+        self._ensure_fts_table()
+        # Quoted prefix terms joined by spaces: every token must match, "truf" finds "truffe".
+        match_expr = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(w) for w in SEARCH_FIELD_WEIGHTS)
+        params = {'match': match_expr, 'limit': limit}
+        conditions = [f"{SEARCH_FTS_TABLE} MATCH :match", "p.is_active = 1", "c.is_active = 1"]
+        if category_slug:
+            conditions.append("c.slug = :category_slug")
+            params['category_slug'] = category_slug
+        if featured is not None:
+            conditions.append("p.is_featured = :featured")
+            params['featured'] = 1 if featured else 0
+        rows = db.session.execute(
+            text(f"SELECT {SEARCH_FTS_TABLE}.rowid FROM {SEARCH_FTS_TABLE} "
+                 f"JOIN {Product.__tablename__} p ON p.id = {SEARCH_FTS_TABLE}.rowid "
+                 f"JOIN {Category.__tablename__} c ON c.id = p.category_id "
+                 f"WHERE {' AND '.join(conditions)} "
+                 f"ORDER BY bm25({SEARCH_FTS_TABLE}, {weights}) LIMIT :limit"),
+            params
+        )
+        return [row[0] for row in rows]
+
+    # --- In-process inverted index backend ---
+    def _ensure_memory_index(self):
+        """(Re)builds the in-process index if it is missing or older than the shared catalog version."""
+        app = self.app or current_app
+        version = app.catalog_cache.get_version() # Re-read from the database at most every CATALOG_VERSION_CHECK_SECONDS
+        if self._postings is not None and self._index_version == version:
+            return
+        with self._build_lock:
+            if self._postings is not None and self._index_version == version:
+                return # Rebuilt by another thread meanwhile
+            # Products of inactive categories are not listed, so they are left out like inactive products.
+            filter_values = {
+                row.id: (row.slug, row.is_featured) for row in
+                db.session.query(Product.id, Category.slug, Product.is_featured).join(Category, Product.category_id == Category.id)
+                .filter(Product.is_active == True, Category.is_active == True)
+            }
+            documents = {pid: doc for pid, doc in self._load_documents().items() if pid in filter_values}
+            postings = defaultdict(dict)
+            for pid, doc in documents.items():
+                for weight, field_text in zip(SEARCH_FIELD_WEIGHTS, doc):
+                    for token in _TOKEN_RE.findall(field_text):
+                        postings[token][pid] = postings[token].get(pid, 0.0) + weight
+            with self._lock:
+                self._postings = postings
+                self._vocabulary = sorted(postings)
+                self._filter_values = filter_values
+                self._doc_count = len(documents)
+                self._index_version = version
+        current_app.logger.info(f"Built in-process product search index with {len(documents)} products (catalog version {version}).")
+
+    def _memory_search(self, tokens, limit, category_slug=None, featured=None):
+        self._ensure_memory_index()
+        with self._lock:
+            doc_count = max(self._doc_count, 1)
+            vocabulary = self._vocabulary
+            scores = None
+            for query_token in tokens:
+                token_scores = {}
+                index = bisect.bisect_left(vocabulary, query_token)
+                while index < len(vocabulary) and vocabulary[index].startswith(query_token):
+                    vocab_token = vocabulary[index]
+                    index += 1
+                    postings = self._postings[vocab_token]
+                    idf = math.log(1 + doc_count / len(postings))
+                    for pid, weighted_tf in postings.items():
+                        score = weighted_tf * idf
+                        if score > token_scores.get(pid, 0.0):
+                            token_scores[pid] = score
+                if scores is None:
+                    scores = token_scores
+                else: # Every query token must match
+                    scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+                if not scores:
+                    return []
+            if category_slug or featured is not None:
+                filter_values = self._filter_values
+                scores = {
+                    pid: score for pid, score in scores.items()
+                    if (not category_slug or filter_values[pid][0] == category_slug)
+                    and (featured is None or filter_values[pid][1] == featured)
+                }
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [pid for pid, _ in ranked[:limit]]
+
+    # --- Public API ---
+    @property
+    def max_results(self):
+        return self._config('PRODUCT_SEARCH_MAX_RESULTS', 500)
+
+    def search(self, term, limit=None, category_slug=None, featured=None):
+        """
+        Returns ids of active products (in active categories) matching every token of `term`, most
+        relevant first, at most `limit` (default PRODUCT_SEARCH_MAX_RESULTS). Accents and case are
+        ignored; each token also matches as a prefix. `category_slug` and `featured` filter the
+        matches before the limit applies.
+        """
+        tokens = tokenize_search_text(term)
+        if not tokens:
+            return []
+        if limit is None:
+            limit = self.max_results
+        if self.uses_fts:
+            return self._fts_search(tokens, limit, category_slug=category_slug, featured=featured)
+        return self._memory_search(tokens, limit, category_slug=category_slug, featured=featured)
+
+    def index_product(self, product_id):
+        """
+        (Re)indexes a single product after an admin write. Errors are logged, not raised.
+        The in-process index needs nothing here: the write's catalog version bump makes every worker rebuild it.
+        """
+        if not self.uses_fts:
+            return
+        try:
+            self._ensure_fts_table()
+            db.session.execute(text(f"DELETE FROM {SEARCH_FTS_TABLE} WHERE rowid = :id"), {'id': product_id})
+            self._fts_write(self._load_documents([product_id]), replace=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Failed to update search index for product {product_id}: {e}", exc_info=True)
+
+    def remove_product(self, product_id):
+        """Drops a deleted product from the FTS index (the in-process index follows the catalog version). Errors are logged, not raised."""
+        if not self.uses_fts:
+            return
+        try:
+            self._ensure_fts_table()
+            db.session.execute(text(f"DELETE FROM {SEARCH_FTS_TABLE} WHERE rowid = :id"), {'id': product_id})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Failed to remove product {product_id} from search index: {e}", exc_info=True)
+
+    def rebuild(self):
+        """
+        Rebuilds the whole FTS index from the products table. For the in-process index, bumps the
+        catalog version instead, so that every worker rebuilds its own copy on its next search.
+        Returns the number of products.
+        """
+        if not self.uses_fts:
+            app = self.app or current_app
+            app.catalog_cache.bump_version(db.session)
+            db.session.commit()
+            return db.session.query(Product.id).filter(Product.is_active == True).count()
+        documents = self._load_documents()
+        self._ensure_fts_table()
+        db.session.execute(text(f"DELETE FROM {SEARCH_FTS_TABLE}"))
+        self._fts_write(documents, replace=False)
+        db.session.commit()
+        return len(documents)
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuilds the product full-text search index."""
+    search_service = current_app.product_search_service
+    count = search_service.rebuild()
+    if search_service.uses_fts:
+        click.echo(f'Product search index rebuilt with {count} products.')
+    else:
+        click.echo(f'Catalog version bumped; every worker rebuilds its in-process index ({count} products) on its next search.')
@@ -0,0 +1,91 @@
+# services/qr_code_service.py
+# Shared QR code encoding for inventory assets: a passport URL is encoded once into a module
+# matrix (cached by URL), which is then drawn as SVG, PNG or a ReportLab drawing for labels.
+import io
+from functools import lru_cache
+
+import qrcode
+from qrcode.constants import ERROR_CORRECT_M
+from PIL import Image
+from reportlab.graphics.shapes import Drawing, Rect
+from reportlab.lib import colors
+
+QR_CODE_FORMATS = ('svg', 'png')
+QR_QUIET_ZONE = 4 # Modules of white border required around the code by the QR specification
+QR_MATRIX_CACHE_SIZE = 4096 # URLs kept per process; an item's QR image, label and label sheet share one entry
+
+
+@lru_cache(maxsize=QR_MATRIX_CACHE_SIZE)
+def encode_qr_matrix(url):
+    """Encodes `url` (smallest fitting version, error correction M) into a tuple of rows of booleans, without border."""
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECT_M, border=0, box_size=1)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+def _dark_runs(matrix):
+    """Yields (x, y, length) for each horizontal run of dark modules, so shapes are drawn per run, not per module."""
+    for y, row in enumerate(matrix):
+        x = 0
+        width = len(row)
+        while x < width:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < width and row[x]:
+                x += 1
+            yield start, y, x - start
+
+
+class QrCodeService:
+    """Renders cached QR matrices of passport URLs in the formats the asset pipeline needs."""
+
+    @staticmethod
+    def svg(url):
+        """Compact SVG (one path of module runs, scalable without loss) of the QR code for `url`."""
+        matrix = encode_qr_matrix(url)
+        size = len(matrix) + 2 * QR_QUIET_ZONE
+        path = ''.join(f"M{x + QR_QUIET_ZONE} {y + QR_QUIET_ZONE}h{length}v1h-{length}z" for x, y, length in _dark_runs(matrix))
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{path}" fill="#000"/></svg>'
+        )
+
+    @staticmethod
+    def png_image(url, box_size=10):
+        """1-bit PIL image of the QR code for `url`, `box_size` pixels per module."""
+        matrix = encode_qr_matrix(url)
+        size = len(matrix) + 2 * QR_QUIET_ZONE
+        image = Image.new('1', (size, size), 255)
+        image.putdata([
+            0 if QR_QUIET_ZONE <= x < size - QR_QUIET_ZONE and QR_QUIET_ZONE <= y < size - QR_QUIET_ZONE
+            and matrix[y - QR_QUIET_ZONE][x - QR_QUIET_ZONE] else 255
+            for y in range(size) for x in range(size)
+        ])
+        return image.resize((size * box_size, size * box_size), Image.NEAREST)
+
+    @staticmethod
+    def render(url, image_format='svg', box_size=10):
+        """The QR code for `url` as the bytes of an SVG or PNG file."""
+        if image_format not in QR_CODE_FORMATS:
+            raise ValueError(f"Unknown QR code format '{image_format}'. Allowed: {', '.join(QR_CODE_FORMATS)}")
+        if image_format == 'svg':
+            return QrCodeService.svg(url).encode('utf-8')
+        buffer = io.BytesIO()
+        QrCodeService.png_image(url, box_size=box_size).save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    @staticmethod
+    def reportlab_drawing(url, size):
+        """ReportLab Drawing of `size` x `size` points for the QR code of `url`, for PDF labels."""
+        matrix = encode_qr_matrix(url)
+        modules = len(matrix) + 2 * QR_QUIET_ZONE
+        scale = float(size) / modules
+        drawing = Drawing(size, size)
+        for x, y, length in _dark_runs(matrix):
+            # PDF y grows upwards, matrix rows downwards
+            drawing.add(Rect((x + QR_QUIET_ZONE) * scale, (modules - QR_QUIET_ZONE - y - 1) * scale, length * scale, scale,
+                             fillColor=colors.black, strokeColor=None, strokeWidth=0))
+        return drawing
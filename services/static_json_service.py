@@ -0,0 +1,159 @@
+# services/static_json_service.py
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from .. import db
+from ..models import StaticJsonJob, StaticJsonJobStatusEnum
+from ..utils import generate_static_json_files
+
+
+class StaticJsonRegenerationService:
+    """
+    Coalescing background regeneration of the static catalog JSON files.
+
+    Admin writes call request_regeneration(), which stores a StaticJsonJob carrying the touched
+    products/categories and returns its id straight away; queued jobs are the dirty set, shared
+    by every process. A daemon thread in the requesting process wakes at most once per
+    STATIC_JSON_REGENERATION_WINDOW_SECONDS, claims every queued job (of any process) with one
+    conditional UPDATE and regenerates their union once, under the static JSON file lock, so a
+    burst of edits costs one or two regenerations and concurrent runs never interleave. With
+    STATIC_JSON_ASYNC disabled (e.g. in tests) regeneration runs inline in the calling request.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._condition = threading.Condition()
+        self._wakeup_pending = False
+        self._pending_since = None
+        self._last_run_started = 0.0
+        self._worker = None
+
+    def _config(self, key, default):
+        app = self.app or current_app
+        return app.config.get(key, default)
+
+    def request_regeneration(self, product_ids=None, category_ids=None, full_rebuild=False):
+        """
+        Queues a regeneration covering the given products/categories (or everything with full_rebuild).
+        Commits the job row in its own transaction; call it after the admin write is committed.
+
+        Returns:
+            str: job id, to be polled with get_job().
+        """
+        job = StaticJsonJob(
+            job_uid=uuid.uuid4().hex, status=StaticJsonJobStatusEnum.QUEUED, full_rebuild=full_rebuild,
+            product_ids=json.dumps(sorted({pid for pid in (product_ids or ()) if pid is not None})),
+            category_ids=json.dumps(sorted({cid for cid in (category_ids or ()) if cid is not None}))
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        if not self._config('STATIC_JSON_ASYNC', True):
+            self._run_pending() # Synchronous mode: the caller's request context is used for url_for
+            return job.job_uid
+        with self._condition:
+            self._wakeup_pending = True
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self._ensure_worker()
+            self._condition.notify()
+        return job.job_uid
+
+    def get_job(self, job_id):
+        job = StaticJsonJob.query.filter_by(job_uid=job_id).first()
+        return job.to_dict() if job else None
+
+    def _ensure_worker(self):
+        """Starts the worker thread if needed (also after a fork, where threads do not survive). Caller holds the lock."""
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._worker_loop, name='static-json-regenerator', daemon=True)
+            self._worker.start()
+
+    def _worker_loop(self):
+        app = self.app
+        while True:
+            with self._condition:
+                while True:
+                    if not self._wakeup_pending:
+                        self._condition.wait()
+                        continue
+                    window = self._config('STATIC_JSON_REGENERATION_WINDOW_SECONDS', 5)
+                    delay = max(self._pending_since, self._last_run_started + window) - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(timeout=delay)
+                self._wakeup_pending = False
+                self._pending_since = None
+                self._last_run_started = time.monotonic()
+            try:
+                # Asset URLs are built with url_for(_external=True), which needs a request context.
+                with app.test_request_context(base_url=app.config.get('BACKEND_APP_BASE_URL')):
+                    self._run_pending()
+            except Exception as e: # Never let the worker thread die
+                app.logger.error(f"Static JSON regeneration worker error: {e}", exc_info=True)
+
+    def _claim_jobs(self):
+        """
+        Claims every queued job, plus running ones whose run died (older than STATIC_JSON_JOB_LOCK_TIMEOUT_SECONDS),
+        in one conditional UPDATE: a job is claimed by exactly one run. Returns the claimed jobs.
+        """
+        now = datetime.now(timezone.utc)
+        lock_timeout = timedelta(seconds=self._config('STATIC_JSON_JOB_LOCK_TIMEOUT_SECONDS', 600))
+        claim_token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        claimed = db.session.query(StaticJsonJob).filter(or_(
+            StaticJsonJob.status == StaticJsonJobStatusEnum.QUEUED,
+            and_(StaticJsonJob.status == StaticJsonJobStatusEnum.RUNNING, StaticJsonJob.started_at < now - lock_timeout)
+        )).update({
+            StaticJsonJob.status: StaticJsonJobStatusEnum.RUNNING, StaticJsonJob.locked_by: claim_token,
+            StaticJsonJob.started_at: now
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return []
+        return StaticJsonJob.query.filter_by(locked_by=claim_token, status=StaticJsonJobStatusEnum.RUNNING).all()
+
+    def _run_pending(self):
+        jobs = self._claim_jobs()
+        if not jobs:
+            return
+        job_ids = [job.id for job in jobs]
+        full_rebuild = any(job.full_rebuild for job in jobs)
+        product_ids, category_ids = set(), set()
+        for job in jobs:
+            product_ids.update(json.loads(job.product_ids or '[]'))
+            category_ids.update(json.loads(job.category_ids or '[]'))
+
+        try:
+            if full_rebuild:
+                result = generate_static_json_files() or {}
+            elif product_ids or category_ids:
+                result = generate_static_json_files(product_ids=product_ids, category_ids=category_ids) or {}
+            else:
+                result = {}
+            errors = result.get('product_errors', []) + result.get('category_errors', [])
+            status = StaticJsonJobStatusEnum.COMPLETED
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Static JSON regeneration failed: {e}", exc_info=True)
+            errors, status = [str(e)], StaticJsonJobStatusEnum.FAILED
+        current_app.logger.info(f"Static JSON regeneration {status.value} for {len(job_ids)} coalesced request(s) (full rebuild: {full_rebuild}).")
+
+        now = datetime.now(timezone.utc)
+        db.session.query(StaticJsonJob).filter(StaticJsonJob.id.in_(job_ids)).update({
+            StaticJsonJob.status: status, StaticJsonJob.errors: json.dumps(errors),
+            StaticJsonJob.finished_at: now, StaticJsonJob.locked_by: None
+        }, synchronize_session=False)
+        retention = timedelta(days=self._config('STATIC_JSON_JOB_RETENTION_DAYS', 7))
+        db.session.query(StaticJsonJob).filter(
+            StaticJsonJob.status.in_((StaticJsonJobStatusEnum.COMPLETED, StaticJsonJobStatusEnum.FAILED)),
+            StaticJsonJob.finished_at < now - retention
+        ).delete(synchronize_session=False)
+        db.session.commit()
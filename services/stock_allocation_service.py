@@ -0,0 +1,217 @@
+# services/stock_allocation_service.py
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, insert, func, or_, exists
+
+from .. import db
+from ..database import apply_stock_counter_delta
+from ..models import (
+    Order, OrderItem, SerializedInventoryItem, StockMovement,
+    OrderStatusEnum, SerializedInventoryItemStatusEnum, StockMovementTypeEnum
+)
+from .stock_reservation_service import StockReservationService
+
+ALLOCATABLE_ORDER_STATUSES = (OrderStatusEnum.PAID, OrderStatusEnum.PROCESSING)
+MAX_CLAIM_PASSES = 3 # Re-picks after losing items to a concurrent run (only on databases without SKIP LOCKED)
+
+
+class StockAllocationService:
+    """
+    Allocates serialized items (jars) to paid order lines, first-expiry-first-out.
+
+    Work is done per product/variant with set-based statements: one locking SELECT of the
+    outstanding lines, one FEFO SELECT of candidate items, one compare-and-set UPDATE per line
+    (AVAILABLE -> ALLOCATED, linked through order_item_id), one executemany INSERT of SALE
+    movements and one counter update. Concurrent runs skip each other's locked lines and items
+    (FOR UPDATE SKIP LOCKED where supported); the status guard on the UPDATE keeps an item from
+    being allocated twice everywhere else.
+    """
+
+    @staticmethod
+    def _allocated_count():
+        return select(func.count(SerializedInventoryItem.id))\
+            .where(SerializedInventoryItem.order_item_id == OrderItem.id).scalar_subquery()
+
+    @staticmethod
+    def pending_order_ids(limit=None, after_id=None):
+        """Paid orders with at least one line not fully allocated, oldest first (keyset-paginated on id)."""
+        outstanding_line = exists().where(
+            OrderItem.order_id == Order.id, OrderItem.product_id.isnot(None),
+            OrderItem.quantity > StockAllocationService._allocated_count()
+        )
+        query = select(Order.id).where(Order.status.in_(ALLOCATABLE_ORDER_STATUSES), outstanding_line)\
+            .order_by(Order.id)
+        if after_id is not None:
+            query = query.where(Order.id > after_id)
+        if limit:
+            query = query.limit(limit)
+        return db.session.execute(query).scalars().all()
+
+    @staticmethod
+    def _lock_outstanding_lines(order_ids):
+        """
+        Locks the order lines of `order_ids` still missing items and returns them with the missing count.
+        Lines locked by a concurrent run are skipped; the count is taken after the lock, so it is current.
+        """
+        locked_ids = db.session.execute(
+            select(OrderItem.id).where(OrderItem.order_id.in_(order_ids), OrderItem.product_id.isnot(None))
+            .order_by(OrderItem.id).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not locked_ids:
+            return []
+        missing = (OrderItem.quantity - StockAllocationService._allocated_count()).label('missing')
+        return db.session.execute(
+            select(OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.variant_id, missing)
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(OrderItem.id.in_(locked_ids), missing > 0)
+            .order_by(Order.order_date, Order.id, OrderItem.id)
+        ).all()
+
+    @staticmethod
+    def _pick_candidates(product_id, variant_id, limit, now):
+        """Ids of AVAILABLE, unexpired items of a product/variant in FEFO order (undated items last)."""
+        query = select(SerializedInventoryItem.id).where(
+            SerializedInventoryItem.product_id == product_id,
+            SerializedInventoryItem.status == SerializedInventoryItemStatusEnum.AVAILABLE,
+            or_(SerializedInventoryItem.expiry_date.is_(None), SerializedInventoryItem.expiry_date > now)
+        )
+        if variant_id:
+            query = query.where(SerializedInventoryItem.variant_id == variant_id)
+        query = query.order_by(
+            SerializedInventoryItem.expiry_date.is_(None), SerializedInventoryItem.expiry_date,
+            SerializedInventoryItem.received_at, SerializedInventoryItem.id
+        ).limit(limit).with_for_update(skip_locked=True)
+        return db.session.execute(query).scalars().all()
+
+    @staticmethod
+    def _allocate_group(product_id, variant_id, lines, now):
+        """
+        Fills `lines` (same product/variant, in priority order) from FEFO candidates.
+        Returns {order_item_id: [item ids claimed]}.
+        """
+        missing = {line.id: line.missing for line in lines}
+        claimed = defaultdict(list)
+        for _ in range(MAX_CLAIM_PASSES):
+            needed = sum(missing.values())
+            if not needed:
+                break
+            candidates = StockAllocationService._pick_candidates(product_id, variant_id, needed, now)
+            if not candidates:
+                break
+            position = 0
+            for line in lines:
+                if position >= len(candidates):
+                    break
+                if not missing[line.id]:
+                    continue
+                item_ids = candidates[position:position + missing[line.id]]
+                position += len(item_ids)
+                db.session.execute(
+                    update(SerializedInventoryItem)
+                    .where(SerializedInventoryItem.id.in_(item_ids), SerializedInventoryItem.status == SerializedInventoryItemStatusEnum.AVAILABLE)
+                    .values(status=SerializedInventoryItemStatusEnum.ALLOCATED, order_item_id=line.id, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+            # Read back what this pass actually won; items taken by a concurrent run are re-picked next pass.
+            won = db.session.execute(
+                select(SerializedInventoryItem.order_item_id, SerializedInventoryItem.id)
+                .where(SerializedInventoryItem.id.in_(candidates), SerializedInventoryItem.order_item_id.in_(list(missing)),
+                       SerializedInventoryItem.status == SerializedInventoryItemStatusEnum.ALLOCATED)
+            ).all()
+            for order_item_id, item_id in won:
+                claimed[order_item_id].append(item_id)
+                missing[order_item_id] -= 1
+            if len(won) == len(candidates):
+                break # Nothing lost to a concurrent run, so a shortage here is real
+        return claimed
+
+    @staticmethod
+    def allocate_orders(order_ids):
+        """
+        Allocates items to the outstanding lines of `order_ids` (callers pass paid orders only).
+        Records one SALE movement (-1) per allocated item, applies the net counter change once per
+        product/variant and releases the matching part of the orders' stock reservations.
+        Lines that cannot be filled stay outstanding for a later run.
+        The calling function is responsible for db.session.commit(), or rollback() on error.
+
+        Returns:
+            dict: {"items_allocated": int, "lines_allocated": int, "short_lines": [...]}
+        """
+        now = datetime.now(timezone.utc)
+        lines_by_group = defaultdict(list)
+        for line in StockAllocationService._lock_outstanding_lines(order_ids) if order_ids else []:
+            lines_by_group[(line.product_id, line.variant_id)].append(line)
+
+        items_allocated = 0
+        lines_allocated = 0
+        short_lines = []
+        for (product_id, variant_id), lines in lines_by_group.items():
+            claimed = StockAllocationService._allocate_group(product_id, variant_id, lines, now)
+            movement_rows = []
+            allocated_by_order = defaultdict(int)
+            for line in lines:
+                item_ids = claimed.get(line.id, [])
+                allocated_by_order[line.order_id] += len(item_ids)
+                movement_rows.extend({
+                    'product_id': product_id, 'variant_id': variant_id, 'serialized_item_id': item_id,
+                    'movement_type': StockMovementTypeEnum.SALE, 'quantity_change': -1,
+                    'related_order_id': line.order_id, 'reason': f"FEFO allocation to order item {line.id}"
+                } for item_id in item_ids)
+                if len(item_ids) < line.missing:
+                    short_lines.append({
+                        "order_id": line.order_id, "order_item_id": line.id, "product_id": product_id,
+                        "variant_id": variant_id, "missing": line.missing - len(item_ids)
+                    })
+                elif item_ids:
+                    lines_allocated += 1
+            if not movement_rows:
+                continue
+            db.session.execute(insert(StockMovement), movement_rows)
+            # The items were counted as available stock, so the decrement cannot legitimately fail; don't let drift block fulfilment.
+            apply_stock_counter_delta(db.session, product_id, -len(movement_rows), variant_id=variant_id, allow_negative=True)
+            for order_id, quantity in allocated_by_order.items():
+                StockReservationService.consume(order_id, product_id, variant_id, quantity)
+            items_allocated += len(movement_rows)
+
+        if short_lines:
+            current_app.logger.warning(f"FEFO allocation left {len(short_lines)} order line(s) short of stock.")
+        current_app.logger.info(f"FEFO allocation: {items_allocated} item(s) allocated to {lines_allocated} order line(s).")
+        return {"items_allocated": items_allocated, "lines_allocated": lines_allocated, "short_lines": short_lines}
+
+    @staticmethod
+    def allocate_pending(batch_size=100, after_id=None):
+        """
+        Allocates the next `batch_size` paid orders with outstanding lines after order `after_id`.
+        The caller commits. The result also carries "orders" and "last_order_id" (the next cursor).
+        """
+        order_ids = StockAllocationService.pending_order_ids(limit=batch_size, after_id=after_id)
+        result = StockAllocationService.allocate_orders(order_ids)
+        result["orders"] = len(order_ids)
+        result["last_order_id"] = order_ids[-1] if order_ids else None
+        return result
+
+
+@click.command('allocate-orders')
+@click.option('--order-id', 'order_ids', multiple=True, type=int, help='Allocate these orders only (repeatable).')
+@click.option('--batch-size', default=100, show_default=True, help='Paid orders allocated per transaction.')
+@with_appcontext
+def allocate_orders_command(order_ids, batch_size):
+    """Allocates serialized items to paid orders, first-expiry-first-out."""
+    if order_ids:
+        result = StockAllocationService.allocate_orders(list(order_ids))
+        db.session.commit()
+        click.echo(f"Allocated {result['items_allocated']} item(s); {len(result['short_lines'])} line(s) short.")
+        return
+
+    after_id = None
+    while True:
+        result = StockAllocationService.allocate_pending(batch_size=batch_size, after_id=after_id)
+        db.session.commit()
+        click.echo(f"{result['orders']} order(s): allocated {result['items_allocated']} item(s); {len(result['short_lines'])} line(s) short.")
+        if result['orders'] < batch_size:
+            break
+        after_id = result['last_order_id'] # Short orders are left for the next run instead of blocking later ones
@@ -0,0 +1,192 @@
+# services/stock_reservation_service.py
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+
+from .. import db
+from ..database import InsufficientStockError
+from ..models import Product, ProductWeightOption, StockReservation
+
+
+def _adjust_reserved(model, row_id, delta, guarded):
+    """
+    Moves model.reserved_stock_quantity by `delta` in one UPDATE. With `guarded`, the UPDATE only
+    applies while on-hand stock still covers every reservation (aggregate - reserved - delta >= 0).
+    Returns True if the row was updated.
+    """
+    statement = update(model).where(model.id == row_id)
+    if guarded:
+        statement = statement.where(model.aggregate_stock_quantity - model.reserved_stock_quantity - delta >= 0)
+    statement = statement.values({model.reserved_stock_quantity: model.reserved_stock_quantity + delta})
+    return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount > 0
+
+
+class StockReservationService:
+    """
+    Holds product/variant quantities for carts between add-to-cart and payment, so limited stock
+    is not sold twice.
+
+    Each hold is a StockReservation row mirrored by the reserved_stock_quantity counters; reads
+    use available = aggregate_stock_quantity - reserved_stock_quantity. A reservation is one
+    guarded UPDATE per counter (the row lock lasts only until the caller commits) plus an
+    upsert of the hold. Expired holds are released in bulk by sweep_expired() / `flask sweep-reservations`.
+    """
+
+    @staticmethod
+    def _ttl(seconds=None, config_key='STOCK_RESERVATION_TTL_SECONDS', default=900):
+        return timedelta(seconds=seconds if seconds is not None else current_app.config.get(config_key, default))
+
+    @staticmethod
+    def _apply_delta(product_id, variant_id, delta):
+        """Applies a reservation change to the product (then variant) counters. Raises InsufficientStockError."""
+        if not delta:
+            return
+        guarded = delta > 0
+        if not _adjust_reserved(Product, product_id, delta, guarded):
+            available = db.session.execute(select(Product.aggregate_stock_quantity - Product.reserved_stock_quantity).where(Product.id == product_id)).scalar()
+            raise InsufficientStockError(product_id, None, delta, available)
+        if variant_id and not _adjust_reserved(ProductWeightOption, variant_id, delta, guarded):
+            _adjust_reserved(Product, product_id, -delta, guarded=False) # Undo the product part; no savepoint needed
+            available = db.session.execute(select(ProductWeightOption.aggregate_stock_quantity - ProductWeightOption.reserved_stock_quantity).where(ProductWeightOption.id == variant_id)).scalar()
+            raise InsufficientStockError(product_id, variant_id, delta, available)
+
+    @staticmethod
+    def reserve(cart_id, product_id, quantity, variant_id=None, cart_item_id=None, ttl_seconds=None):
+        """
+        Sets the quantity held for a cart line to `quantity` and refreshes its expiry; 0 releases it.
+        If available stock is short, expired holds on the product are swept once before giving up.
+        The calling function is responsible for db.session.commit(), or rollback() on error.
+
+        Raises:
+            InsufficientStockError: if the additional quantity is not available.
+        Returns:
+            StockReservation or None (when released).
+        """
+        line_filter = dict(cart_id=cart_id, product_id=product_id, variant_id=variant_id)
+        reservation = StockReservation.query.filter_by(**line_filter).first()
+        try:
+            StockReservationService._apply_delta(product_id, variant_id, quantity - (reservation.quantity if reservation else 0))
+        except InsufficientStockError:
+            # Holds that expired since the last sweep still count; release this product's and retry once.
+            if not StockReservationService.sweep_expired(product_ids=[product_id]):
+                raise
+            reservation = StockReservation.query.filter_by(**line_filter).first() # This line's own hold may have been swept
+            StockReservationService._apply_delta(product_id, variant_id, quantity - (reservation.quantity if reservation else 0))
+
+        if quantity <= 0:
+            if reservation:
+                db.session.delete(reservation)
+            return None
+        expires_at = datetime.now(timezone.utc) + StockReservationService._ttl(ttl_seconds)
+        if reservation is None:
+            reservation = StockReservation(cart_id=cart_id, product_id=product_id, variant_id=variant_id, quantity=quantity)
+            db.session.add(reservation)
+        reservation.quantity = quantity
+        reservation.cart_item_id = cart_item_id or reservation.cart_item_id
+        reservation.expires_at = expires_at
+        return reservation
+
+    @staticmethod
+    def release(reservations):
+        """Deletes the given holds and gives their quantities back. The caller commits."""
+        totals = defaultdict(int)
+        reservation_ids = []
+        for reservation in reservations:
+            totals[(reservation.product_id, reservation.variant_id)] += reservation.quantity
+            reservation_ids.append(reservation.id)
+        if not reservation_ids:
+            return 0
+        for (product_id, variant_id), quantity in totals.items():
+            StockReservationService._apply_delta(product_id, variant_id, -quantity)
+        db.session.query(StockReservation).filter(StockReservation.id.in_(reservation_ids)).delete(synchronize_session=False)
+        return len(reservation_ids)
+
+    @staticmethod
+    def release_cart(cart_id):
+        """Releases every hold of a cart that has not been checked out. The caller commits."""
+        return StockReservationService.release(
+            StockReservation.query.filter(StockReservation.cart_id == cart_id, StockReservation.order_id.is_(None)).all()
+        )
+
+    @staticmethod
+    def release_order(order_id):
+        """Releases the holds of an order, e.g. once its stock has been allocated or it was cancelled. The caller commits."""
+        return StockReservationService.release(StockReservation.query.filter_by(order_id=order_id).all())
+
+    @staticmethod
+    def hold_for_order(cart_id, order_id, ttl_seconds=None):
+        """
+        Moves a cart's holds to an order at checkout, with the (longer) payment window as expiry.
+        The caller commits. Returns the number of holds moved.
+        """
+        expires_at = datetime.now(timezone.utc) + StockReservationService._ttl(ttl_seconds, 'STOCK_RESERVATION_ORDER_TTL_SECONDS', 3600)
+        return db.session.query(StockReservation).filter(StockReservation.cart_id == cart_id, StockReservation.order_id.is_(None)).update({
+            StockReservation.order_id: order_id, StockReservation.cart_id: None,
+            StockReservation.cart_item_id: None, StockReservation.expires_at: expires_at
+        }, synchronize_session=False)
+
+    @staticmethod
+    def consume(order_id, product_id, variant_id, quantity):
+        """
+        Reduces an order's hold on a product/variant by `quantity` once that stock has left on-hand
+        stock (e.g. allocated at fulfilment), so it is not counted twice. The caller commits.
+        Returns the quantity actually released.
+        """
+        reservation = StockReservation.query.filter_by(order_id=order_id, product_id=product_id, variant_id=variant_id).first()
+        if reservation is None or quantity <= 0:
+            return 0
+        released = min(quantity, reservation.quantity)
+        StockReservationService._apply_delta(product_id, variant_id, -released)
+        if released == reservation.quantity:
+            db.session.delete(reservation)
+        else:
+            reservation.quantity -= released
+        return released
+
+    @staticmethod
+    def sweep_expired(product_ids=None, batch_size=1000):
+        """
+        Releases expired holds in batches: one grouped counter UPDATE per product/variant and one DELETE
+        per batch. The caller commits. Returns the number of holds released.
+        """
+        now = datetime.now(timezone.utc)
+        released = 0
+        while True:
+            query = StockReservation.query.filter(StockReservation.expires_at <= now)
+            if product_ids is not None:
+                query = query.filter(StockReservation.product_id.in_(product_ids))
+            batch = query.order_by(StockReservation.id).limit(batch_size).all()
+            if not batch:
+                return released
+            released += StockReservationService.release(batch)
+            if len(batch) < batch_size:
+                return released
+
+    @staticmethod
+    def available_quantity(product_id, variant_id=None):
+        """Stock that can still be reserved for a product (or one of its variants)."""
+        model, row_id = (ProductWeightOption, variant_id) if variant_id else (Product, product_id)
+        available = db.session.execute(
+            select(model.aggregate_stock_quantity - model.reserved_stock_quantity).where(model.id == row_id)
+        ).scalar()
+        return max(available or 0, 0)
+
+
+@click.command('sweep-reservations')
+@click.option('--loop', is_flag=True, help='Keep sweeping every --interval seconds.')
+@click.option('--interval', default=60.0, show_default=True, help='Seconds between sweeps with --loop.')
+@with_appcontext
+def sweep_reservations_command(loop, interval):
+    """Releases expired cart/order stock reservations."""
+    while True:
+        released = StockReservationService.sweep_expired()
+        db.session.commit()
+        click.echo(f'Released {released} expired stock reservation(s).')
+        if not loop:
+            break
+        time.sleep(interval)
@@ -3,6 +3,12 @@ import re
 import smtplib 
 import os
 import json
+import base64
+import gzip
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import current_app, jsonify, g, request, url_for
@@ -10,10 +16,21 @@ from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_identity
 from functools import wraps
 from unidecode import unidecode
 from datetime import datetime, timezone, timedelta
+from sqlalchemy import and_, or_, func, select
+
+try:
+    import brotli # Optional: only needed when STATIC_JSON_PRECOMPRESS includes 'br'
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl # POSIX only; elsewhere static JSON regeneration is serialized within the process only
+except ImportError:
+    fcntl = None
 
 # Import db and models for generate_static_json_files
 from . import db 
-from .models import Product, Category, ProductWeightOption, ProductImage, ProductLocalization, CategoryLocalization
+from .models import Product, Category, ProductWeightOption, ProductImage, ProductLocalization, CategoryLocalization, ProductTypeEnum
 
 # --- Sanitization Helper ---
 def sanitize_input(value, allow_html=False, max_length=None):
@@ -195,94 +212,421 @@ def format_datetime_for_storage(dt_obj=None):
     else: dt_obj = dt_obj.astimezone(timezone.utc) 
     return dt_obj.isoformat(timespec='seconds') 
 
+# --- Keyset (Cursor) Pagination Helpers ---
+def encode_cursor(sort_value, row_id):
+    """Encodes the last row's sort key and id into an opaque, URL-safe cursor string."""
+    if isinstance(sort_value, datetime):
+        payload = ['dt', sort_value.isoformat(), row_id]
+    else:
+        payload = ['v', sort_value, row_id]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        kind, sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if kind == 'dt':
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except Exception:
+        raise ValueError("Invalid pagination cursor.")
+
+def paginate_keyset(query, sort_column, id_column, cursor=None, per_page=20, descending=False, include_total=False, sort_value_getter=None):
+    """
+    Keyset pagination on (sort_column, id_column) as an alternative to query.paginate().
+    Avoids OFFSET scans and only runs COUNT(*) when include_total is True.
+    `query` must not already be ordered; `sort_column` should be non-nullable (wrap in coalesce otherwise).
+    `sort_value_getter` reads the sort value back from a result item; it defaults to the
+    attribute named like `sort_column` and is required when sorting on an expression.
+
+    Returns:
+        tuple: (items, next_cursor or None, total or None)
+    """
+    total = query.order_by(None).count() if include_total else None
+
+    if cursor:
+        last_sort_value, last_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(or_(sort_column < last_sort_value, and_(sort_column == last_sort_value, id_column < last_id)))
+        else:
+            query = query.filter(or_(sort_column > last_sort_value, and_(sort_column == last_sort_value, id_column > last_id)))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    # Fetch one extra row to know whether another page exists without counting.
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page and items:
+        last_item = items[-1]
+        sort_value = sort_value_getter(last_item) if sort_value_getter else getattr(last_item, sort_column.key)
+        next_cursor = encode_cursor(sort_value, getattr(last_item, id_column.key))
+    return items, next_cursor, total
+
+
+# --- Static Catalog JSON ---
+def _static_json_data_dir():
+    data_dir = os.path.join(current_app.root_path, 'website', 'source', 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+def _load_static_json(file_path):
+    """Returns the list stored in an existing static JSON file, or None if it is missing or unreadable."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else None
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        current_app.logger.warning(f"Could not read existing static JSON {file_path}, falling back to a full rebuild: {e}")
+        return None
+
+def _write_static_json(file_path, data):
+    """Writes through a temporary file so readers never see a half-written document."""
+    _write_file_atomic(file_path, json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8'))
+
+_static_json_thread_lock = threading.Lock()
+
+@contextmanager
+def _static_json_lock(data_dir):
+    """
+    Exclusive lock around a static JSON regeneration (read, merge, write), shared by every
+    process of the host through an flock on <data_dir>/.static_json.lock.
+    """
+    with _static_json_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(data_dir, '.static_json.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _merge_static_entries(existing_entries, refreshed_ids, new_entries):
+    """Replaces the entries whose id is in refreshed_ids with new_entries, keeping the list ordered by name."""
+    merged = [entry for entry in existing_entries if entry.get('id') not in refreshed_ids]
+    merged.extend(new_entries)
+    merged.sort(key=lambda entry: ((entry.get('name') or '').lower(), entry.get('id') or 0))
+    return merged
+
+@contextmanager
+def _timed(timings, label):
+    """Accumulates the wall time of the enclosed block into timings[label]."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[label] = timings.get(label, 0.0) + time.perf_counter() - started
+
+def _format_timings(timings):
+    return ', '.join(f"{label}={seconds * 1000:.1f}ms" for label, seconds in timings.items())
+
+def _group_by(rows, key_attr):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(getattr(row, key_attr), []).append(row)
+    return grouped
+
+def _localizations_by_lang(rows, owner_attr):
+    """Maps (owner_id, lang_code) -> localization row."""
+    return {(getattr(row, owner_attr), row.lang_code): row for row in rows}
+
+def _load_static_product_rows(product_filters, timings):
+    """
+    Loads everything the static product export needs in one query per table:
+    products, their categories, active variants, non-primary images and FR/EN localizations.
+    Related tables are filtered with a subquery on the product criteria rather than a bound
+    id list, so full rebuilds do not hit parameter limits.
+    """
+    product_id_select = select(Product.id).where(*product_filters)
+    with _timed(timings, 'products'):
+        products_models = Product.query.filter(*product_filters).order_by(Product.name).all()
+    with _timed(timings, 'categories'):
+        categories_by_id = {c.id: c for c in Category.query.filter(Category.id.in_(select(Product.category_id).where(*product_filters)))}
+    with _timed(timings, 'weight_options'):
+        options_by_product = _group_by(
+            ProductWeightOption.query.filter(ProductWeightOption.product_id.in_(product_id_select), ProductWeightOption.is_active == True)
+            .order_by(ProductWeightOption.product_id, ProductWeightOption.weight_grams).all(),
+            'product_id'
+        )
+    with _timed(timings, 'images'):
+        images_by_product = _group_by(
+            ProductImage.query.filter(ProductImage.product_id.in_(product_id_select), ProductImage.is_primary == False)
+            .order_by(ProductImage.product_id, ProductImage.id).all(),
+            'product_id'
+        )
+    with _timed(timings, 'localizations'):
+        localizations = _localizations_by_lang(
+            ProductLocalization.query.filter(ProductLocalization.product_id.in_(product_id_select), ProductLocalization.lang_code.in_(['fr', 'en'])).all(),
+            'product_id'
+        )
+    return products_models, categories_by_id, options_by_product, images_by_product, localizations
+
+def _load_static_category_rows(category_filters, timings):
+    """Loads categories, their active product counts and FR/EN localizations in one query each."""
+    category_id_select = select(Category.id).where(*category_filters)
+    with _timed(timings, 'categories'):
+        categories_models = Category.query.filter(*category_filters).order_by(Category.name).all()
+    with _timed(timings, 'product_counts'):
+        product_counts = dict(
+            db.session.query(Product.category_id, func.count(Product.id))
+            .filter(Product.is_active == True, Product.category_id.in_(category_id_select))
+            .group_by(Product.category_id).all()
+        )
+    with _timed(timings, 'localizations'):
+        localizations = _localizations_by_lang(
+            CategoryLocalization.query.filter(CategoryLocalization.category_id.in_(category_id_select), CategoryLocalization.lang_code.in_(['fr', 'en'])).all(),
+            'category_id'
+        )
+    return categories_models, product_counts, localizations
+
+def _static_product_dict(p_model, category, options_models, image_models, loc_fr, loc_en):
+    product_dict = {field: getattr(p_model, field, None) for field in PRODUCT_EXPORT_FIELDS if hasattr(p_model, field)}
+    
+    # Add related/calculated fields explicitly
+    product_dict['id'] = p_model.id # Ensure ID is always present
+    product_dict['name'] = p_model.name # Ensure name is present
+    product_dict['slug'] = p_model.slug
+    product_dict['type'] = p_model.type.value if p_model.type else None # Enums are not JSON serializable
+
+    if category:
+        product_dict['category_name'] = category.name
+        product_dict['category_slug'] = category.slug
+        product_dict['category_code'] = category.category_code
+    else:
+        product_dict['category_name'] = None
+        product_dict['category_slug'] = None
+        product_dict['category_code'] = None
+
+    if p_model.main_image_url:
+        try:
+            product_dict['main_image_full_url'] = url_for('serve_public_asset', filepath=p_model.main_image_url, _external=True)
+        except Exception as e_url:
+            current_app.logger.warning(f"Could not generate URL for product main image {p_model.main_image_url} (ID: {p_model.id}): {e_url}")
+            product_dict['main_image_full_url'] = None # Fallback
+    else:
+        product_dict['main_image_full_url'] = None
+
+    product_dict['weight_options'] = []
+    if p_model.type == ProductTypeEnum.VARIABLE_WEIGHT:
+        for opt in options_models:
+            variant_data = {v_field: getattr(opt, v_field, None) for v_field in PRODUCT_VARIANT_EXPORT_FIELDS if hasattr(opt, v_field)}
+            variant_data['option_id'] = opt.id # Ensure option_id is present
+            product_dict['weight_options'].append(variant_data)
+    
+    product_dict['additional_images'] = []
+    for img_model in image_models:
+        img_data = {img_field: getattr(img_model, img_field, None) for img_field in PRODUCT_IMAGE_EXPORT_FIELDS if hasattr(img_model, img_field)}
+        img_data['id'] = img_model.id # Ensure id is present
+        if img_model.image_url:
+            try:
+                img_data['image_full_url'] = url_for('serve_public_asset', filepath=img_model.image_url, _external=True)
+            except Exception as e_img_url:
+                current_app.logger.warning(f"Could not generate URL for additional image {img_model.image_url} (Product ID: {p_model.id}): {e_img_url}")
+                img_data['image_full_url'] = None
+        product_dict['additional_images'].append(img_data)
+    
+    # Add localized fields (example for name and description)
+    product_dict['name_fr'] = loc_fr.name_fr if loc_fr and loc_fr.name_fr else p_model.name
+    product_dict['name_en'] = loc_en.name_en if loc_en and loc_en.name_en else p_model.name
+    product_dict['description_fr'] = loc_fr.description_fr if loc_fr and loc_fr.description_fr else p_model.description
+    product_dict['description_en'] = loc_en.description_en if loc_en and loc_en.description_en else p_model.description
+    # Add other localized fields as needed, checking PRODUCT_EXPORT_FIELDS
+    return product_dict
+
+def _static_category_dict(cat_model, product_count, loc_fr_cat, loc_en_cat):
+    cat_dict = {field: getattr(cat_model, field, None) for field in CATEGORY_EXPORT_FIELDS if hasattr(cat_model, field)}
+    cat_dict['id'] = cat_model.id # Ensure ID
+    cat_dict['name'] = cat_model.name # Ensure name
+
+    if cat_model.image_url:
+        try:
+            cat_dict['image_full_url'] = url_for('serve_public_asset', filepath=cat_model.image_url, _external=True)
+        except Exception as e_url:
+            current_app.logger.warning(f"Could not generate URL for category image {cat_model.image_url} (ID: {cat_model.id}): {e_url}")
+            cat_dict['image_full_url'] = None
+    else:
+        cat_dict['image_full_url'] = None
+    
+    cat_dict['product_count'] = product_count
 
-def generate_static_json_files():
+    # Add localized fields (example for name and description)
+    cat_dict['name_fr'] = loc_fr_cat.name_fr if loc_fr_cat and loc_fr_cat.name_fr else cat_model.name
+    cat_dict['name_en'] = loc_en_cat.name_en if loc_en_cat and loc_en_cat.name_en else cat_model.name
+    cat_dict['description_fr'] = loc_fr_cat.description_fr if loc_fr_cat and loc_fr_cat.description_fr else cat_model.description
+    cat_dict['description_en'] = loc_en_cat.description_en if loc_en_cat and loc_en_cat.description_en else cat_model.description
+    # Add other localized fields as needed, checking CATEGORY_EXPORT_FIELDS
+    return cat_dict
+
+STATIC_SHARD_DIRNAME = 'catalog'
+STATIC_MANIFEST_FILENAME = 'manifest.json'
+
+def _write_file_atomic(file_path, data_bytes):
+    """Writes through a uniquely named temporary file in the same directory, then renames it into place."""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data_bytes)
+    os.replace(tmp_path, file_path)
+
+def _write_static_shard(shard_dir, prefix, payload, precompress):
+    """
+    Writes a compact JSON shard named <prefix>.<content hash>.json (plus .gz/.br siblings when requested).
+    Identical content maps to the same file name, so unchanged shards are not rewritten.
+
+    Returns:
+        dict: manifest entry with the file name, hash and size.
+    """
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    content_hash = hashlib.sha256(body).hexdigest()[:16]
+    filename = f"{prefix}.{content_hash}.json"
+    file_path = os.path.join(shard_dir, filename)
+    if not os.path.exists(file_path):
+        _write_file_atomic(file_path, body)
+    if 'gzip' in precompress and not os.path.exists(f"{file_path}.gz"):
+        _write_file_atomic(f"{file_path}.gz", gzip.compress(body, compresslevel=9, mtime=0))
+    if 'br' in precompress and not os.path.exists(f"{file_path}.br"):
+        _write_file_atomic(f"{file_path}.br", brotli.compress(body))
+    return {"file": f"{STATIC_SHARD_DIRNAME}/{filename}", "hash": content_hash, "size": len(body)}
+
+def _static_precompress_formats():
+    formats = {fmt.strip().lower() for fmt in current_app.config.get('STATIC_JSON_PRECOMPRESS', '').split(',') if fmt.strip()}
+    if 'br' in formats and brotli is None:
+        current_app.logger.warning("STATIC_JSON_PRECOMPRESS includes 'br' but the brotli package is not installed; skipping .br files.")
+        formats.discard('br')
+    return formats
+
+def write_static_catalog_shards(data_dir, products_list, categories_list):
+    """
+    Writes the sharded form of the static catalog next to the monolithic files:
+    one shard with all categories, one per category with its products, one per product,
+    and a small manifest.json mapping each to its content-hashed file. Shards can therefore
+    be cached forever by URL; only manifest.json needs revalidation. Shards referenced by
+    neither the new nor the previous manifest are removed afterwards.
+    """
+    shard_dir = os.path.join(data_dir, STATIC_SHARD_DIRNAME)
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest_path = os.path.join(data_dir, STATIC_MANIFEST_FILENAME)
+    precompress = _static_precompress_formats()
+
+    products_by_category = {}
+    for product in products_list:
+        products_by_category.setdefault(product.get('category_slug'), []).append(product)
+
+    manifest = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "categories": _write_static_shard(shard_dir, 'categories', categories_list, precompress),
+        "category_products": {},
+        "products": {}
+    }
+    for category in categories_list:
+        slug = category.get('slug')
+        category_products = products_by_category.get(slug, [])
+        entry = _write_static_shard(shard_dir, f"category-{slug}", category_products, precompress)
+        entry["product_count"] = len(category_products)
+        manifest["category_products"][slug] = entry
+    for product in products_list:
+        manifest["products"][product.get('slug')] = _write_static_shard(shard_dir, f"product-{product.get('slug')}", product, precompress)
+
+    previous_manifest = None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous_manifest = json.load(f)
+    except (OSError, ValueError):
+        pass
+    _write_file_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    # Keep the previous generation so pages that loaded the old manifest can still fetch their shards.
+    referenced = set()
+    for m in (manifest, previous_manifest or {}):
+        if isinstance(m.get("categories"), dict):
+            referenced.add(os.path.basename(m["categories"].get("file", "")))
+        for section in ("category_products", "products"):
+            referenced.update(os.path.basename(e.get("file", "")) for e in (m.get(section) or {}).values())
+    removed = 0
+    for filename in os.listdir(shard_dir):
+        base_name = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+        if base_name.endswith('.json') and base_name not in referenced:
+            try:
+                os.remove(os.path.join(shard_dir, filename))
+                removed += 1
+            except OSError as e:
+                current_app.logger.warning(f"Could not remove stale catalog shard {filename}: {e}")
+    current_app.logger.info(f"Wrote static catalog manifest with {len(manifest['category_products'])} category and {len(manifest['products'])} product shards; removed {removed} stale file(s).")
+    return manifest
+
+def generate_static_json_files(product_ids=None, category_ids=None):
     """
     Generates static JSON files for products and categories.
     Implements selective field export and per-item error handling.
+
+    Without arguments both files are rebuilt from scratch. Given product_ids and/or
+    category_ids, only those entries (plus the products of those categories) are
+    re-serialized and merged into the existing files; a missing or unreadable file
+    falls back to a full rebuild. Runs under _static_json_lock, so concurrent regenerations
+    (other threads or processes) never interleave their read-merge-write.
+
+    Related rows are loaded with one query per table (see _load_static_product_rows),
+    so the number of round-trips does not depend on catalog size.
     """
     if not current_app:
         print("Cannot generate static files: Flask app context is not available.")
         return
 
-    with current_app.app_context():
-        current_app.logger.info("Starting generation of static JSON files for products and categories (SQLAlchemy version).")
+    incremental = product_ids is not None or category_ids is not None
+    product_ids = set(product_ids or ())
+    category_ids = set(category_ids or ())
+
+    with current_app.app_context(), _static_json_lock(_static_json_data_dir()):
+        current_app.logger.info(f"Starting {'incremental' if incremental else 'full'} generation of static JSON files for products and categories (SQLAlchemy version).")
+        data_dir = _static_json_data_dir()
         
         # --- Products JSON ---
         products_list = []
         product_generation_errors = []
+        product_timings = {}
+        products_file_path = os.path.join(data_dir, 'products_details.json')
         try:
-            products_models = Product.query.filter_by(is_active=True).order_by(Product.name).all()
-            for p_model in products_models:
-                try:
-                    product_dict = {field: getattr(p_model, field, None) for field in PRODUCT_EXPORT_FIELDS if hasattr(p_model, field)}
-                    
-                    # Add related/calculated fields explicitly
-                    product_dict['id'] = p_model.id # Ensure ID is always present
-                    product_dict['name'] = p_model.name # Ensure name is present
-                    product_dict['slug'] = p_model.slug
-
-                    if p_model.category:
-                        product_dict['category_name'] = p_model.category.name
-                        product_dict['category_slug'] = p_model.category.slug
-                        product_dict['category_code'] = p_model.category.category_code
-                    else:
-                        product_dict['category_name'] = None
-                        product_dict['category_slug'] = None
-                        product_dict['category_code'] = None
-
-                    if p_model.main_image_url:
-                        try:
-                            product_dict['main_image_full_url'] = url_for('serve_public_asset', filepath=p_model.main_image_url, _external=True)
-                        except Exception as e_url:
-                            current_app.logger.warning(f"Could not generate URL for product main image {p_model.main_image_url} (ID: {p_model.id}): {e_url}")
-                            product_dict['main_image_full_url'] = None # Fallback
-                    else:
-                        product_dict['main_image_full_url'] = None
-
-                    product_dict['weight_options'] = []
-                    if p_model.type == ProductTypeEnum.VARIABLE_WEIGHT: # Assuming ProductTypeEnum is defined
-                        options_models = p_model.weight_options.filter_by(is_active=True).order_by(ProductWeightOption.weight_grams).all()
-                        for opt in options_models:
-                            variant_data = {v_field: getattr(opt, v_field, None) for v_field in PRODUCT_VARIANT_EXPORT_FIELDS if hasattr(opt, v_field)}
-                            variant_data['option_id'] = opt.id # Ensure option_id is present
-                            product_dict['weight_options'].append(variant_data)
-                    
-                    product_dict['additional_images'] = []
-                    for img_model in p_model.images.filter_by(is_primary=False).order_by(ProductImage.id).all():
-                        img_data = {img_field: getattr(img_model, img_field, None) for img_field in PRODUCT_IMAGE_EXPORT_FIELDS if hasattr(img_model, img_field)}
-                        img_data['id'] = img_model.id # Ensure id is present
-                        if img_model.image_url:
-                            try:
-                                img_data['image_full_url'] = url_for('serve_public_asset', filepath=img_model.image_url, _external=True)
-                            except Exception as e_img_url:
-                                current_app.logger.warning(f"Could not generate URL for additional image {img_model.image_url} (Product ID: {p_model.id}): {e_img_url}")
-                                img_data['image_full_url'] = None
-                        product_dict['additional_images'].append(img_data)
-                    
-                    # Add localized fields (example for name and description)
-                    # This assumes ProductLocalization model and relationships are set up
-                    loc_fr = p_model.localizations.filter_by(lang_code='fr').first()
-                    loc_en = p_model.localizations.filter_by(lang_code='en').first()
-                    product_dict['name_fr'] = loc_fr.name_fr if loc_fr and loc_fr.name_fr else p_model.name
-                    product_dict['name_en'] = loc_en.name_en if loc_en and loc_en.name_en else p_model.name
-                    product_dict['description_fr'] = loc_fr.description_fr if loc_fr and loc_fr.description_fr else p_model.description
-                    product_dict['description_en'] = loc_en.description_en if loc_en and loc_en.description_en else p_model.description
-                    # Add other localized fields as needed, checking PRODUCT_EXPORT_FIELDS
-
-                    products_list.append(product_dict)
-                except Exception as e_item:
-                    error_detail = f"Failed to process product ID {p_model.id} ({p_model.name}): {str(e_item)}"
-                    current_app.logger.error(error_detail, exc_info=True)
-                    product_generation_errors.append(error_detail)
-                    continue # Skip this product and continue with others
-
-            data_dir = os.path.join(current_app.root_path, 'website', 'source', 'data')
-            os.makedirs(data_dir, exist_ok=True)
-            products_file_path = os.path.join(data_dir, 'products_details.json')
-            with open(products_file_path, 'w', encoding='utf-8') as f:
-                json.dump(products_list, f, ensure_ascii=False, indent=4)
-            current_app.logger.info(f"Successfully generated {products_file_path} with {len(products_list)} products.")
+            existing_products = _load_static_json(products_file_path) if incremental else None
+            product_filters = [Product.is_active == True]
+            if existing_products is not None:
+                if category_ids: # Products embed their category's name/slug/code
+                    product_ids.update(pid for (pid,) in db.session.query(Product.id).filter(Product.category_id.in_(list(category_ids))))
+                product_filters.append(Product.id.in_(list(product_ids)))
+            products_models, categories_by_id, options_by_product, images_by_product, localizations = \
+                _load_static_product_rows(product_filters, product_timings)
+
+            with _timed(product_timings, 'serialize'):
+                for p_model in products_models:
+                    try:
+                        products_list.append(_static_product_dict(
+                            p_model, categories_by_id.get(p_model.category_id),
+                            options_by_product.get(p_model.id, []), images_by_product.get(p_model.id, []),
+                            localizations.get((p_model.id, 'fr')), localizations.get((p_model.id, 'en'))
+                        ))
+                        category_ids.add(p_model.category_id) # Its product_count may have changed
+                    except Exception as e_item:
+                        error_detail = f"Failed to process product ID {p_model.id} ({p_model.name}): {str(e_item)}"
+                        current_app.logger.error(error_detail, exc_info=True)
+                        product_generation_errors.append(error_detail)
+                        continue # Skip this product and continue with others
+
+                if existing_products is not None:
+                    # Refreshed ids that are no longer returned (deleted/deactivated) drop out of the merged list.
+                    products_list = _merge_static_entries(existing_products, product_ids, products_list)
+            with _timed(product_timings, 'write'):
+                _write_static_json(products_file_path, products_list)
+            current_app.logger.info(f"Successfully generated {products_file_path} with {len(products_list)} products. Timings: {_format_timings(product_timings)}")
             if product_generation_errors:
                 current_app.logger.warning(f"Encountered {len(product_generation_errors)} errors during product JSON generation. See logs for details.")
 
@@ -294,46 +638,33 @@ def generate_static_json_files():
         # --- Categories JSON ---
         categories_list = []
         category_generation_errors = []
+        category_timings = {}
+        categories_file_path = os.path.join(data_dir, 'categories_details.json')
         try:
-            categories_models = Category.query.filter_by(is_active=True).order_by(Category.name).all()
-            for cat_model in categories_models:
-                try:
-                    cat_dict = {field: getattr(cat_model, field, None) for field in CATEGORY_EXPORT_FIELDS if hasattr(cat_model, field)}
-                    cat_dict['id'] = cat_model.id # Ensure ID
-                    cat_dict['name'] = cat_model.name # Ensure name
-
-                    if cat_model.image_url:
-                        try:
-                            cat_dict['image_full_url'] = url_for('serve_public_asset', filepath=cat_model.image_url, _external=True)
-                        except Exception as e_url:
-                            current_app.logger.warning(f"Could not generate URL for category image {cat_model.image_url} (ID: {cat_model.id}): {e_url}")
-                            cat_dict['image_full_url'] = None
-                    else:
-                        cat_dict['image_full_url'] = None
-                    
-                    cat_dict['product_count'] = cat_model.products.filter_by(is_active=True).count()
-
-                    # Add localized fields (example for name and description)
-                    loc_fr_cat = cat_model.localizations.filter_by(lang_code='fr').first()
-                    loc_en_cat = cat_model.localizations.filter_by(lang_code='en').first()
-                    cat_dict['name_fr'] = loc_fr_cat.name_fr if loc_fr_cat and loc_fr_cat.name_fr else cat_model.name
-                    cat_dict['name_en'] = loc_en_cat.name_en if loc_en_cat and loc_en_cat.name_en else cat_model.name
-                    cat_dict['description_fr'] = loc_fr_cat.description_fr if loc_fr_cat and loc_fr_cat.description_fr else cat_model.description
-                    cat_dict['description_en'] = loc_en_cat.description_en if loc_en_cat and loc_en_cat.description_en else cat_model.description
-                    # Add other localized fields as needed, checking CATEGORY_EXPORT_FIELDS
-
-                    categories_list.append(cat_dict)
-                except Exception as e_item_cat:
-                    error_detail = f"Failed to process category ID {cat_model.id} ({cat_model.name}): {str(e_item_cat)}"
-                    current_app.logger.error(error_detail, exc_info=True)
-                    category_generation_errors.append(error_detail)
-                    continue # Skip this category
-
-            # data_dir already created or checked above
-            categories_file_path = os.path.join(data_dir, 'categories_details.json')
-            with open(categories_file_path, 'w', encoding='utf-8') as f:
-                json.dump(categories_list, f, ensure_ascii=False, indent=4)
-            current_app.logger.info(f"Successfully generated {categories_file_path} with {len(categories_list)} categories.")
+            existing_categories = _load_static_json(categories_file_path) if incremental else None
+            category_filters = [Category.is_active == True]
+            if existing_categories is not None:
+                category_filters.append(Category.id.in_(list(category_ids)))
+            categories_models, product_counts, cat_localizations = _load_static_category_rows(category_filters, category_timings)
+
+            with _timed(category_timings, 'serialize'):
+                for cat_model in categories_models:
+                    try:
+                        categories_list.append(_static_category_dict(
+                            cat_model, product_counts.get(cat_model.id, 0),
+                            cat_localizations.get((cat_model.id, 'fr')), cat_localizations.get((cat_model.id, 'en'))
+                        ))
+                    except Exception as e_item_cat:
+                        error_detail = f"Failed to process category ID {cat_model.id} ({cat_model.name}): {str(e_item_cat)}"
+                        current_app.logger.error(error_detail, exc_info=True)
+                        category_generation_errors.append(error_detail)
+                        continue # Skip this category
+
+                if existing_categories is not None:
+                    categories_list = _merge_static_entries(existing_categories, category_ids, categories_list)
+            with _timed(category_timings, 'write'):
+                _write_static_json(categories_file_path, categories_list)
+            current_app.logger.info(f"Successfully generated {categories_file_path} with {len(categories_list)} categories. Timings: {_format_timings(category_timings)}")
             if category_generation_errors:
                 current_app.logger.warning(f"Encountered {len(category_generation_errors)} errors during category JSON generation. See logs for details.")
 
@@ -341,7 +672,19 @@ def generate_static_json_files():
             current_app.logger.error(f"Critical error during categories_details.json generation: {e_global_cat}", exc_info=True)
             category_generation_errors.append(f"Global error in category generation: {str(e_global_cat)}")
         
+        # --- Sharded catalog + manifest (optional output mode) ---
+        if current_app.config.get('STATIC_JSON_SHARDED', False):
+            if any(e.startswith('Global error') for e in product_generation_errors + category_generation_errors):
+                current_app.logger.warning("Skipping static catalog shards because a full JSON file could not be generated.")
+            else:
+                try:
+                    write_static_catalog_shards(data_dir, products_list, categories_list)
+                except Exception as e_shards:
+                    current_app.logger.error(f"Critical error during static catalog shard generation: {e_shards}", exc_info=True)
+                    category_generation_errors.append(f"Global error in shard generation: {str(e_shards)}")
+
         # Return status or list of errors if needed by caller
         return {
             "product_errors": product_generation_errors,
-            "categor
+            "category_errors": category_generation_errors
+        }